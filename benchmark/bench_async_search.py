@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 19:20
+# @Author  : floatsliang
+# @File    : bench_async_search.py
+import asyncio
+import time
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from timeit import default_timer
+
+from sqlorm4es import BaseModel, Integer, Text
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """
+    stand-in of elasticsearch _search api, answers after 20ms
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    res = b'{"took":20,"hits":{"total":1,"hits":[{"_id":"1","_source":{"lineno":1,"message":"ok"}}]}}'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(0.02)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.res)))
+        self.end_headers()
+        self.wfile.write(self.res)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    lineno = Integer(required=True)
+    message = Text()
+
+
+def build_sql(port, i):
+    return LogCenter.select(LogCenter.message) \
+        .where((LogCenter.lineno > i) & (LogCenter.message == 'error')) \
+        .database({'hosts': ['127.0.0.1:{}'.format(port)], 'maxsize': 200}) \
+        .limit(10)
+
+
+def bench_sync(port, count):
+    start = default_timer()
+    for i in range(count):
+        build_sql(port, i).execute()
+    return count / (default_timer() - start)
+
+
+def bench_async(port, count):
+    async def run():
+        await asyncio.gather(*[build_sql(port, i).execute_async() for i in range(count)])
+
+    start = default_timer()
+    asyncio.run(run())
+    return count / (default_timer() - start)
+
+
+if __name__ == '__main__':
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SearchHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    print('sync execute: {:.0f} searches/s'.format(bench_sync(server.server_port, 200)))
+    print('execute_async, 1000 in flight: {:.0f} searches/s'.format(bench_async(server.server_port, 1000)))
+    server.shutdown()
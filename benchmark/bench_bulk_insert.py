@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 15:30
+# @Author  : floatsliang
+# @File    : bench_bulk_insert.py
+import time
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from timeit import default_timer
+
+from sqlorm4es import BaseModel, Boolean, Integer, Text, Date
+
+
+class BulkHandler(BaseHTTPRequestHandler):
+    """
+    stand-in of elasticsearch _bulk api, answers every action with status 201 after latency seconds
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0
+    item = b'{"index":{"_index":"lala","_type":"_doc","_id":"1","result":"created","status":201}}'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        actions = body.count(b'\n') // 2
+        if self.latency:
+            time.sleep(self.latency)
+        res = b'{"took":1,"errors":false,"items":[' + b','.join([self.item] * actions) + b']}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(res)))
+        self.end_headers()
+        self.wfile.write(res)
+
+    def log_message(self, *args):
+        pass
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+    __doc_type__ = '_doc'
+
+    ok = Boolean(default=True)
+    lineno = Integer(required=True)
+    message = Text(default='xixi')
+    timestamp = Date(timezone="+8")
+
+
+def rows(count):
+    for i in range(count):
+        yield {'lineno': i, 'message': 'log line {} '.format(i) * 4, 'timestamp': 1571000000000 + i}
+
+
+def bench(port, count, chunk_size):
+    start = default_timer()
+    res = LogCenter.insert(rows(count)) \
+        .database({'hosts': ['127.0.0.1:{}'.format(port)]}) \
+        .chunk(size=chunk_size) \
+        .execute()
+    elapsed = default_timer() - start
+    assert res['success'] == count
+    return count / elapsed
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BulkHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    for chunk_size in (100, 500, 2000):
+        print('chunk size {}: {:.0f} docs/s'.format(chunk_size, bench(server.server_port, 50000, chunk_size)))
+    server.shutdown()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 19:40
+# @Author  : floatsliang
+# @File    : bench_client_binding.py
+from timeit import default_timer
+
+from sqlorm4es import BaseModel, Integer, Text, SelectSQL
+from sqlorm4es.epool import POOL
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+    __database__ = {
+        'hosts': ['127.0.0.1:9201', '127.0.0.1:9202'],
+        'maxsize': 50,
+        'timeout': 30,
+        'es_version': 7.10,
+    }
+
+    lineno = Integer(required=True)
+    message = Text(default='xixi')
+
+
+RESPONSE = {'took': 1, 'hits': {'total': 1, 'hits': [{'_id': '1', '_source': {'lineno': 1}}]}}
+
+
+def pool_lease(sql):
+    """
+    SQL._lease before binding: pool key built from config of every query
+    """
+    return POOL.lease(**(sql._database or {}))
+
+
+def bench_execute(rounds):
+    sqls = [LogCenter.select().where(LogCenter.lineno > i % 100) for i in range(rounds)]
+    start = default_timer()
+    for sql in sqls:
+        sql.execute()
+    return (default_timer() - start) / rounds * 1e6
+
+
+if __name__ == '__main__':
+    rounds = 100000
+    # cluster answers at once, so only client side work of execute() is timed
+    with LogCenter._meta.client.lease() as conn:
+        conn.transport.perform_request = lambda *args, **kwargs: RESPONSE
+    bench_execute(1000)
+    bound = bench_execute(rounds)
+    lease = SelectSQL._lease
+    SelectSQL._lease = pool_lease
+    per_query = bench_execute(rounds)
+    SelectSQL._lease = lease
+    print('execute() leasing POOL.lease(**database): {:.2f} us'.format(per_query))
+    print('execute() leasing bound client handle:    {:.2f} us'.format(bound))
+    print('saved per execute: {:.2f} us, pool stats: {}'.format(per_query - bound, POOL.stats()))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 23:50
+# @Author  : floatsliang
+# @File    : bench_columnar.py
+import tracemalloc
+from timeit import default_timer
+
+import numpy as np
+
+from sqlorm4es.columnar import ColumnBuilder, flatten_buckets, to_arrays
+from sqlorm4es.field import Integer, Float, Boolean, Date, Text
+from sqlorm4es.model import BaseModel
+from sqlorm4es.utils import SearchResult, json_dumps, json_loads
+
+FIELDS = ['lineno', 'cost', 'ok', 'timestamp', 'message']
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    lineno = Integer()
+    cost = Float()
+    ok = Boolean()
+    timestamp = Date()
+    message = Text()
+
+
+def make_pages(count, page_size):
+    pages = []
+    for start in range(0, count, page_size):
+        pages.append(json_dumps({'hits': {'total': count, 'hits': [
+            {'_index': 'lala', '_id': str(i), '_source': {
+                'lineno': i, 'cost': i / 3, 'ok': bool(i % 2), 'timestamp': 1792281600000 + i * 1000,
+                'message': 'message {}'.format(i)}}
+            for i in range(start, min(start + page_size, count))]}}))
+    return pages
+
+
+def list_of_dicts(pages):
+    """
+    documents of every page concatenated into lists, converted to arrays at the end
+    """
+    docs = []
+    for body in pages:
+        docs.extend(SearchResult(json_loads(body))['data'])
+    return {
+        'lineno': np.array([doc.get('lineno') for doc in docs], dtype=np.int64),
+        'cost': np.array([doc.get('cost') for doc in docs], dtype=np.float64),
+        'ok': np.array([doc.get('ok') for doc in docs], dtype=np.bool_),
+        'timestamp': np.array([doc.get('timestamp') for doc in docs], dtype='datetime64[ms]'),
+        'message': np.array([doc.get('message') for doc in docs], dtype=object),
+    }
+
+
+def columnar(pages):
+    builder = None
+    for body in pages:
+        res = json_loads(body)
+        if builder is None:
+            builder = ColumnBuilder(FIELDS, LogCenter, capacity=res['hits']['total'])
+        builder.add_hits(res['hits']['hits'])
+    return builder.result()
+
+
+def bench(func, pages, rounds):
+    start = default_timer()
+    for _ in range(rounds):
+        func(pages)
+    elapsed = (default_timer() - start) / rounds * 1e3
+    tracemalloc.start()
+    func(pages)
+    peak = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def make_aggs(outer, inner):
+    return {'group_by_host': {'buckets': [
+        {'key': 'host-{}'.format(i), 'doc_count': inner * 3, 'group_by_lineno': {'buckets': [
+            {'key': j, 'doc_count': 3, 'max_cost': {'value': j / 3}, 'avg_cost': {'value': j / 7}}
+            for j in range(inner)]}}
+        for i in range(outer)]}}
+
+
+def walk_rows(node, path=(), rows=None):
+    """
+    recursive walk callers wrote before flatten_buckets: one dict per leaf bucket
+    """
+    rows = [] if rows is None else rows
+    for name, value in node.items():
+        if name.startswith('group_by_') and 'buckets' in value:
+            for bucket in value['buckets']:
+                walk_rows(bucket, path + ((name[9:], bucket['key']),), rows)
+            return rows
+    row = dict(path)
+    row['doc_count'] = node.get('doc_count')
+    for name, value in node.items():
+        if isinstance(value, dict) and 'value' in value:
+            row[name] = value['value']
+    rows.append(row)
+    return rows
+
+
+def walked_arrays(aggs):
+    rows = walk_rows(aggs)
+    return {name: np.array([row.get(name) for row in rows]) for name in rows[0]}
+
+
+def bench_aggs(func, aggs, rounds):
+    start = default_timer()
+    for _ in range(rounds):
+        func(aggs)
+    return (default_timer() - start) / rounds * 1e3
+
+
+if __name__ == '__main__':
+    size, page_size, rounds = 100000, 1000, 5
+    pages = make_pages(size, page_size)
+    print('{} hits in pages of {}, ms (decode + columns) / peak KiB'.format(size, page_size))
+    print('list of dicts {:7.1f} ms {:8.0f} KiB'.format(*bench(list_of_dicts, pages, rounds)))
+    print('columnar      {:7.1f} ms {:8.0f} KiB'.format(*bench(columnar, pages, rounds)))
+
+    aggs = make_aggs(100, 1000)
+    print('group by buckets 100 x 1000, ms to table (lists) / numpy arrays')
+    print('recursive walk {:7.1f} ms {:7.1f} ms'.format(bench_aggs(walk_rows, aggs, rounds),
+                                                      bench_aggs(walked_arrays, aggs, rounds)))
+    print('flatten        {:7.1f} ms {:7.1f} ms'.format(bench_aggs(flatten_buckets, aggs, rounds),
+                                                      bench_aggs(lambda a: to_arrays(flatten_buckets(a)), aggs, rounds)))
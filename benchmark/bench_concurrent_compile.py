@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 11:40
+# @Author  : floatsliang
+# @File    : bench_concurrent_compile.py
+import json
+from threading import Thread
+from timeit import default_timer
+
+from sqlorm4es import BaseModel, Boolean, Integer, Text, Date, Q
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    ok = Boolean(default=True)
+    lineno = Integer(required=True)
+    message = Text(default='xixi')
+    timestamp = Date(timezone="+8")
+
+
+def build_sql(i):
+    return LogCenter.select(LogCenter.ok, LogCenter.lineno, 'max(lineno)') \
+        .where(((LogCenter.ok == bool(i % 2)) & (LogCenter.message != 'error-{}'.format(i))) |
+               (LogCenter.lineno < i) |
+               (LogCenter.lineno >> [i, i + 1, i + 2])) \
+        .group_by(LogCenter.ok) \
+        .order_by((LogCenter.lineno, 'desc')) \
+        .limit(20)
+
+
+def dumps(query):
+    return json.dumps(query, sort_keys=True)
+
+
+def worker(sqls, expected, errors):
+    for i, sql in enumerate(sqls):
+        try:
+            if dumps(sql._compiler.compile(use_cache=False)) != expected[i]:
+                errors.append(i)
+            term = Q('term', field='message', value='error-{}'.format(i))
+            if term['term']['message']['value'] != 'error-{}'.format(i):
+                errors.append(i)
+        except Exception:
+            errors.append(i)
+
+
+def bench(threads, rounds):
+    sqls = [build_sql(i) for i in range(rounds)]
+    expected = [dumps(sql._compiler.compile(use_cache=False)) for sql in sqls]
+    errors = []
+    workers = [Thread(target=worker, args=(sqls, expected, errors)) for _ in range(threads)]
+    start = default_timer()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = default_timer() - start
+    return threads * rounds / elapsed, len(errors)
+
+
+if __name__ == '__main__':
+    for threads in (1, 4, 8):
+        qps, errors = bench(threads, 2000)
+        print('{} threads: {:.0f} compiles/s, {} wrong results'.format(threads, qps, errors))
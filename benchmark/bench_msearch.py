@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 20:50
+# @Author  : floatsliang
+# @File    : bench_msearch.py
+import time
+from threading import Thread, Barrier
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from timeit import default_timer
+
+from sqlorm4es import BaseModel, Integer, Text, batch, coalesce
+from sqlorm4es.epool import POOL
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """
+    stand-in of elasticsearch _search and _msearch api, answers after 20ms
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    hit = b'{"took":20,"hits":{"total":1,"hits":[{"_id":"1","_source":{"lineno":1,"message":"ok"}}]}}'
+    requests = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        SearchHandler.requests += 1
+        time.sleep(0.02)
+        if self.path.split('?')[0].endswith('_msearch'):
+            count = len(body.strip().split(b'\n')) // 2
+            res = b'{"responses":[' + b','.join([self.hit] * count) + b']}'
+        else:
+            res = self.hit
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(res)))
+        self.end_headers()
+        self.wfile.write(res)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+DATABASE = {}
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+    __database__ = DATABASE
+
+    lineno = Integer(required=True)
+    message = Text()
+
+
+def build_sql(i):
+    return LogCenter.select(LogCenter.message).where((LogCenter.lineno > i) & (LogCenter.message == 'error'))
+
+
+def bench_serial(count):
+    start = default_timer()
+    results = [build_sql(i).execute() for i in range(1, count + 1)]
+    assert all(res['meta']['count'] == 1 for res in results)
+    return default_timer() - start
+
+
+def bench_batch(count):
+    start = default_timer()
+    with batch():
+        results = [build_sql(i).execute() for i in range(1, count + 1)]
+    assert all(res['meta']['count'] == 1 for res in results)
+    return default_timer() - start
+
+
+def bench_threads(count):
+    barrier = Barrier(count)
+    results = []
+
+    def search(i):
+        barrier.wait()
+        results.append(build_sql(i).execute())
+
+    threads = [Thread(target=search, args=(i,)) for i in range(1, count + 1)]
+    start = default_timer()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == count and all(res['meta']['count'] == 1 for res in results)
+    return default_timer() - start
+
+
+def report(name, count, run):
+    SearchHandler.requests = 0
+    elapsed = run(count)
+    print('{:<34} {:7.1f} ms, {:3d} http requests'.format(name, elapsed * 1000, SearchHandler.requests))
+
+
+if __name__ == '__main__':
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SearchHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    DATABASE.update(hosts=['127.0.0.1:{}'.format(server.server_port)], maxsize=50)
+    POOL.reload()
+    count = 40
+    report('serial execute', count, bench_serial)
+    report('batch() block', count, bench_batch)
+    report('{} threads'.format(count), count, bench_threads)
+    coalescer = coalesce(window=0.002)
+    report('{} threads, coalesce 2ms window'.format(count), count, bench_threads)
+    print('coalescer stats: {}'.format(coalescer.stats()))
+    coalesce(None)
+    server.shutdown()
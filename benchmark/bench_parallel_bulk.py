@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 16:55
+# @Author  : floatsliang
+# @File    : bench_parallel_bulk.py
+from threading import Thread
+from http.server import ThreadingHTTPServer
+from timeit import default_timer
+
+from sqlorm4es import parallel_bulk
+from bench_bulk_insert import BulkHandler, LogCenter, rows
+
+
+def bench(port, count, workers, chunk_size=500):
+    database = {'hosts': ['127.0.0.1:{}'.format(port)]}
+    start = default_timer()
+    if workers:
+        success = sum(ok for ok, _ in parallel_bulk(LogCenter, rows(count), workers=workers,
+                                                    chunk_size=chunk_size, database=database))
+    else:
+        success = LogCenter.insert(rows(count)).database(database).chunk(size=chunk_size).execute()['success']
+    elapsed = default_timer() - start
+    assert success == count
+    return count / elapsed
+
+
+if __name__ == '__main__':
+    # every _bulk request takes 20ms on the stand-in cluster
+    BulkHandler.latency = 0.02
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BulkHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    print('sequential: {:.0f} docs/s'.format(bench(server.server_port, 50000, 0)))
+    for workers in (1, 2, 4, 8):
+        print('{} workers: {:.0f} docs/s'.format(workers, bench(server.server_port, 50000, workers)))
+    server.shutdown()
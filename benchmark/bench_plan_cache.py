@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 10:12
+# @Author  : floatsliang
+# @File    : bench_plan_cache.py
+from timeit import default_timer
+
+from sqlorm4es import BaseModel, Boolean, Integer, Text, Date, QueryCompiler
+from sqlorm4es.utils import json_dumps
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    ok = Boolean(default=True)
+    lineno = Integer(required=True)
+    message = Text(default='xixi')
+    timestamp = Date(timezone="+8")
+
+
+def build_sql(i):
+    return LogCenter.select(LogCenter.ok, LogCenter.lineno, 'max(lineno)') \
+        .where(((LogCenter.ok == bool(i % 2)) & (LogCenter.message != 'error')) |
+               (LogCenter.timestamp >= '2017-10-12') |
+               (LogCenter.lineno >> [i, i + 1, i + 2])) \
+        .group_by(LogCenter.ok) \
+        .order_by((LogCenter.lineno, 'desc')) \
+        .limit(20)
+
+
+def bench(rounds, use_cache, encode=False):
+    sqls = [build_sql(i) for i in range(rounds)]
+    start = default_timer()
+    for sql in sqls:
+        query = sql._compiler.compile(use_cache=use_cache)
+        if encode:
+            json_dumps(query)
+    return (default_timer() - start) / rounds * 1e6
+
+
+def bench_bytes(rounds):
+    sqls = [build_sql(i) for i in range(rounds)]
+    start = default_timer()
+    for sql in sqls:
+        sql._compiler.compile(format='bytes')
+    return (default_timer() - start) / rounds * 1e6
+
+
+if __name__ == '__main__':
+    rounds = 20000
+    QueryCompiler.plan_cache.clear()
+    uncached = bench(rounds, False)
+    cached = bench(rounds, True)
+    print('compile without plan cache: {:.1f} us/query'.format(uncached))
+    print('compile with plan cache:    {:.1f} us/query'.format(cached))
+    print('speedup: {:.1f}x, cache stats: {}'.format(uncached / cached, QueryCompiler.plan_cache.stats()))
+    encoded = bench(rounds, True, encode=True)
+    rendered = bench_bytes(rounds)
+    print('cached compile + json encode: {:.1f} us/query'.format(encoded))
+    print('cached compile to bytes:      {:.1f} us/query'.format(rendered))
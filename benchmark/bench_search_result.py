@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 22:55
+# @Author  : floatsliang
+# @File    : bench_search_result.py
+import tracemalloc
+from copy import deepcopy
+from timeit import default_timer
+
+from sqlorm4es.utils import SearchResult, json_dumps, json_loads
+
+
+def eager_result(res):
+    """
+    SearchResult.init before lazy documents: walk every hit and write _id into its _source
+    """
+    data = []
+    for doc in res['hits']['hits']:
+        source = doc.get('_source', None)
+        if source:
+            source['_id'] = doc.get('_id', None)
+            data.append(source)
+    return {'data': data, 'meta': {'count': len(data), 'status': 200, 'error': 'ok'}}
+
+
+def lazy_result(res):
+    return SearchResult(res)
+
+
+def make_body(count):
+    return json_dumps({'took': 3, 'hits': {'total': count, 'hits': [
+        {'_index': 'lala', '_id': str(i), '_score': 1.0,
+         '_source': {'lineno': i, 'message': 'message {}'.format(i), 'ok': bool(i % 2), 'tags': ['a', 'b']}}
+        for i in range(count)]}})
+
+
+def bench(build, body, use, rounds):
+    start = default_timer()
+    for _ in range(rounds):
+        use(build(json_loads(body)))
+    elapsed = (default_timer() - start) / rounds * 1e3
+    # peak memory of one result on top of its parsed response
+    res = json_loads(body)
+    tracemalloc.start()
+    result = build(res)
+    use(result)
+    peak = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_concat(body, pages, add):
+    results = [SearchResult(json_loads(body)) for _ in range(pages)]
+    tracemalloc.start()
+    start = default_timer()
+    total = SearchResult()
+    for res in results:
+        total = add(total, res)
+    elapsed = (default_timer() - start) * 1e3
+    peak = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    assert len(total['data']) == pages * 100
+    return elapsed, peak
+
+
+def copying_add(total, res):
+    """
+    SearchResult.__add__ before shared documents: deep copy both operands
+    """
+    merged = SearchResult()
+    merged['data'] = deepcopy(list(total['data'])) + deepcopy(list(res['data']))
+    return merged
+
+
+if __name__ == '__main__':
+    size, rounds = 10000, 20
+    body = make_body(size)
+    uses = [
+        ('count only', lambda res: res['meta']['count']),
+        ('first 10 docs', lambda res: [doc['_id'] for doc in res['data'][:10]]),
+        ('all docs', lambda res: [doc['_id'] for doc in res['data']]),
+    ]
+    print('size={} hits, ms per response (decode + result) / peak KiB on top of decoded response'.format(size))
+    for name, use in uses:
+        eager = bench(eager_result, body, use, rounds)
+        lazy = bench(lazy_result, body, use, rounds)
+        print('{:<14} eager {:6.2f} ms {:8.0f} KiB   lazy {:6.2f} ms {:8.0f} KiB'.format(name, *(eager + lazy)))
+
+    page = make_body(100)
+    for pages in (20, 100):
+        copied = bench_concat(page, pages, copying_add)
+        linked = bench_concat(page, pages, lambda total, res: total + res)
+        print('sum of {:3d} pages x 100 docs: deep copy {:8.1f} ms {:8.0f} KiB   shared {:5.2f} ms {:5.0f} KiB'.format(
+            pages, *(copied + linked)))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 17:30
+# @Author  : floatsliang
+# @File    : bench_stream.py
+import time
+from contextlib import nullcontext
+from timeit import default_timer
+
+from sqlorm4es import BaseModel, Integer, SelectSQL
+from sqlorm4es.utils import SearchResult
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    lineno = Integer(required=True)
+
+
+class SlowConnection(object):
+    """
+    stand-in cluster answering every page after latency seconds
+    """
+
+    def __init__(self, total, latency):
+        self.total = total
+        self.latency = latency
+
+    def search(self, index=None, body=None, **kwargs):
+        time.sleep(self.latency)
+        start = body['search_after'][0] + 1 if 'search_after' in body else 0
+        end = min(start + body['size'], self.total)
+        return {'hits': {'total': self.total, 'hits': [
+            {'_id': str(i), '_source': {'lineno': i}, 'sort': [i]} for i in range(start, end)]}}
+
+
+def handle(doc, cost):
+    # caller work per document, eg. writing it to a file
+    end = default_timer() + cost
+    while default_timer() < end:
+        pass
+
+
+def bench(total, latency, cost, prefetch):
+    sql = LogCenter.select().order_by(('_id', 'asc')).limit(1000)
+    conn = SlowConnection(total, latency)
+    SelectSQL._lease = lambda self: nullcontext(conn)
+    start = default_timer()
+    if prefetch:
+        for doc in sql.stream(prefetch=prefetch):
+            handle(doc, cost)
+    else:
+        for res in sql._iter_pages():
+            for doc in SearchResult(res)['data']:
+                handle(doc, cost)
+    return total / (default_timer() - start)
+
+
+if __name__ == '__main__':
+    # 50ms per page on cluster, 20us per document in caller
+    for prefetch in (0, 1, 2, 4):
+        print('prefetch {}: {:.0f} docs/s'.format(prefetch, bench(100000, 0.05, 0.00002, prefetch)))
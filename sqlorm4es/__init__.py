@@ -7,7 +7,12 @@ __version__ = '1.1.5'
 
 from .model import BaseModel
 from .field import *
-from .sql import SelectSQL, InsertSQL, UpdateSQL, DeleteSQL
+from .sql import SelectSQL, PreparedSelectSQL, InsertSQL, UpdateSQL, DeleteSQL
+from .bulk import parallel_bulk
+from .msearch import batch, coalesce
+from .flight import single_flight
+from .cache import result_cache, MemoryCache, CacheBackend
 from .compiler import QueryCompiler
 from .query import *
 from .epool import DBPool
+from .aio import AsyncDBPool
@@ -0,0 +1,577 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 18:20
+# @Author  : floatsliang
+# @File    : aio.py
+import asyncio
+import base64
+import json
+from collections import namedtuple, OrderedDict
+from timeit import default_timer
+from urllib.parse import quote, urlencode, urlparse
+from weakref import WeakKeyDictionary
+
+from elasticsearch.exceptions import HTTP_EXCEPTIONS, TransportError, ConnectionError, ConnectionTimeout
+
+from .epool import BytesSerializer, DBPool, _PoolEntry, _CLIENT_OPTIONS, _DEFAULT_CONF, _DEFAULT_TIMEOUT, \
+    _DEFAULT_WAIT_TIMEOUT, _MAX_CONN
+from .utils import json_dumps
+
+try:
+    # official async client, shipped by elasticsearch[async] >= 7.8 when aiohttp is installed
+    from elasticsearch import AsyncElasticsearch
+except ImportError:
+    AsyncElasticsearch = None
+
+_DEFAULT_ASYNC_CONF = dict(_DEFAULT_CONF, maxsize=100)
+_DEFAULT_PORT = 9200
+# requests sent again on another connection when a reused keep-alive connection fails after sending them
+_IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+_READ_ONLY_ENDPOINTS = ('/_search', '/_msearch', '/_search/scroll', '/_count')
+
+_Host = namedtuple('_Host', ['host', 'port', 'ssl', 'prefix'])
+
+
+def _parse_host(host, config):
+    if isinstance(host, dict):
+        return _Host(host.get('host', 'localhost'), int(host.get('port', _DEFAULT_PORT)),
+                     bool(host.get('use_ssl', config.get('use_ssl', False))), host.get('url_prefix', ''))
+    if '://' not in host:
+        host = '{}://{}'.format('https' if config.get('use_ssl') else 'http', host)
+    url = urlparse(host)
+    return _Host(url.hostname, url.port or _DEFAULT_PORT, url.scheme == 'https', url.path.rstrip('/'))
+
+
+def _param_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return ','.join(_param_value(v) for v in value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
+
+
+def _make_url(*parts):
+    """
+    url path of request, empty parts are skipped and list parts joined by comma, eg. ('a', None, '_search')
+    -> /a/_search
+    """
+    return '/' + '/'.join(quote(_param_value(part), safe=',*') for part in parts
+                          if part is not None and part != '' and part != [] and part != ())
+
+
+def _close_stream(stream):
+    if stream is not None:
+        stream[1].close()
+
+
+def _stale(stream):
+    """
+    idle keep-alive stream closed by server
+    """
+    return stream[0].at_eof() or stream[1].is_closing()
+
+
+def _retryable(method, url):
+    """
+    request can be sent twice without being applied twice, eg. searches but not POST _bulk
+    """
+    return method in _IDEMPOTENT_METHODS or url.split('?', 1)[0].endswith(_READ_ONLY_ENDPOINTS)
+
+
+async def _read_response(reader, method):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError(u'connection closed by server')
+    status = int(status_line.split(None, 2)[1])
+    headers = {}
+    while 1:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    keep_alive = headers.get('connection', '').lower() != 'close'
+    if method == 'HEAD':
+        data = b''
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while 1:
+            size = int((await reader.readline()).split(b';', 1)[0], 16)
+            if not size:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        data = b''.join(chunks)
+    elif 'content-length' in headers:
+        data = await reader.readexactly(int(headers['content-length']))
+    else:
+        data = await reader.read()
+        keep_alive = False
+    return status, data, keep_alive
+
+
+class AsyncESConnection(object):
+    """
+    asyncio counterpart of ESConnection speaking http/1.1 over keep-alive asyncio streams,
+    at most maxsize connections are opened per host and requests are spread over hosts round robin,
+    no failover, sniffing nor compression (see AiohttpESConnection)
+    """
+    _version = 6.8
+
+    def __init__(self, config, timeout):
+        self._timeout = timeout
+        self._version = config.get('es_version', self._version)
+        hosts = config.get('hosts') or _DEFAULT_CONF['hosts']
+        if isinstance(hosts, (str, dict)):
+            hosts = [hosts]
+        self._hosts = [_parse_host(host, config) for host in hosts]
+        self._maxsize = int(config.get('maxsize', _DEFAULT_ASYNC_CONF['maxsize']))
+        self._request_timeout = config.get('timeout', _DEFAULT_CONF['timeout'])
+        self._serializer = BytesSerializer()
+        self._headers = {'connection': 'keep-alive', 'content-type': 'application/json'}
+        http_auth = config.get('http_auth')
+        if http_auth:
+            if isinstance(http_auth, (tuple, list)):
+                http_auth = ':'.join(http_auth)
+            self._headers['authorization'] = 'Basic ' + base64.b64encode(http_auth.encode('utf-8')).decode('ascii')
+        self._idle = {host: [] for host in self._hosts}
+        self._slots = None
+        self._next_host = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    def set_timeout(self, timeout):
+        self._timeout = timeout
+
+    def _request_bytes(self, host, method, url, body, headers):
+        lines = ['{} {}{} HTTP/1.1'.format(method, host.prefix, url), 'host: {}:{}'.format(host.host, host.port)]
+        for name, value in headers.items():
+            lines.append('{}: {}'.format(name, value))
+        lines.append('content-length: {}'.format(len(body) if body else 0))
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        return head + body if body else head
+
+    async def _open(self, host):
+        return await asyncio.open_connection(host.host, host.port, ssl=host.ssl or None)
+
+    @staticmethod
+    async def _send(stream, request):
+        writer = stream[1]
+        writer.write(request)
+        await writer.drain()
+
+    async def perform_request(self, method, url, params=None, body=None, headers=None):
+        params = dict(params or {})
+        ignore = params.pop('ignore', ())
+        if isinstance(ignore, int):
+            ignore = (ignore,)
+        if params:
+            url = '{}?{}'.format(url, urlencode({k: _param_value(v) for k, v in params.items()}))
+        if body is not None:
+            body = self._serializer.dumps(body)
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+        if headers:
+            headers = dict(self._headers, **headers)
+        else:
+            headers = self._headers
+        host = self._hosts[self._next_host % len(self._hosts)]
+        self._next_host += 1
+        request = self._request_bytes(host, method, url, body, headers)
+        retryable = _retryable(method, url)
+
+        if self._slots is None:
+            self._slots = {h: asyncio.Semaphore(self._maxsize) for h in self._hosts}
+        async with self._slots[host]:
+            idle = self._idle[host]
+            while 1:
+                stream = idle.pop() if idle else None
+                if stream is not None and _stale(stream):
+                    _close_stream(stream)
+                    continue
+                reused, sent = stream is not None, False
+                try:
+                    if stream is None:
+                        stream = await asyncio.wait_for(self._open(host), self._request_timeout)
+                    await asyncio.wait_for(self._send(stream, request), self._request_timeout)
+                    sent = True
+                    status, data, keep_alive = await asyncio.wait_for(
+                        _read_response(stream[0], method), self._request_timeout)
+                except asyncio.TimeoutError as ex:
+                    _close_stream(stream)
+                    raise ConnectionTimeout('TIMEOUT', str(ex), ex)
+                except (OSError, asyncio.IncompleteReadError) as ex:
+                    _close_stream(stream)
+                    if reused and (not sent or retryable):
+                        # keep-alive connection closed by server while idle, retry on another one,
+                        # a sent request which is not idempotent may have been applied already
+                        continue
+                    raise ConnectionError('N/A', str(ex), ex)
+                except BaseException:
+                    # cancelled in the middle of a request, stream state is unknown
+                    _close_stream(stream)
+                    raise
+                break
+            if keep_alive:
+                idle.append(stream)
+            else:
+                _close_stream(stream)
+
+        if 200 <= status < 300 or status in ignore:
+            return self._serializer.loads(data) if data else {}
+        error, info = data.decode('utf-8', 'replace'), None
+        try:
+            info = json.loads(error)
+            error = info.get('error', error)
+            if isinstance(error, dict) and 'type' in error:
+                error = error['type']
+        except (ValueError, TypeError, AttributeError):
+            pass
+        raise HTTP_EXCEPTIONS.get(status, TransportError)(status, error, info)
+
+    async def search(self, index=None, body=None, doc_type=None, **params):
+        return await self.perform_request('POST', _make_url(index, doc_type, '_search'), params=params, body=body)
+
+    async def bulk(self, body, index=None, doc_type=None, **params):
+        return await self.perform_request('POST', _make_url(index, doc_type, '_bulk'), params=params,
+                                          body=self._bulk_body(body),
+                                          headers={'content-type': 'application/x-ndjson'})
+
+    async def scroll(self, scroll_id, scroll=None, **params):
+        body = {'scroll_id': scroll_id}
+        if scroll:
+            body['scroll'] = scroll
+        return await self.perform_request('POST', '/_search/scroll', params=params, body=body)
+
+    async def clear_scroll(self, scroll_id, **params):
+        return await self.perform_request('DELETE', '/_search/scroll', params=params,
+                                          body={'scroll_id': [scroll_id]})
+
+    @staticmethod
+    def _bulk_body(body):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        elif not isinstance(body, (bytes, bytearray)):
+            body = b'\n'.join(line if isinstance(line, bytes) else json_dumps(line) for line in body)
+        return body if body.endswith(b'\n') else body + b'\n'
+
+    async def close(self):
+        for idle in self._idle.values():
+            while idle:
+                _close_stream(idle.pop())
+
+
+if AsyncElasticsearch is not None:
+    class AiohttpESConnection(AsyncElasticsearch):
+        """
+        AsyncESConnection on official async client (aiohttp): failover with dead host marking,
+        retry_on_status, sniffing and http_compress configured as for Elasticsearch
+        """
+        _version = 6.8
+
+        def __init__(self, config, timeout):
+            self._timeout = timeout
+            self._version = config.get('es_version', self._version)
+            config = {k: v for k, v in config.items() if k not in _CLIENT_OPTIONS}
+            config.setdefault('serializer', BytesSerializer())
+            super(AiohttpESConnection, self).__init__(**config)
+
+        @property
+        def version(self):
+            return self._version
+
+        @property
+        def timeout(self):
+            return self._timeout
+
+        def set_timeout(self, timeout):
+            self._timeout = timeout
+else:
+    AiohttpESConnection = None
+
+
+class _LoopPool(object):
+    """
+    clients of AsyncDBPool opened in one event loop
+    """
+    __slots__ = ('default', 'entries', 'cond', 'waiting', 'closing', 'next_clean',
+                 'created', 'evicted', 'waits', 'wait_time')
+
+    def __init__(self):
+        self.default = None
+        self.entries = OrderedDict()
+        # created on first wait, it belongs to the running loop
+        self.cond = None
+        self.waiting = 0
+        # close() of evicted clients, kept so they are not garbage collected before done
+        self.closing = set()
+        self.next_clean = float('inf')
+        self.created = 0
+        self.evicted = 0
+        self.waits = 0
+        self.wait_time = 0.
+
+
+class AsyncClientHandle(object):
+    """
+    async counterpart of ClientHandle, config key is computed when binding and again only after pool reload
+    """
+    __slots__ = ('_pool', '_config', '_key', '_generation')
+
+    def __init__(self, pool, config):
+        self._pool = pool
+        self._config = {} if config is None else config
+        self._key = pool._key_of(self._config)
+        self._generation = pool._generation
+
+    @property
+    def config(self):
+        return self._config
+
+    @property
+    def key(self):
+        """
+        pool key of bound config, None for default config
+        """
+        pool = self._pool
+        if self._generation != pool._generation:
+            # config may be changed in place before reload
+            self._key = pool._key_of(self._config)
+            self._generation = pool._generation
+        return self._key
+
+    def connect(self, pool_timeout=None):
+        return self._pool._connect(self._config, self.key, pool_timeout)
+
+    def lease(self, pool_timeout=None):
+        return _AsyncLease(self._pool, self._config, self.key, pool_timeout)
+
+
+class _AsyncLease(object):
+    """
+    async context manager leasing a client of AsyncDBPool, waits for a slot when pool is full of leased clients
+    """
+    __slots__ = ('_pool', '_config', '_key', '_timeout', '_loop_pool', '_entry')
+
+    def __init__(self, pool, config, key, pool_timeout):
+        self._pool = pool
+        self._config = config
+        self._key = key
+        self._timeout = pool_timeout
+        self._loop_pool = None
+        self._entry = None
+
+    async def __aenter__(self):
+        self._loop_pool, self._entry = await self._pool._acquire(self._config, self._key, self._timeout)
+        return self._entry.conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._pool._release(self._loop_pool, self._entry)
+        return False
+
+
+class AsyncDBPool(object):
+    """
+    DBPool counterpart handing out async connections, asyncio streams are bound to the event loop
+    they are opened in, so connections are pooled per event loop: at most max_conn clients are kept per loop,
+    least recently used idle client is evicted when pool is full and idle clients unused for pool_timeout
+    seconds are evicted when clean_timeout is on, lease() waits up to wait_timeout seconds when pool is full
+    of leased clients
+    :param engine: connection class, AiohttpESConnection when elasticsearch[async] is installed,
+        AsyncESConnection otherwise
+    """
+
+    def __init__(self, engine=None, clean_timeout=True,
+                 pool_timeout=_DEFAULT_TIMEOUT, max_conn=_MAX_CONN, wait_timeout=_DEFAULT_WAIT_TIMEOUT, **conf):
+        self._engine = engine or AiohttpESConnection or AsyncESConnection
+        self._conf = conf or _DEFAULT_ASYNC_CONF
+        self._key = DBPool._config_key(self._conf)
+        self._clean_timeout = clean_timeout
+        self._timeout = pool_timeout
+        self._max_conn = max(int(max_conn), 1)
+        self._wait_timeout = wait_timeout
+        self._pools = WeakKeyDictionary()
+        self._generation = 0
+
+    def _key_of(self, config):
+        """
+        pool key of config, None for default config
+        """
+        if not config:
+            return None
+        key = DBPool._config_key(config)
+        return None if key == self._key else key
+
+    def _loop_pool(self):
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            pool = self._pools[loop] = _LoopPool()
+        return pool
+
+    def _create_conn(self, config, pool_timeout):
+        return self._engine(config, default_timer() + (pool_timeout or self._timeout))
+
+    @staticmethod
+    def _close_later(pool, conn):
+        task = asyncio.ensure_future(conn.close())
+        pool.closing.add(task)
+        task.add_done_callback(pool.closing.discard)
+
+    def _evict(self, pool, key):
+        entry = pool.entries.pop(key)
+        entry.pooled = False
+        pool.evicted += 1
+        AsyncDBPool._close_later(pool, entry.conn)
+
+    def _clean(self, pool, now):
+        """
+        evict idle clients when the least recently used one may have timed out
+        """
+        if not self._clean_timeout or now < pool.next_clean:
+            return
+        for key, entry in list(pool.entries.items()):
+            if now - entry.last_used < self._timeout:
+                break
+            if not entry.leases:
+                self._evict(pool, key)
+        oldest = next((entry for entry in pool.entries.values() if not entry.leases), None)
+        pool.next_clean = float('inf') if oldest is None else oldest.last_used + self._timeout
+
+    def _evict_lru(self, pool):
+        for key, entry in pool.entries.items():
+            if not entry.leases:
+                self._evict(pool, key)
+                return True
+        return False
+
+    def _checkout(self, pool, config, key, pool_timeout, lease):
+        """
+        client entry of key in pool of running loop, None when pool is full of leased clients
+        """
+        if key is None:
+            if pool.default is None:
+                pool.default = _PoolEntry(None, self._create_conn(self._conf, pool_timeout), None)
+            return pool.default
+        now = default_timer()
+        self._clean(pool, now)
+        entry = pool.entries.get(key)
+        if entry is None:
+            if len(pool.entries) >= self._max_conn and not self._evict_lru(pool):
+                return None
+            entry = pool.entries[key] = _PoolEntry(key, self._create_conn(config, pool_timeout), None)
+            pool.next_clean = min(pool.next_clean, now + self._timeout)
+            pool.created += 1
+        else:
+            pool.entries.move_to_end(key)
+        entry.last_used = now
+        if lease:
+            entry.leases += 1
+        return entry
+
+    def _connect(self, config, key, pool_timeout):
+        entry = self._checkout(self._loop_pool(), config, key, pool_timeout, False)
+        if entry is None:
+            raise Exception(u'ERROR: no idle connection in pool, lease() waits for one')
+        return entry.conn
+
+    async def _acquire(self, config, key, pool_timeout):
+        pool = self._loop_pool()
+        entry = self._checkout(pool, config, key, pool_timeout, True)
+        if entry is not None:
+            return pool, entry
+        if pool.cond is None:
+            pool.cond = asyncio.Condition()
+        start = default_timer()
+        pool.waiting += 1
+        try:
+            async with pool.cond:
+                entry = await asyncio.wait_for(
+                    pool.cond.wait_for(lambda: self._checkout(pool, config, key, pool_timeout, True)),
+                    self._wait_timeout)
+        except asyncio.TimeoutError:
+            raise Exception(u'ERROR: no idle connection in pool after waiting {}s'.format(self._wait_timeout))
+        finally:
+            pool.waiting -= 1
+            pool.waits += 1
+            pool.wait_time += default_timer() - start
+        return pool, entry
+
+    async def _release(self, pool, entry):
+        if entry.key is None:
+            return
+        entry.leases -= 1
+        entry.last_used = default_timer()
+        if entry.pooled:
+            pool.entries.move_to_end(entry.key)
+        if not entry.leases:
+            pool.next_clean = min(pool.next_clean, entry.last_used + self._timeout)
+            if pool.waiting:
+                async with pool.cond:
+                    pool.cond.notify_all()
+
+    def connect(self, pool_timeout=None, **config):
+        """
+        client for config in running event loop, hold a lease() instead to use it for a long time
+        """
+        return self._connect(config, self._key_of(config), pool_timeout)
+
+    def lease(self, pool_timeout=None, **config):
+        """
+        async context manager of client for config which is not evicted until lease ends
+        """
+        return _AsyncLease(self, config, self._key_of(config), pool_timeout)
+
+    def bind(self, config):
+        """
+        handle resolving pool key of config once, see AsyncClientHandle
+        """
+        return AsyncClientHandle(self, config)
+
+    def stats(self):
+        pools = list(self._pools.values())
+        active = sum(1 for pool in pools for entry in pool.entries.values() if entry.leases)
+        return {
+            'active': active,
+            'idle': sum(len(pool.entries) for pool in pools) - active,
+            'loops': len(pools),
+            'max_conn': self._max_conn,
+            'created': sum(pool.created for pool in pools),
+            'evicted': sum(pool.evicted for pool in pools),
+            'waits': sum(pool.waits for pool in pools),
+            'wait_time': sum(pool.wait_time for pool in pools),
+        }
+
+    def reload(self):
+        """
+        make every bound handle compute key of its config again on next use, clients of stale keys are
+        evicted as least recently used ones
+        """
+        self._generation += 1
+
+    async def close(self):
+        """
+        close all clients of running event loop
+        """
+        pool = self._pools.pop(asyncio.get_running_loop(), None)
+        if pool is None:
+            return
+        conns = [entry.conn for entry in pool.entries.values()]
+        if pool.default is not None:
+            conns.append(pool.default.conn)
+        for conn in conns:
+            await conn.close()
+        if pool.closing:
+            await asyncio.gather(*pool.closing)
+
+
+AIO_POOL = AsyncDBPool()
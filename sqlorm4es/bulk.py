@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 16:10
+# @Author  : floatsliang
+# @File    : bulk.py
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+
+from .sql import InsertSQL, _BULK_CHUNK_SIZE
+
+_POLL_INTERVAL = 0.1
+_DONE = object()
+
+
+class _Failure(object):
+    __slots__ = ('exc',)
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _put(q, obj, stop):
+    while not stop.is_set():
+        try:
+            q.put(obj, timeout=_POLL_INTERVAL)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _feed(sql, tasks, results, workers, stop):
+    try:
+        for chunk in sql._chunks():
+            if not _put(tasks, chunk, stop):
+                return
+    except Exception as ex:
+        _put(results, _Failure(ex), stop)
+    finally:
+        for _ in range(workers):
+            _put(tasks, _DONE, stop)
+
+
+def _work(sql, tasks, results, stop):
+    try:
+        while not stop.is_set():
+            try:
+                chunk = tasks.get(timeout=_POLL_INTERVAL)
+            except Empty:
+                continue
+            if chunk is _DONE:
+                break
+            body, items = chunk
+            if body is None:
+                res = sql._send_chunk(None, body, items)
+            else:
+                with sql._lease() as conn:
+                    res = sql._send_chunk(conn, body, items)
+            _put(results, res, stop)
+    except Exception as ex:
+        _put(results, _Failure(ex), stop)
+    finally:
+        _put(results, _DONE, stop)
+
+
+def parallel_bulk(model_clazz, rows, workers: int = 4, chunk_size: int = _BULK_CHUNK_SIZE,
+                  max_chunk_bytes: int = None, queue_size: int = None, **kwargs):
+    """
+    index rows through _bulk api with a pool of worker threads, each chunk is sent over a client leased from the
+    model's bound client, so workers stay within max_conn of the pool, chunks wait in a bounded queue so memory stays flat when rows come faster than cluster indexes them
+    :param model_clazz: model to validate rows against
+    :param rows: iterable of dict or model instance, consumed lazily
+    :param workers: number of worker threads
+    :param chunk_size: max documents per _bulk request
+    :param max_chunk_bytes: max body bytes per _bulk request
+    :param queue_size: max chunks waiting for workers, 2 * workers by default
+    :param kwargs: index, database and doc_type of InsertSQL
+    :return: iterator of (ok, item) per row, rows of one chunk in order, chunks in completion order
+    """
+    workers = max(int(workers), 1)
+    queue_size = queue_size or workers * 2
+    sql = InsertSQL(model_clazz, **kwargs).values(rows).chunk(size=chunk_size, max_bytes=max_chunk_bytes)
+    tasks = Queue(maxsize=queue_size)
+    results = Queue(maxsize=queue_size)
+    stop = Event()
+    threads = [Thread(target=_feed, args=(sql, tasks, results, workers, stop), daemon=True)]
+    threads.extend(Thread(target=_work, args=(sql, tasks, results, stop), daemon=True) for _ in range(workers))
+    for t in threads:
+        t.start()
+    try:
+        running = workers
+        while running:
+            res = results.get()
+            if res is _DONE:
+                running -= 1
+            elif isinstance(res, _Failure):
+                raise res.exc
+            else:
+                for item in res:
+                    yield item
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 21:45
+# @Author  : floatsliang
+# @File    : cache.py
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from threading import Lock
+from timeit import default_timer
+
+from .utils import json_dumps, json_loads
+
+_DEFAULT_TTL = 5
+_DEFAULT_MAXSIZE = 1024
+_DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# process wide result cache, None when caching is off
+backend = None
+# bumped by every invalidation, searches sent before a write do not store their results after it
+generation = 0
+
+
+def index_matches(index, written):
+    """
+    whether search on index (maybe comma separated list or wildcard pattern) may read documents of written index,
+    written index may be a wildcard pattern too (writes of index pattern models)
+    """
+    if not index or index in ('_all', '*'):
+        return True
+    if not written:
+        return True
+    return any(fnmatchcase(written, part) or fnmatchcase(part, written)
+               for part in (part.strip() for part in str(index).split(',')))
+
+
+class CacheBackend(object):
+    """
+    interface of result cache backends, key is (client key, index, doc_type, compiled query bytes),
+    value is the raw search response, backend must hand out a copy the caller may modify
+    """
+
+    def get(self, key):
+        """
+        :return: cached response or None
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def invalidate(self, index):
+        """
+        drop entries of searches that may read documents of index, None drops all
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        self.invalidate(None)
+
+    def stats(self):
+        return {}
+
+
+class _CacheEntry(object):
+    __slots__ = ('data', 'size', 'expires')
+
+    def __init__(self, data, expires):
+        self.data = data
+        self.size = len(data)
+        self.expires = expires
+
+
+class MemoryCache(CacheBackend):
+    """
+    in-process LRU cache with time to live, bounded by entry count and total bytes of encoded responses,
+    responses are kept json encoded so every hit decodes a fresh copy
+    """
+
+    def __init__(self, ttl=_DEFAULT_TTL, maxsize=_DEFAULT_MAXSIZE, max_bytes=_DEFAULT_MAX_BYTES):
+        self._ttl = ttl
+        self._maxsize = int(maxsize)
+        self._max_bytes = int(max_bytes)
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _pop(self, key):
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry.expires <= default_timer():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            data = entry.data
+        return json_loads(data)
+
+    def set(self, key, value, ttl=None):
+        data = json_dumps(value)
+        if len(data) > self._max_bytes:
+            return
+        entry = _CacheEntry(data, default_timer() + (self._ttl if ttl is None else ttl))
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = entry
+            self._bytes += entry.size
+            while len(self._data) > self._maxsize or self._bytes > self._max_bytes:
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate(self, index):
+        with self._lock:
+            if index is None:
+                keys = list(self._data)
+            else:
+                keys = [key for key in self._data if index_matches(key[1], index)]
+            for key in keys:
+                self._pop(key)
+            self.invalidations += len(keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'bytes': self._bytes,
+                'maxsize': self._maxsize,
+                'max_bytes': self._max_bytes,
+                'ttl': self._ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+def result_cache(cache=True, **kwargs):
+    """
+    turn on caching of SelectSQL.execute() results process wide
+    :param cache: True for a MemoryCache built from kwargs (ttl, maxsize, max_bytes), a CacheBackend,
+                  or None/False to turn it off
+    :return: the backend in use, None when turned off
+    """
+    global backend
+    if cache is True:
+        cache = MemoryCache(**kwargs)
+    backend = None if cache is None or cache is False else cache
+    return backend
+
+
+def invalidate(index):
+    """
+    drop cached results that may read documents of index, called after writes through models
+    """
+    global generation
+    generation += 1
+    if backend is not None:
+        backend.invalidate(index)
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 23:30
+# @Author  : floatsliang
+# @File    : columnar.py
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from dateutil import parser as date_parser
+
+from .field import Field, Integer, Float, Boolean, Date, Object
+from .parser import resolve_field
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_MIN_CAPACITY = 1024
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# numpy dtype kinds of a page that can be stored without per value conversion, dates as epoch millis
+_FAST_KINDS = {'int': 'i', 'float': 'if', 'bool': 'b', 'date': 'i'}
+# name prefix of group by aggregations made by QueryCompiler
+_GROUP_PREFIX = 'group_by_'
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError(u'ERROR: numpy is required for columnar export, pip install numpy')
+
+
+def _model_field(model_clazz, name):
+    field = resolve_field(model_clazz, name)
+    if isinstance(field, Field):
+        return field
+    # name given as stored field name (eg. Date(name='@timestamp'))
+    for desc in (getattr(model_clazz, '_fields', None) or {}).values():
+        if desc.field.get_name() == name:
+            return desc.field
+    return None
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
+
+
+def _to_epoch_ms(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        moment = date_parser.parse(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    delta = moment - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+class _Column(object):
+    """
+    preallocated values and null mask of one field, grown by doubling when more hits come than expected
+    """
+    __slots__ = ('name', 'path', 'kind', 'values', 'mask')
+
+    def __init__(self, name, field, capacity):
+        self.name = name
+        self.path = name.split('.')
+        if isinstance(field, Object) or (isinstance(field, Field) and field.multi):
+            self.kind = 'object'
+        elif isinstance(field, Integer):
+            self.kind = 'int'
+        elif isinstance(field, Float):
+            self.kind = 'float'
+        elif isinstance(field, Boolean):
+            self.kind = 'bool'
+        elif isinstance(field, Date):
+            self.kind = 'date'
+        else:
+            self.kind = 'object'
+        dtype = {'int': np.int64, 'float': np.float64, 'bool': np.bool_, 'date': 'datetime64[ms]',
+                 'object': object}[self.kind]
+        self.values = np.zeros(capacity, dtype=dtype) if self.kind != 'object' else np.empty(capacity, dtype=object)
+        self.mask = np.zeros(capacity, dtype=np.bool_)
+
+    def grow(self, capacity):
+        self.values = np.resize(self.values, capacity)
+        self.mask = np.resize(self.mask, capacity)
+
+    def _get(self, source):
+        value = source
+        for part in self.path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return value
+
+    def fill(self, sources, start):
+        """
+        decode field of sources into rows [start, start + len(sources))
+        """
+        end = start + len(sources)
+        name = self.name
+        if len(self.path) == 1:
+            raw = [source.get(name) for source in sources]
+        else:
+            raw = [source[name] if name in source else self._get(source) for source in sources]
+        if self.kind == 'object':
+            self.values[start:end] = raw
+            self.mask[start:end] = [value is None for value in raw]
+            return
+        # page without missing, multi or string values is converted by numpy at once
+        try:
+            array = np.array(raw)
+        except (ValueError, TypeError):
+            array = None
+        if array is not None and array.ndim == 1 and array.dtype.kind in _FAST_KINDS[self.kind]:
+            self.values[start:end] = array.view('datetime64[ms]') if self.kind == 'date' else array
+            self.mask[start:end] = False
+            return
+        if self.kind != 'date':
+            # first of multi values for single valued fields
+            raw = [value[0] if isinstance(value, list) and value else value for value in raw]
+        missing = [value is None or value == [] for value in raw]
+        self.mask[start:end] = missing
+        if self.kind == 'int':
+            cleaned = [0 if miss else int(value) for value, miss in zip(raw, missing)]
+        elif self.kind == 'float':
+            cleaned = [0. if miss else float(value) for value, miss in zip(raw, missing)]
+        elif self.kind == 'bool':
+            cleaned = [False if miss else _to_bool(value) for value, miss in zip(raw, missing)]
+        else:
+            cleaned = [0 if miss else _to_epoch_ms(value[0] if isinstance(value, list) else value)
+                       for value, miss in zip(raw, missing)]
+            self.values[start:end] = np.array(cleaned, dtype=np.int64).view('datetime64[ms]')
+            return
+        self.values[start:end] = cleaned
+
+    def result(self, size):
+        return np.ma.MaskedArray(self.values[:size], mask=self.mask[:size])
+
+
+class ColumnBuilder(object):
+    """
+    decode hits page by page into preallocated column arrays, one per field, dtype from model field type:
+    Integer int64, Float float64, Boolean bool, Date datetime64[ms] (UTC), others object,
+    missing values are masked
+    """
+
+    def __init__(self, fields, model_clazz=None, capacity=0):
+        _require_numpy()
+        capacity = max(int(capacity or 0), _MIN_CAPACITY)
+        self._capacity = capacity
+        self._size = 0
+        self._with_id = False
+        self._columns = []
+        for field in fields:
+            if isinstance(field, Field):
+                name = field.get_name()
+            else:
+                name, field = field, _model_field(model_clazz, field)
+            if name == '_id':
+                self._with_id = True
+                continue
+            self._columns.append(_Column(name, field, capacity))
+        self._ids = np.empty(capacity, dtype=object) if self._with_id else None
+
+    def __len__(self):
+        return self._size
+
+    def reserve(self, capacity):
+        if capacity <= self._capacity:
+            return
+        capacity = max(capacity, self._capacity * 2)
+        for column in self._columns:
+            column.grow(capacity)
+        if self._ids is not None:
+            self._ids = np.resize(self._ids, capacity)
+        self._capacity = capacity
+
+    def add_sources(self, sources, ids=None):
+        """
+        :param sources: list of document sources (dict)
+        :param ids: list of document ids, needed when _id column is asked for
+        """
+        start = self._size
+        self.reserve(start + len(sources))
+        for column in self._columns:
+            column.fill(sources, start)
+        if self._ids is not None:
+            self._ids[start:start + len(sources)] = ids
+        self._size += len(sources)
+
+    def add_hits(self, hits):
+        hits = [hit for hit in hits if hit.get('_source')]
+        self.add_sources([hit['_source'] for hit in hits], [hit.get('_id') for hit in hits])
+
+    def result(self):
+        """
+        :return: dict of field name to numpy masked array
+        """
+        columns = {}
+        if self._ids is not None:
+            columns['_id'] = np.ma.MaskedArray(self._ids[:self._size], mask=np.zeros(self._size, dtype=np.bool_))
+        for column in self._columns:
+            columns[column.name] = column.result(self._size)
+        return columns
+
+
+def default_fields(model_clazz, docs=()):
+    """
+    all fields of model, keys of documents (first seen first) without model
+    """
+    fields = getattr(model_clazz, '_fields', None)
+    if fields:
+        return [desc.field for desc in fields.values()]
+    names = {}
+    for sources, _ in (docs.chunks() if hasattr(docs, 'chunks') else [(docs, None)]):
+        for source in sources:
+            names.update(dict.fromkeys(source))
+    names.pop('_id', None)
+    return list(names)
+
+
+def _group_of(node):
+    """
+    (field name, buckets) of the group by aggregation under node, None for a leaf bucket
+    """
+    for name, value in node.items():
+        if name.startswith(_GROUP_PREFIX) and isinstance(value, dict) and 'buckets' in value:
+            return name[len(_GROUP_PREFIX):], value['buckets']
+    return None
+
+
+def _metrics(bucket):
+    """
+    (column, aggregation name, percent) of metrics in bucket, every percent of a percentiles aggregation
+    is a column named aggregation.percent
+    """
+    metrics = []
+    for name, value in bucket.items():
+        if not isinstance(value, dict):
+            continue
+        if 'value' in value:
+            metrics.append((name, name, None))
+        elif isinstance(value.get('values'), dict):
+            metrics.extend(('{}.{}'.format(name, percent), name, percent) for percent in value['values'])
+    return metrics
+
+
+def _metric_value(bucket, name, percent):
+    metric = bucket.get(name)
+    if metric is None:
+        return None
+    if percent is None:
+        return metric['value']
+    return metric['values'].get(percent)
+
+
+class _Table(object):
+    """
+    columns of equal length, column first seen after some rows is padded with None
+    """
+
+    def __init__(self):
+        self.columns = OrderedDict()
+        self.rows = 0
+
+    def column(self, name):
+        values = self.columns.get(name)
+        if values is None:
+            values = self.columns[name] = [None] * self.rows
+        return values
+
+    def extend(self, name, values):
+        self.column(name).extend(values)
+
+    def close_rows(self, count):
+        self.rows += count
+        for values in self.columns.values():
+            if len(values) < self.rows:
+                values.extend([None] * (self.rows - len(values)))
+
+
+def flatten_buckets(aggregations):
+    """
+    flatten nested group by buckets of a search response into a table, one row per leaf bucket,
+    group keys (named by field), doc_count and metric values are the columns.
+    leaf buckets under the same parent are filled column by column in one go
+    :param aggregations: 'aggregations' of a search response
+    :return: OrderedDict of column name to list of values
+    """
+    table = _Table()
+    if not aggregations:
+        return table.columns
+    group = _group_of(aggregations)
+    if group is None:
+        # metrics without group by give one row
+        for column, name, percent in _metrics(aggregations):
+            table.extend(column, [_metric_value(aggregations, name, percent)])
+        table.close_rows(1)
+        return table.columns
+    stack = [((), group)]
+    while stack:
+        path, (field, buckets) = stack.pop()
+        if not buckets:
+            continue
+        inner = _group_of(buckets[0])
+        if inner is not None:
+            for bucket in reversed(buckets):
+                stack.append((path + ((field, bucket['key']),), _group_of(bucket)))
+            continue
+        count = len(buckets)
+        for name, key in path:
+            table.extend(name, [key] * count)
+        if isinstance(buckets[0]['key'], dict):
+            # composite bucket key holds value of every source
+            for name in buckets[0]['key']:
+                table.extend(name, [bucket['key'].get(name) for bucket in buckets])
+        else:
+            table.extend(field, [bucket['key'] for bucket in buckets])
+        table.extend('doc_count', [bucket.get('doc_count') for bucket in buckets])
+        for column, name, percent in _metrics(buckets[0]):
+            if percent is None:
+                table.extend(column, [bucket[name]['value'] if name in bucket else None for bucket in buckets])
+            else:
+                table.extend(column, [_metric_value(bucket, name, percent) for bucket in buckets])
+        table.close_rows(count)
+    return table.columns
+
+
+def bucket_rows(aggregations):
+    """
+    yield rows of flatten_buckets one by one as dict of column name to value
+    """
+    columns = flatten_buckets(aggregations)
+    names = list(columns)
+    for values in zip(*columns.values()):
+        yield dict(zip(names, values))
+
+
+def _numeric_array(values):
+    """
+    numpy array of numbers or booleans, None for other values
+    """
+    if not values or isinstance(values[0], (str, list, dict)):
+        return None
+    try:
+        array = np.array(values)
+    except (ValueError, TypeError):
+        return None
+    return array if array.ndim == 1 and array.dtype.kind in 'biuf' else None
+
+
+def to_arrays(columns):
+    """
+    lists of values to numpy masked arrays, None is masked, dtype is inferred from the other values
+    (object for strings)
+    """
+    _require_numpy()
+    arrays = OrderedDict()
+    for name, values in columns.items():
+        mask = np.array([value is None for value in values], dtype=np.bool_)
+        array = _numeric_array(values if not mask.any() else [value for value in values if value is not None])
+        if array is None:
+            array = np.fromiter(values, dtype=object, count=len(values))
+        elif len(array) < len(values):
+            filled = np.zeros(len(values), dtype=array.dtype)
+            filled[~mask] = array
+            array = filled
+        arrays[name] = np.ma.MaskedArray(array, mask=mask)
+    return arrays
+
+
+def total_hits(res):
+    """
+    total hits of a search response, es 7 reports it as {'value': n, 'relation': 'eq'}
+    """
+    total = res.get('hits', {}).get('total', 0)
+    if isinstance(total, dict):
+        total = total.get('value', 0)
+    return total or 0
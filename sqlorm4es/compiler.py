@@ -2,11 +2,12 @@
 # @Time    : 2019/10/4 22:53
 # @Author  : floatsliang
 # @File    : compiler.py
-import re
 from functools import partial
 
-from .field import OP, Expr, Field
+from .field import OP, Expr, Field, Param, Date
 from .query import Q
+from .optimizer import WhereOptimizer
+from .utils import LRUCache, json_dumps, split_in_value
 
 
 def f_add(a, b):
@@ -25,6 +26,164 @@ def f_div(a, b):
     return b / a
 
 
+_RANGE_KEYS = {
+    OP.OP_LT: 'lt',
+    OP.OP_LTE: 'lte',
+    OP.OP_GT: 'gt',
+    OP.OP_GTE: 'gte',
+}
+
+_RANGE_OPS = {v: k for k, v in _RANGE_KEYS.items()}
+
+_BUCKET_FILL_PARAMS = ('min_doc_count', 'extended_bounds')
+# calendar_interval and fixed_interval of date_histogram are accepted since es 7.2
+_CALENDAR_INTERVAL_VERSION = (7, 2)
+
+
+def _version_key(version):
+    """
+    comparable (major, minor) of es_version, give two digit minor versions as text ('7.10', 7.10 is 7.1)
+    """
+    return tuple(int(part) for part in str(version).split('.')[:2])
+
+
+_PLAN_CACHE_SIZE = 512
+
+
+def bind_value(val, field=None, inv_val=None, fmt=None, split=False):
+    """
+    turn a where-clause literal into the value written to the query:
+    split IN list, validate by field, apply inverted math op, then format
+    """
+    if split:
+        val = split_in_value(val)
+    if hasattr(field, 'validate'):
+        if isinstance(val, list):
+            val = [field.validate(v) for v in val]
+        else:
+            val = field.validate(val)
+    if callable(inv_val):
+        if isinstance(val, list):
+            val = [inv_val(b=v) for v in val]
+        else:
+            val = inv_val(b=val)
+    if fmt and val is not None:
+        val = fmt(val)
+    return val
+
+
+def _copy_tree(node):
+    if isinstance(node, dict):
+        return {k: _copy_tree(v) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_copy_tree(v) for v in node]
+    return node
+
+
+def _dict_paths(root):
+    """
+    map id of every dict node in the query tree to its key/index path
+    """
+    paths = {}
+    node_stack = [(root, ())]
+    while node_stack:
+        node, path = node_stack.pop()
+        if isinstance(node, dict):
+            paths[id(node)] = path
+            for k, v in node.items():
+                node_stack.append((v, path + (k,)))
+        elif isinstance(node, list):
+            for i, v in enumerate(node):
+                node_stack.append((v, path + (i,)))
+    return paths
+
+
+class CompiledPlan(object):
+    """
+    precompiled DSL skeleton of one query shape, rendering it copies the
+    skeleton and writes the bound literals into their slots
+    """
+    __slots__ = ('skeleton', 'slots', 'params', '_fragments', '_order')
+
+    def __init__(self, skeleton, slots, params=()):
+        self.skeleton = skeleton
+        self.slots = slots
+        self.params = tuple(params)
+        self._fragments = None
+        self._order = None
+
+    def _literals(self, params):
+        unknown = set(params) - set(self.params)
+        if unknown:
+            raise ValueError(u'ERROR: unknown params {} of prepared sql'.format(sorted(unknown)))
+        try:
+            return [params[name] for name in self.params]
+        except KeyError as ex:
+            raise ValueError(u'ERROR: missing value of param {}'.format(ex))
+
+    def bind(self, **params):
+        return self.render(self._literals(params))
+
+    def bind_bytes(self, **params):
+        return self.render_bytes(self._literals(params))
+
+    def fragments(self):
+        """
+        json bytes of the skeleton split at every slot, so literals can be
+        encoded in between without building the query dict, slots are
+        split in the order they appear in the encoding (see _order)
+        """
+        if self._fragments is None:
+            marker = '__sqlorm4es_slot_{}_{}__'.format(id(self), '{}')
+            body = _copy_tree(self.skeleton)
+            for i, slot in enumerate(self.slots):
+                node = body
+                for step in slot[0]:
+                    node = node[step]
+                node[slot[1]] = marker.format(i)
+            encoded = json_dumps(body)
+            quoted = [json_dumps(marker.format(i)) for i in range(len(self.slots))]
+            order = sorted(range(len(self.slots)), key=lambda i: encoded.index(quoted[i]))
+            fragments = []
+            start = 0
+            for i in order:
+                end = encoded.index(quoted[i], start)
+                fragments.append(encoded[start:end])
+                start = end + len(quoted[i])
+            fragments.append(encoded[start:])
+            self._order = order
+            self._fragments = fragments
+        return self._fragments
+
+    def render_bytes(self, literals) -> bytes:
+        fragments = self.fragments()
+        buf = bytearray(fragments[0])
+        for n, i in enumerate(self._order):
+            slot = self.slots[i]
+            val = slot[2](literals[i])
+            if slot[3] and val is None:
+                # empty range bound has to be left out, fall back to dict rendering
+                return json_dumps(self.render(literals))
+            buf += json_dumps(val)
+            buf += fragments[n + 1]
+        return bytes(buf)
+
+    def render(self, literals):
+        body = _copy_tree(self.skeleton)
+        for slot, literal in zip(self.slots, literals):
+            path, key, binder, skip_empty = slot
+            node = body
+            for step in path:
+                node = node[step]
+            val = binder(literal)
+            # range bounds with empty value are left out, same as Range.with_*
+            if skip_empty and val is None:
+                node.pop(key, None)
+            else:
+                node[key] = val
+        return body
+
+
 class QueryCompiler(object):
     logical_op = {
         OP.OP_AND,
@@ -52,6 +211,7 @@ class QueryCompiler(object):
         OP.OP_MATCH,
         OP.OP_NOT_MATCH,
         OP.OP_MATCH_ALL,
+        OP.OP_RANGE,
     }
 
     agg_op = {
@@ -60,16 +220,38 @@ class QueryCompiler(object):
         OP.OP_AVG,
         OP.OP_COUNT,
         OP.OP_SUM,
+        OP.OP_CARDINALITY,
+        OP.OP_PERCENTILES,
     }
 
     _MAX_NEST_DEPTH = 10
 
+    plan_cache = LRUCache(_PLAN_CACHE_SIZE)
+    optimize_where = True
+
     def __init__(self, sql):
         self._sql = sql
+        self._slots = None
+        self._optimized = (None, None)
 
-    def compile(self, sql_type='select'):
+    def optimized_where(self):
+        """
+        where clause after WhereOptimizer rewrite, kept until where changes
+        :return:
+        """
+        where = self._sql['where']
+        if where is None or not self.optimize_where:
+            return where
+        if self._optimized[0] is not where:
+            self._optimized = (where, WhereOptimizer().optimize(where))
+        return self._optimized[1]
+
+    def compile(self, sql_type='select', use_cache=True, format='dict'):
         if sql_type == 'select':
-            return self.parse_select_sql()
+            if use_cache and self.plan_cache is not None:
+                return self.compile_select_cached(format)
+            query = self.parse_select_sql()
+            return json_dumps(query) if format == 'bytes' else query
         elif sql_type == 'insert':
             return self.parse_insert_sql()
         elif sql_type == 'update':
@@ -79,6 +261,129 @@ class QueryCompiler(object):
         else:
             raise NotImplementedError(u'ERROR: sql type not implemented yet')
 
+    def compile_select_cached(self, format='dict'):
+        """
+        look up the precompiled plan of current query shape, render it with
+        literals of the where clause, compile and cache a new plan on miss
+        :param format: 'dict' for query dict, 'bytes' for json encoded request body
+        :return:
+        """
+        literals = []
+        key = self.fingerprint(literals)
+        if key is None:
+            query = self.parse_select_sql()
+            return json_dumps(query) if format == 'bytes' else query
+        plan = self.plan_cache.get(key)
+        if plan is not None:
+            return plan.render_bytes(literals) if format == 'bytes' else plan.render(literals)
+
+        query, slots = self._parse_select_with_slots()
+        plan_slots = [slot[:4] for slot in slots]
+        self.plan_cache.set(key, CompiledPlan(_copy_tree(query), plan_slots))
+        return json_dumps(query) if format == 'bytes' else query
+
+    def prepare(self):
+        """
+        compile sql whose where clause contains Param placeholders once,
+        the returned plan only binds param values when rendered
+        :return: CompiledPlan
+        """
+        query, slots = self._parse_select_with_slots()
+        names = []
+        plan_slots = []
+        for slot in slots:
+            literal = slot[4]
+            if isinstance(literal, Param):
+                names.append(literal.name)
+                plan_slots.append(slot[:4])
+        return CompiledPlan(_copy_tree(query), plan_slots, names)
+
+    def _parse_select_with_slots(self):
+        self._slots = []
+        try:
+            query = self.parse_select_sql()
+            slots = self._slots
+        finally:
+            self._slots = None
+        paths = _dict_paths(query)
+        return query, [(paths[id(slot[0])],) + slot[1:] for slot in slots]
+
+    def fingerprint(self, literals=None):
+        """
+        structural key of the sql: fields, where tree shape, group by, order by,
+        limit and offset, where literals are collected into `literals` in the
+        same order the compiler visits them
+        :return: hashable key, None if the sql shape can not be cached
+        """
+        if literals is None:
+            literals = []
+        sql = self._sql
+        try:
+            where = self.optimized_where()
+            where_shape = self._where_shape(where, literals) if where is not None else None
+            fields_shape = tuple(self._operand_token(f) or f for f in sql['fields'])
+            group_by_shape = tuple(self._operand_token(f) or f for f in sql['group_by'])
+            order_by_shape = tuple(sql['order_by'].items())
+            key = ('select', where_shape, fields_shape, group_by_shape, order_by_shape,
+                   sql['limit'], sql['offset'], sql.get('composite'), sql.get('es_version'))
+            hash(key)
+        except (TypeError, ValueError):
+            return None
+        return key
+
+    @staticmethod
+    def _field_token(field):
+        # sql clones deep copy their fields, so identify field by type, name and timezone instead of id
+        return field.__class__, field.get_name(), str(getattr(field, '_timezone', ''))
+
+    def _operand_token(self, node):
+        if isinstance(node, Field):
+            return ('f',) + self._field_token(node)
+        if isinstance(node, Expr):
+            if node.op in self.math_op:
+                if isinstance(node.lhs, Field):
+                    return ('m', node.op, 'l', node.rhs) + self._field_token(node.lhs)
+                if isinstance(node.rhs, Field):
+                    return ('m', node.op, 'r', node.lhs) + self._field_token(node.rhs)
+            if node.op in self.agg_op or node.op is OP.OP_DATE_TRUNC:
+                field = self._field_token(node.lhs) if isinstance(node.lhs, Field) else node.lhs
+                return 'a', node.op, field, node.rhs
+            raise ValueError(u'ERROR: operand shape can not be cached')
+        return None
+
+    def _where_shape(self, node, literals):
+        shape = []
+        node_stack = [node]
+        while node_stack:
+            node = node_stack.pop()
+            if not isinstance(node, Expr):
+                raise ValueError(u'ERROR: where node shape can not be cached')
+            if node.op in self.logical_op:
+                shape.append(node.op)
+                node_stack.append(node.rhs)
+                node_stack.append(node.lhs)
+            elif node.op in self.rel_op:
+                l_token = self._operand_token(node.lhs)
+                r_token = self._operand_token(node.rhs)
+                if l_token:
+                    token, literal = (node.op, l_token, None), node.rhs
+                elif r_token:
+                    token, literal = (node.op, None, r_token), node.lhs
+                elif isinstance(node.lhs, str):
+                    token, literal = (node.op, node.lhs, str), node.rhs
+                else:
+                    raise ValueError(u'ERROR: where node shape can not be cached')
+                if node.op is OP.OP_RANGE:
+                    bound_keys = tuple(sorted(literal))
+                    shape.append(token + bound_keys)
+                    literals.extend(literal[k] for k in bound_keys)
+                else:
+                    shape.append(token)
+                    literals.append(literal)
+            else:
+                raise ValueError(u'ERROR: where node shape can not be cached')
+        return tuple(shape)
+
     def _op_to_func(self, q, op, inv=False):
         if op is OP.OP_AND:
             if inv:
@@ -121,6 +426,10 @@ class QueryCompiler(object):
             func = partial(q.metrics, op='sum')
         elif op is OP.OP_AVG:
             func = partial(q.metrics, op='avg')
+        elif op is OP.OP_CARDINALITY:
+            func = q.cardinality
+        elif op is OP.OP_PERCENTILES:
+            func = q.percentiles
         else:
             raise NotImplementedError
 
@@ -131,7 +440,7 @@ class QueryCompiler(object):
         preorder AND/OR node bi-tree to construct nested Bool query
         :return:
         """
-        curr_node = self._sql['where']
+        curr_node = self.optimized_where()
         where_query = Q('bool', scoring=scoring)
         if curr_node.op not in self.logical_op:
             root_op = OP.OP_AND
@@ -187,7 +496,7 @@ class QueryCompiler(object):
                     field_name = field.get_name()
                     val = l_val
                     inv_val = r_inv
-                elif isinstance(l_val, str) and isinstance(r_val, str):
+                elif isinstance(l_val, str):
                     field = l_val
                     field_name = field
                     val = r_val
@@ -195,26 +504,35 @@ class QueryCompiler(object):
                 else:
                     raise ValueError(
                         u'ERROR: left or right field of relation operation {} should be Field or str type'.format(op))
+                if op is OP.OP_RANGE:
+                    return self.parse_range(field, field_name, val, inv_val), inv
+                slot_fmt = None
+                split = False
                 if op in (OP.OP_LTE, OP.OP_LT, OP.OP_GT, OP.OP_GTE):
                     q = Q('range', field=field_name)
+                    slot_key = _RANGE_KEYS[op]
+                    slot_fmt = '{}'.format
                 elif op is OP.OP_EQ or op is OP.OP_NE:
                     q = Q('term', field=field_name)
+                    slot_key = 'value'
                     if op is OP.OP_NE:
                         op = OP.OP_EQ
                         inv = True
                 elif op is OP.OP_IN:
-                    if not isinstance(val, list) and not isinstance(val, tuple):
-                        val = re.sub(r'\s*[()\[\]]\s*', '', val)
-                        val = re.split(r'\s*[,;]\s*', val)
+                    if not isinstance(val, Param):
+                        val = split_in_value(val)
+                    split = True
                     q = Q('terms', field=field_name)
-                    val = list(val)
+                    slot_key = field_name
                 elif op is OP.OP_LIKE or op is OP.OP_NOT_LIKE:
                     q = Q('wildcard', field=field_name)
+                    slot_key = 'value'
                     if op is OP.OP_NOT_LIKE:
                         op = OP.OP_LIKE
                         inv = True
                 elif op in {OP.OP_MATCH, OP.OP_NOT_MATCH, OP.OP_MATCH_ALL}:
                     q = Q('match', field=field_name)
+                    slot_key = 'query'
                     if op is OP.OP_NOT_MATCH:
                         inv = True
                     elif op is OP.OP_MATCH_ALL:
@@ -222,17 +540,13 @@ class QueryCompiler(object):
                     op = OP.OP_MATCH
                 else:
                     raise NotImplementedError
-                if hasattr(field, 'validate'):
-                    if isinstance(val, list):
-                        val = [field.validate(v) for v in val]
-                    else:
-                        val = field.validate(val)
-                if callable(inv_val):
-                    if isinstance(val, list):
-                        val = [inv_val(v) for v in val]
-                    else:
-                        val = inv_val(val)
+                literal = val
+                if not isinstance(val, Param):
+                    val = bind_value(val, field, inv_val)
                 self._op_to_func(q, op)(val)
+                if self._slots is not None:
+                    binder = partial(bind_value, field=field, inv_val=inv_val, fmt=slot_fmt, split=split)
+                    self._slots.append((q._work_dir, slot_key, binder, slot_fmt is not None, literal))
 
                 return q, inv
             elif op in self.math_op:
@@ -262,12 +576,30 @@ class QueryCompiler(object):
                     field = field.get_name()
                 else:
                     raise ValueError(u'ERROR: aggregation field type only support str or Field')
-                return (field, op), inv
+                # options of the aggregation (eg. precision_threshold) are kept in rhs as (name, value) pairs
+                return (field, op, leaf_node.rhs), inv
             else:
                 raise NotImplementedError
         else:
             return leaf_node, inv
 
+    def parse_range(self, field, field_name, bounds, inv_val=None):
+        """
+        single range query of the bounds merged by where optimizer
+        :return:
+        """
+        q = Q('range', field=field_name)
+        for bound_key in sorted(bounds):
+            if bound_key not in _RANGE_OPS:
+                raise ValueError(u'ERROR: unsupported range bound {}'.format(bound_key))
+            literal = bounds[bound_key]
+            val = literal if isinstance(literal, Param) else bind_value(literal, field, inv_val)
+            self._op_to_func(q, _RANGE_OPS[bound_key])(val)
+            if self._slots is not None:
+                binder = partial(bind_value, field=field, inv_val=inv_val, fmt='{}'.format)
+                self._slots.append((q._work_dir, bound_key, binder, True, literal))
+        return q
+
     def parse_fields(self):
         fields = self._sql['fields']
         _source_fields = []
@@ -293,10 +625,33 @@ class QueryCompiler(object):
                 _agg_fields.append(field.get_name())
             elif isinstance(field, str):
                 _agg_fields.append(field)
+            elif isinstance(field, Expr) and field.op is OP.OP_DATE_TRUNC:
+                _agg_fields.append(self.parse_date_trunc(field))
             else:
                 raise ValueError(u'ERROR: unsupported field type {} in group by'.format(field.__class__))
         return _agg_fields
 
+    def parse_date_trunc(self, node):
+        """
+        (field name, 'date_histogram', params) of a date_trunc group by, time zone of Date field by default,
+        es before 7.2 takes calendar and fixed intervals as interval
+        """
+        field = node.lhs
+        params = dict(node.rhs)
+        version = self._sql.get('es_version')
+        if version is not None and _version_key(version) < _CALENDAR_INTERVAL_VERSION:
+            for name in ('calendar_interval', 'fixed_interval'):
+                if name in params:
+                    params['interval'] = params.pop(name)
+        if 'extended_bounds' in params:
+            params['extended_bounds'] = dict(params['extended_bounds'])
+        if isinstance(field, Field):
+            if 'time_zone' not in params and isinstance(field, Date) and field.time_zone():
+                params['time_zone'] = field.time_zone()
+            field = field.get_name()
+        params['field'] = field
+        return field, 'date_histogram', params
+
     def parse_order_by(self):
         return self._sql['order_by']
 
@@ -306,7 +661,7 @@ class QueryCompiler(object):
     def parse_select_sql(self):
         query = Q('dsl')
 
-        if self._sql['where']:
+        if self._sql['where'] is not None:
             where_query = self.parse_where()
             query.query(where_query)
             self.parse_join(where_query)
@@ -316,10 +671,23 @@ class QueryCompiler(object):
         _sort_fields = self.parse_order_by()
         curr_agg = query
         prev_name = ''
-        if _agg_fields_group_by:
+        if _agg_fields_group_by and self._sql.get('composite'):
+            agg_query = Q('aggs')
+            # composite sources have no empty buckets, min_doc_count and extended_bounds do not apply
+            sources = [field if isinstance(field, str) else
+                       (field[0], field[1], {k: v for k, v in field[2].items() if k not in _BUCKET_FILL_PARAMS})
+                       for field in _agg_fields_group_by]
+            agg_query.composite(sources, orders=_sort_fields, size=self._sql['composite'])
+            curr_agg.aggs(agg_query, name=prev_name)
+            curr_agg = agg_query
+            prev_name = 'composite'
+        elif _agg_fields_group_by:
             for field in _agg_fields_group_by:
                 agg_query = Q('aggs')
-                if field in _sort_fields:
+                if isinstance(field, tuple):
+                    field, _, params = field
+                    agg_query.date_histogram(order=_sort_fields.get(field), **params)
+                elif field in _sort_fields:
                     agg_query.terms(field=field, order_by="_key", order=_sort_fields[field])
                 else:
                     agg_query.terms(field=field)
@@ -331,8 +699,8 @@ class QueryCompiler(object):
             curr_agg.aggs(agg_query, name=prev_name)
             curr_agg = agg_query
             for field_and_op in _agg_fields_selection:
-                field, op = field_and_op
-                self._op_to_func(curr_agg, op)(field)
+                field, op, options = field_and_op
+                self._op_to_func(curr_agg, op)(field, **dict(options or ()))
 
         if _source_fields:
             query._source(_source_fields)
@@ -3,11 +3,15 @@
 # @Author  : floatsliang
 # @File    : epool.py
 import json
-import random
-from threading import Lock
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock, Condition
 from timeit import default_timer
 
-from elasticsearch import Elasticsearch, ImproperlyConfigured
+from elasticsearch import Elasticsearch, ImproperlyConfigured, SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+from .utils import json_dumps, json_loads
 
 _DEFAULT_CONF = {
     'hosts': ['127.0.0.1:9200'],
@@ -21,19 +25,49 @@ _DEFAULT_CONF = {
 }
 
 _DEFAULT_TIMEOUT = 600
+_DEFAULT_WAIT_TIMEOUT = 30
 _MAX_CONN = 10
-_CLEAN_RATIO = 0.2
-_OVERLOAD_RATIO = 2
-_MAX_CLEAN = 10
+# options of ESConnection itself, clients only differ in them share one transport
+_CLIENT_OPTIONS = {'es_version'}
+
+
+class BytesSerializer(JSONSerializer):
+    """
+    json serializer passing pre-encoded request body through untouched
+    """
+
+    def dumps(self, data):
+        if isinstance(data, (str, bytes, bytearray)):
+            return data
+        try:
+            return json_dumps(data, default=self.default)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
+
+    def loads(self, s):
+        try:
+            return json_loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
 
 
 class ESConnection(Elasticsearch):
     _version = 6.8
 
-    def __init__(self, config, timeout):
+    def __init__(self, config, timeout, transport=None):
         self._timeout = timeout
         self._version = config.get("es_version", self._version)
-        super(ESConnection, self).__init__(**config)
+        config = {k: v for k, v in config.items() if k not in _CLIENT_OPTIONS}
+        config.setdefault('serializer', BytesSerializer())
+        if transport is not None:
+            super(ESConnection, self).__init__(transport_class=lambda *args, **kwargs: transport)
+        else:
+            super(ESConnection, self).__init__(**config)
+
+    def _bulk_body(self, body):
+        if isinstance(body, (bytes, bytearray)):
+            return body if body.endswith(b'\n') else body + b'\n'
+        return super(ESConnection, self)._bulk_body(body)
 
     @property
     def version(self):
@@ -47,73 +81,385 @@ class ESConnection(Elasticsearch):
         self._timeout = timeout
 
 
+class _PoolEntry(object):
+    __slots__ = ('key', 'conn', 'transport_key', 'leases', 'last_used', 'pooled')
+
+    def __init__(self, key, conn, transport_key):
+        self.key = key
+        self.conn = conn
+        self.transport_key = transport_key
+        self.leases = 0
+        self.last_used = default_timer()
+        self.pooled = True
+
+
+class ClientHandle(object):
+    """
+    client of one config bound once (eg. by a model at class creation), config key is computed when binding and
+    resolved client is kept until it is evicted from pool or pool is reloaded, so a query gets its client
+    without building the key and cleaning up pool again
+    """
+    __slots__ = ('_pool', '_config', '_key', '_state')
+
+    def __init__(self, pool, config):
+        self._pool = pool
+        self._config = {} if config is None else config
+        self._key = pool._key_of(self._config)
+        # (pool generation, pool entry, client) swapped as a whole so readers never see a mix
+        self._state = (None, None, None)
+
+    @property
+    def config(self):
+        return self._config
+
+    @property
+    def key(self):
+        """
+        pool key of bound config, None for default config
+        """
+        return self._key
+
+    @property
+    def version(self):
+        """
+        es_version of bound config, version of pool default client for default config
+        """
+        if self._key is None:
+            return self._pool._default_connect.version
+        return self._config.get('es_version', ESConnection._version)
+
+    def _resolve(self):
+        pool = self._pool
+        generation = pool._generation
+        if generation != self._state[0]:
+            # config may be changed in place before reload
+            self._key = pool._key_of(self._config)
+        entry = pool._acquire(self._config, False, key=self._key)
+        conn = pool._default_connect if entry is None else entry.conn
+        self._state = (generation, entry, conn)
+        return conn
+
+    def connect(self):
+        pool = self._pool
+        with pool._lock:
+            generation, entry, conn = self._state
+            if generation == pool._generation and (entry is None or entry.pooled):
+                if entry is not None:
+                    now = default_timer()
+                    pool._touch(entry, now)
+                    pool._clean(now)
+                return conn
+        return self._resolve()
+
+    def lease(self, pool_timeout=None):
+        pool = self._pool
+        generation, entry, conn = self._state
+        if generation != pool._generation:
+            self._resolve()
+        elif entry is None:
+            return _Lease(pool, None, conn)
+        else:
+            with pool._lock:
+                if entry.pooled:
+                    now = default_timer()
+                    pool._checkout(entry, True, now)
+                    pool._clean(now)
+                    return _Lease(pool, entry, conn)
+        return pool._lease(self._config, self._key, pool_timeout)
+
+
+class _Lease(object):
+    """
+    lease of a client taken by ClientHandle, ended on exit
+    """
+    __slots__ = ('_pool', '_entry', '_conn')
+
+    def __init__(self, pool, entry, conn):
+        self._pool = pool
+        self._entry = entry
+        self._conn = conn
+
+    def __enter__(self):
+        return self._conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._entry is not None:
+            self._pool._release(self._entry)
+        return False
+
+
 class DBPool(object):
+    """
+    thread-safe pool of ESConnection keyed by config, clients whose configs only differ in client level
+    options (eg. es_version) share one transport (one urllib3 pool per host), at most max_conn clients
+    are kept, least recently used idle client is evicted when pool is full and idle clients unused for
+    pool_timeout seconds are evicted when clean_timeout is on, caller waits up to wait_timeout seconds
+    when pool is full of leased clients, transport of evicted client is closed with its last client so
+    hold a lease() for requests instead of keeping a connect() client around
+    """
 
     def __init__(self, engine=None, clean_timeout=True,
-                 pool_timeout=_DEFAULT_TIMEOUT, max_conn=_MAX_CONN, **conf):
+                 pool_timeout=_DEFAULT_TIMEOUT, max_conn=_MAX_CONN, wait_timeout=_DEFAULT_WAIT_TIMEOUT, **conf):
         conf = conf or _DEFAULT_CONF
+        self._conf = conf
+        self._key = DBPool._config_key(conf)
         self._default_connect = ESConnection(conf, None)
-        self._key = json.dumps(tuple(sorted(conf.items())))
-        self._pool = {}
+        self._entries = OrderedDict()
+        # keys whose clients are being created out of lock, they take a slot of pool
+        self._creating = set()
+        # transport key -> [transport, clients sharing it], default client keeps its transport alive
+        self._transports = {DBPool._transport_key(conf): [self._default_connect.transport, 1]}
         self._clean_timeout = clean_timeout
         self._timeout = pool_timeout
-        self._max_conn = max_conn
-        self._clean_conn_per_round = min(int(max_conn * _CLEAN_RATIO), _MAX_CLEAN)
-        self._max_overload_conn = max_conn * _OVERLOAD_RATIO
-        self._clean_lock = Lock()
+        self._max_conn = max(int(max_conn), 1)
+        self._wait_timeout = wait_timeout
+        self._lock = Lock()
+        self._cond = Condition(self._lock)
+        # callers waiting for a slot, nobody is notified without them
+        self._waiting = 0
+        # earliest time an idle client may be unused for pool_timeout, see _clean
+        self._next_clean = float('inf')
+        self._created = 0
+        self._evicted = 0
+        self._waits = 0
+        self._wait_time = 0.
+        self._generation = 0
+
+    @staticmethod
+    def _config_key(config):
+        return json.dumps(sorted(config.items()), default=repr)
+
+    def _key_of(self, config):
+        """
+        pool key of config, None for default config
+        """
+        if not config:
+            return None
+        key = DBPool._config_key(config)
+        return None if key == self._key else key
 
     @staticmethod
-    def _is_conn_timeout(conn):
-        return True if default_timer() > conn.timeout else False
+    def _transport_key(config):
+        return DBPool._config_key({k: v for k, v in config.items() if k not in _CLIENT_OPTIONS})
 
-    def _new_conn(self, key, timeout, config):
+    @staticmethod
+    def _create_conn(timeout, config, transport=None):
         now = default_timer()
         try:
-            conn = ESConnection(config, now + timeout)
+            return ESConnection(config, now + timeout, transport=transport)
         except Exception as ex:
             if isinstance(ex, ImproperlyConfigured):
                 raise Exception(u'ERROR: Config passed to the client is inconsistent or invalid')
             raise Exception(u'ERROR: {}'.format(str(ex)))
 
-        if len(self._pool) < self._max_overload_conn:
-            self._pool[key] = conn
-        return conn
+    def _unshare(self, transport_key):
+        shared = self._transports[transport_key]
+        shared[1] -= 1
+        if not shared[1]:
+            del self._transports[transport_key]
+            shared[0].close()
 
-    def _get_conn(self, key, timeout, config):
-        conn = self._pool.get(key, None)
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        entry.pooled = False
+        self._evicted += 1
+        self._unshare(entry.transport_key)
 
-        if conn:
-            if DBPool._is_conn_timeout(conn):
-                conn.set_timeout(default_timer() + timeout)
-            return conn
-        else:
-            return self._new_conn(key, timeout, config)
+    def _touch(self, entry, now=None):
+        self._entries.move_to_end(entry.key)
+        entry.last_used = default_timer() if now is None else now
+
+    def _evict_idle(self, now):
+        for key, entry in list(self._entries.items()):
+            if now - entry.last_used < self._timeout:
+                break
+            if not entry.leases:
+                self._evict(key)
+
+    def _clean(self, now=None):
+        """
+        evict idle clients when the least recently used one may have timed out, so acquiring a client
+        does not scan pool every time, holding lock
+        """
+        if not self._clean_timeout:
+            return
+        now = default_timer() if now is None else now
+        if now < self._next_clean:
+            return
+        self._evict_idle(now)
+        # clients are kept in use order, first idle one times out first
+        oldest = next((entry for entry in self._entries.values() if not entry.leases), None)
+        self._next_clean = float('inf') if oldest is None else oldest.last_used + self._timeout
 
-    def _clean_timeout_conn(self):
-        if len(self._pool) > self._max_conn:
-            if self._clean_lock.acquire(blocking=False):
-                clean_list = random.choices(list(self._pool.keys()),
-                                            k=self._clean_conn_per_round)
-                for key in clean_list:
-                    if DBPool._is_conn_timeout(self._pool[key]):
-                        del self._pool[key]
+    def _evict_lru(self):
+        for key, entry in self._entries.items():
+            if not entry.leases:
+                self._evict(key)
+                return True
+        return False
 
-                self._clean_lock.release()
+    def _has_slot(self, key):
+        if key in self._creating:
+            return False
+        if key in self._entries or len(self._entries) + len(self._creating) < self._max_conn:
+            return True
+        self._next_clean = 0
+        self._clean()
+        return len(self._entries) + len(self._creating) < self._max_conn or self._evict_lru()
+
+    def _wait_for_slot(self, key, start):
+        """
+        wait until key is created by another caller or there is room for a new client, holding lock
+        """
+        deadline = start + self._wait_timeout
+        waiting = False
+        try:
+            while not self._has_slot(key):
+                if not waiting:
+                    waiting = True
+                    self._waiting += 1
+                remain = deadline - default_timer()
+                if remain <= 0:
+                    raise Exception(u'ERROR: no idle connection in pool after waiting {}s'.format(
+                        self._wait_timeout))
+                self._cond.wait(remain)
+        finally:
+            if waiting:
+                self._waiting -= 1
+                self._waits += 1
+                self._wait_time += default_timer() - start
+
+    def _acquire(self, config, lease, pool_timeout=None, key=False):
+        if key is False:
+            key = self._key_of(config)
+        if key is None:
+            return None
+        with self._cond:
+            now = default_timer()
+            self._clean(now)
+            self._wait_for_slot(key, now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return self._checkout(entry, lease)
+            # client is created out of lock (eg. sniff_on_start talks to cluster), its slot and the
+            # transport it shares are held meanwhile
+            self._creating.add(key)
+            transport_key = DBPool._transport_key(config)
+            shared = self._transports.get(transport_key)
+            if shared:
+                shared[1] += 1
+        try:
+            conn = DBPool._create_conn(pool_timeout or self._timeout, config,
+                                       transport=shared[0] if shared else None)
+        except Exception:
+            with self._cond:
+                self._creating.discard(key)
+                if shared:
+                    self._unshare(transport_key)
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self._creating.discard(key)
+            if not shared:
+                shared = self._transports.get(transport_key)
+                if shared:
+                    # same hosts created by another caller meanwhile, keep one transport for them
+                    conn.transport.close()
+                    conn = DBPool._create_conn(pool_timeout or self._timeout, config, transport=shared[0])
+                    shared[1] += 1
+                else:
+                    self._transports[transport_key] = [conn.transport, 1]
+            entry = self._entries[key] = _PoolEntry(key, conn, transport_key)
+            self._next_clean = min(self._next_clean, entry.last_used + self._timeout)
+            self._created += 1
+            self._cond.notify_all()
+            return self._checkout(entry, lease)
+
+    def _checkout(self, entry, lease, now=None):
+        self._touch(entry, now)
+        if lease:
+            entry.leases += 1
+        return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry.leases -= 1
+            entry.last_used = default_timer()
+            if entry.pooled:
+                self._entries.move_to_end(entry.key)
+            if not entry.leases:
+                self._next_clean = min(self._next_clean, entry.last_used + self._timeout)
+                if self._waiting:
+                    self._cond.notify_all()
 
     def connect(self, pool_timeout=None, **config):
-        if self._clean_timeout:
-            self._clean_timeout_conn()
+        """
+        client for config to make requests right away, hold a lease() instead to use it for a long time
+        """
+        entry = self._acquire(config, False, pool_timeout)
+        return self._default_connect if entry is None else entry.conn
 
-        if not config:
-            return self._default_connect
-        key = json.dumps(tuple(sorted(config.items())))
-        if key == self._key:
-            return self._default_connect
+    def lease(self, pool_timeout=None, **config):
+        """
+        client for config which is not evicted until lease ends
+        """
+        return self._lease(config, False, pool_timeout)
 
-        pool_timeout = pool_timeout or self._timeout
-        conn = self._get_conn(key, pool_timeout, config)
+    def bind(self, config):
+        """
+        handle resolving client of config once, see ClientHandle
+        """
+        return ClientHandle(self, config)
 
-        return conn
+    @contextmanager
+    def _lease(self, config, key, pool_timeout):
+        entry = self._acquire(config, True, pool_timeout, key=key)
+        if entry is None:
+            yield self._default_connect
+            return
+        try:
+            yield entry.conn
+        finally:
+            self._release(entry)
+
+    def new_connection(self, pool_timeout=None, **config):
+        """
+        connection with its own transport, not shared with other callers (eg. one per worker thread),
+        release it by conn.transport.close()
+        """
+        return DBPool._create_conn(pool_timeout or self._timeout, config or self._conf)
+
+    def stats(self):
+        with self._cond:
+            active = sum(1 for entry in self._entries.values() if entry.leases)
+            return {
+                'active': active,
+                'idle': len(self._entries) - active,
+                'transports': len(self._transports),
+                'max_conn': self._max_conn,
+                'created': self._created,
+                'evicted': self._evicted,
+                'waits': self._waits,
+                'wait_time': self._wait_time,
+            }
+
+    def clear(self):
+        """
+        evict all idle clients
+        """
+        with self._cond:
+            for key in [key for key, entry in self._entries.items() if not entry.leases]:
+                self._evict(key)
+
+    def reload(self):
+        """
+        evict all idle clients and make every bound handle resolve its config again on next use,
+        call it after changing a config (eg. model __database__) in place
+        """
+        with self._cond:
+            self._generation += 1
+            for key in [key for key, entry in self._entries.items() if not entry.leases]:
+                self._evict(key)
 
 
 POOL = DBPool()
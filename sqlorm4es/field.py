@@ -3,12 +3,14 @@
 # @Author  : floatsliang
 # @File    : field.py
 import json
+import re
 from ast import literal_eval
 from six import string_types
 from datetime import datetime, date, timezone as dt_tz, timedelta
 from dateutil import parser, tz
 
-__all__ = ['OP', 'OP_DICT', 'Expr', 'Integer', 'Float', 'Boolean', 'Text', 'Date', 'Object']
+__all__ = ['OP', 'OP_DICT', 'Expr', 'Param', 'Integer', 'Float', 'Boolean', 'Text', 'Date', 'Object', 'distinct',
+           'percentiles', 'date_trunc']
 
 
 class OP:
@@ -31,25 +33,38 @@ class OP:
     OP_MATCH = 17
     OP_NOT_MATCH = 18
     OP_MATCH_ALL = 19
+    OP_RANGE = 20
 
     OP_COUNT = 21
     OP_SUM = 22
     OP_MAX = 23
     OP_MIN = 24
     OP_AVG = 25
+    OP_CARDINALITY = 26
+    OP_PERCENTILES = 27
+    OP_DATE_TRUNC = 28
 
 
 OP_DICT = {
     '<>': OP.OP_NE, '=': OP.OP_EQ, '>': OP.OP_GT,
     '>=': OP.OP_GTE, '<': OP.OP_LT, '<=': OP.OP_LTE,
     '!=': OP.OP_NE, 'in': OP.OP_IN, 'like': OP.OP_LIKE, 'LIKE': OP.OP_LIKE,
-    'count': OP.OP_COUNT, 'sum': OP.OP_SUM, 'max': OP.OP_MAX,
-    'avg': OP.OP_AVG, 'or': OP.OP_OR, 'OR': OP.OP_OR, 'and': OP.OP_AND,
+    'count': OP.OP_COUNT, 'sum': OP.OP_SUM, 'max': OP.OP_MAX, 'min': OP.OP_MIN,
+    'avg': OP.OP_AVG, 'distinct': OP.OP_CARDINALITY, 'percentile': OP.OP_PERCENTILES,
+    'percentiles': OP.OP_PERCENTILES, 'or': OP.OP_OR, 'OR': OP.OP_OR, 'and': OP.OP_AND,
     'AND': OP.OP_AND, 'match': OP.OP_MATCH, 'matchall': OP.OP_MATCH_ALL,
     'MATCH': OP.OP_MATCH, 'MATCHALL': OP.OP_MATCH_ALL, 'not match': OP.OP_NOT_MATCH,
     'not like': OP.OP_NOT_LIKE, 'NOT LIKE': OP.OP_NOT_LIKE, 'NOT MATCH': OP.OP_NOT_MATCH
 }
 
+_METRIC_OP = {OP.OP_COUNT, OP.OP_SUM, OP.OP_MAX, OP.OP_MIN, OP.OP_AVG}
+
+_INTERVAL_PATTERN = re.compile(r'^(?P<value>\d+)(?P<unit>ms|s|m|h|d|w|M|q|y)$')
+_CALENDAR_UNITS = {'m', 'h', 'd', 'w', 'M', 'q', 'y'}
+_FIXED_UNITS = {'ms', 's', 'm', 'h', 'd'}
+_CALENDAR_NAMES = {'minute': '1m', 'hour': '1h', 'day': '1d', 'week': '1w', 'month': '1M', 'quarter': '1q',
+                   'year': '1y'}
+
 
 def _e(op, inv=False):
     def inner(self, rhs):
@@ -98,6 +113,94 @@ class Expr(Node):
         return Expr(self.lhs, self.op, self.rhs)
 
 
+class Param(Node):
+    """
+    named placeholder of a where-clause value, bound when a prepared sql executes
+    """
+
+    def __init__(self, name):
+        super(Param, self).__init__()
+        self.name = name
+
+    def __repr__(self):
+        return ':{}'.format(self.name)
+
+
+def distinct(field, precision_threshold=None):
+    """
+    approximate count of distinct values of field (cardinality aggregation)
+    :param precision_threshold: counts below it are expected to be close to accurate, more memory per bucket
+    """
+    options = (('precision_threshold', int(precision_threshold)),) if precision_threshold else None
+    return Expr(field, OP.OP_CARDINALITY, options)
+
+
+def percentiles(field, *percents, compression=None):
+    """
+    approximate percentiles of field (TDigest backed percentiles aggregation)
+    :param percents: eg. 50, 95, 99, elasticsearch default percents when empty
+    :param compression: TDigest compression, higher is more accurate and uses more memory
+    """
+    options = []
+    if percents:
+        options.append(('percents', tuple(float(percent) for percent in percents)))
+    if compression:
+        options.append(('compression', float(compression)))
+    return Expr(field, OP.OP_PERCENTILES, tuple(options) or None)
+
+
+def date_trunc(interval, field, time_zone=None, min_doc_count=None, extended_bounds=None):
+    """
+    group by field truncated to interval (date_histogram aggregation), eg. date_trunc('1h', Model.timestamp)
+    :param interval: calendar interval (1m, 1h, 1d, 1w, 1M, 1q, 1y or minute, hour, day, week, month, quarter,
+                     year) or fixed interval (eg. 30s, 5m, 12h, 90d)
+    :param time_zone: time zone of buckets, time zone of Date field by default
+    :param min_doc_count: 0 to keep empty buckets
+    :param extended_bounds: (min, max) the buckets cover even without documents, datetime or date math string
+    """
+    interval = _CALENDAR_NAMES.get(str(interval).lower(), str(interval).strip())
+    match = _INTERVAL_PATTERN.match(interval)
+    if not match:
+        raise ValueError(u'ERROR: invalid date_trunc interval {}'.format(interval))
+    value, unit = int(match.group('value')), match.group('unit')
+    if value == 1 and unit in _CALENDAR_UNITS:
+        options = [('calendar_interval', interval)]
+    elif unit in _FIXED_UNITS:
+        options = [('fixed_interval', interval)]
+    else:
+        raise ValueError(u'ERROR: {} can only be a calendar interval of 1{}'.format(interval, unit))
+    if time_zone:
+        options.append(('time_zone', str(time_zone)))
+    if min_doc_count is not None:
+        options.append(('min_doc_count', int(min_doc_count)))
+    if extended_bounds:
+        bound = field.validate if isinstance(field, Date) else datetime.isoformat
+        bounds = [bound(value) if isinstance(value, (datetime, date)) else value for value in extended_bounds]
+        options.append(('extended_bounds', (('min', bounds[0]), ('max', bounds[1]))))
+    return Expr(field, OP.OP_DATE_TRUNC, tuple(options))
+
+
+def aggregate(func, field, args=(), is_distinct=False):
+    """
+    aggregation expression of sql function func(field, args...), eg. max(x), count(distinct x),
+    distinct(x, 3000) (precision threshold), percentile(x, 95) or percentiles(x, 50, 95, 99)
+    """
+    func = func.lower()
+    if is_distinct and func not in ('count', 'distinct'):
+        raise NotImplementedError(u'ERROR: DISTINCT is only supported in count aggregation')
+    if is_distinct or func == 'distinct':
+        if len(args) > 1:
+            raise ValueError(u'ERROR: distinct aggregation takes at most one precision threshold')
+        return distinct(field, *args)
+    if func in ('percentile', 'percentiles'):
+        return percentiles(field, *args)
+    if func not in OP_DICT or OP_DICT[func] not in _METRIC_OP:
+        raise NotImplementedError(u'ERROR: {} aggregation not supported yet'.format(func))
+    if args:
+        raise ValueError(u'ERROR: {} aggregation takes no arguments'.format(func))
+    return Expr(field, OP_DICT[func], None)
+
+
 class FieldDescriptor(object):
 
     def __init__(self, field):
@@ -215,6 +318,22 @@ class Date(Field):
             raise ValueError('ERROR: Could not parse date from the value {}'.format(value))
         return datetime.strftime(value, '%Y-%m-%dT%H:%M:%S.%f%z')
 
+    def time_zone(self):
+        """
+        time zone of the field as elasticsearch time_zone parameter, zone id or utc offset
+        """
+        if self._timezone is None:
+            return None
+        filename = getattr(self._timezone, '_filename', None) or ''
+        if 'zoneinfo/' in filename:
+            return filename.split('zoneinfo/', 1)[1]
+        offset = self._timezone.utcoffset(datetime.now())
+        if offset is None:
+            return None
+        minutes = int(offset.total_seconds()) // 60
+        sign = '-' if minutes < 0 else '+'
+        return '{}{:02d}:{:02d}'.format(sign, abs(minutes) // 60, abs(minutes) % 60)
+
 
 class Object(Field):
 
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 21:10
+# @Author  : floatsliang
+# @File    : flight.py
+from concurrent.futures import Future
+from copy import deepcopy
+from threading import Lock
+
+# process wide SingleFlight, None when de-duplication is off
+group = None
+
+
+class SingleFlight(object):
+    """
+    run one call per key at a time, callers coming with the same key while it is in flight wait for it
+    and share its result (or exception) instead of calling again
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            # every waiter gets its own copy, documents it modifies are not seen by other callers
+            return deepcopy(future.result())
+        try:
+            res = func()
+        except BaseException as ex:
+            self._done(key)
+            future.set_exception(ex)
+            raise
+        self._done(key)
+        future.set_result(res)
+        return res
+
+    def _done(self, key):
+        # later callers start a new flight, waiters already holding the future still get the result
+        with self._lock:
+            del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+            }
+
+
+def single_flight(enabled=True):
+    """
+    turn on de-duplication of identical in-flight SelectSQL.execute() searches process wide,
+    searches are identical when client config, index, doc_type and compiled body are the same
+    :return: the SingleFlight in use, None when turned off
+    """
+    global group
+    group = SingleFlight() if enabled else None
+    return group
@@ -6,17 +6,49 @@ from six import add_metaclass
 from copy import copy, deepcopy
 
 from .epool import POOL
+from .aio import AIO_POOL
 from .sql import SelectSQL, InsertSQL, DeleteSQL, UpdateSQL
-from .field import Field, FieldDescriptor
+from .field import Field, FieldDescriptor, Date
+from .pruning import IndexPattern
 from .utils import result_wrapper
 
 
+def _first_date_field(attrs):
+    """
+    stored name of the first Date field of model, time field of index pattern unless named
+    """
+    for attr_name, attr in attrs.items():
+        field = attr.field if isinstance(attr, FieldDescriptor) else attr
+        if isinstance(field, Date):
+            return field.get_name() or attr_name
+    return '@timestamp'
+
+
+def _stored_name(attrs, name):
+    """
+    stored field name of model attribute name, name itself when it is no field of model
+    """
+    attr = attrs.get(name)
+    field = attr.field if isinstance(attr, FieldDescriptor) else attr
+    return (field.get_name() or name) if isinstance(field, Field) else name
+
+
 class ModelOptions(object):
 
     def __init__(self, name, bases, attrs):
-        self.index = attrs.get('__index__', name)
+        pattern = attrs.get('__index_pattern__', None)
+        self.index_pattern = None
+        if pattern:
+            time_field = attrs.get('__index_time_field__', None) or _first_date_field(attrs)
+            self.index_pattern = IndexPattern(pattern, attrs.get('__index_granularity__', 'day'), time_field)
+        self.index = attrs.get('__index__', self.index_pattern.wildcard if pattern else name)
+        routing = attrs.get('__routing__', None)
+        self.routing = _stored_name(attrs, routing) if routing else None
         self.database = attrs.get('__database__', {})
         self.doc_type = attrs.get('__doc_type__', None)
+        # client is bound once per model, queries reuse it until database is overridden or pool reloaded
+        self.client = POOL.bind(self.database)
+        self.aio_client = AIO_POOL.bind(self.database)
 
 
 class ModelMeta(type):
@@ -70,6 +102,8 @@ class BaseModel(object):
 
     def database(self, database):
         self._meta.database = database
+        self._meta.client = POOL.bind(database)
+        self._meta.aio_client = AIO_POOL.bind(database)
 
     def get_index(self):
         return self._meta.index
@@ -91,28 +125,30 @@ class BaseModel(object):
 
     @classmethod
     def insert(cls, *rows):
-        return InsertSQL(cls, values=rows)
+        return InsertSQL(cls).values(*rows)
 
     @classmethod
     @result_wrapper
     def get_many(cls, fields: list, index=None, where=None, database=None, **kwargs):
-        result = SelectSQL(cls,
-                           index=index,
-                           database=database,
-                           **kwargs)\
-            .fields(*fields)\
-            .where(where)\
-            .limit(kwargs.get('limit'), None)\
-            .offset(kwargs.get('offset', None)).execute()
-        return result
+        sql = SelectSQL(cls, index=index, database=database, **kwargs).fields(*fields)
+        if where is not None:
+            sql.where(where)
+        if kwargs.get('limit') is not None:
+            sql.limit(kwargs['limit'])
+        if kwargs.get('offset') is not None:
+            sql.offset(kwargs['offset'])
+        return sql.execute()
 
     @classmethod
-    @result_wrapper
     def get_one(cls, fields: list, index=None, where=None, database=None, **kwargs):
         kwargs['limit'] = 1
         return cls.get_many(fields=fields, index=index, where=where, database=database, **kwargs)
 
     def save(self):
-        doc = self._data
-        insert_sql = InsertSQL(self).values(doc)
-        return insert_sql.execute()
+        insert_sql = InsertSQL(self.__class__, index=self.get_index(), database=self.get_database()).values(self)
+        ok, item = next(insert_sql.execute_iter())
+        res = next(iter(item.values()))
+        if not ok:
+            raise Exception(u'ERROR: save document failed, {}'.format(res.get('error')))
+        self._data['_id'] = res['_id']
+        return res
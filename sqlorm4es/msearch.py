@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 20:05
+# @Author  : floatsliang
+# @File    : msearch.py
+from concurrent.futures import Future
+from contextlib import contextmanager
+from threading import local, Lock, Condition
+from timeit import default_timer
+
+from elasticsearch.exceptions import HTTP_EXCEPTIONS, TransportError
+
+from .utils import SearchResult, json_dumps
+
+_MSEARCH_MAX_SIZE = 100
+_COALESCE_WINDOW = 0.002
+_COALESCE_MAX_SIZE = 50
+
+_local = local()
+# process wide Coalescer, None when coalescing is off
+coalescer = None
+
+
+def _msearch(conn, searches):
+    """
+    send (sql, query) pairs as one _msearch request, responses are in the order of searches
+    """
+    lines = []
+    for sql, query in searches:
+        header = {'index': sql._index}
+        if sql._doc_type:
+            header['type'] = sql._doc_type
+        if sql._ignore_unavailable:
+            header['ignore_unavailable'] = True
+        if sql._routing_value:
+            header['routing'] = sql._routing_value
+        lines.append(json_dumps(header))
+        lines.append(query if isinstance(query, bytes) else json_dumps(query))
+    lines.append(b'')
+    responses = conn.msearch(body=b'\n'.join(lines))['responses']
+    if len(responses) != len(searches):
+        raise Exception(u'ERROR: _msearch answered {} responses for {} searches'.format(
+            len(responses), len(searches)))
+    return responses
+
+
+def _group_by_client(searches):
+    """
+    group searches by client config preserving order, one _msearch goes over one client
+    """
+    groups = {}
+    for search in searches:
+        groups.setdefault(search[0]._bound_client().key, []).append(search)
+    return groups.values()
+
+
+def _response_error(res):
+    error = res['error']
+    if isinstance(error, dict) and 'type' in error:
+        error = error['type']
+    status = res.get('status', 'N/A')
+    return HTTP_EXCEPTIONS.get(status, TransportError)(status, error, res)
+
+
+class MSearchBatch(object):
+    """
+    searches executed in a batch() block, sent as _msearch requests when block exits
+    """
+
+    def __init__(self, max_size=_MSEARCH_MAX_SIZE):
+        self._max_size = max(int(max_size), 1)
+        self._searches = []
+
+    def __len__(self):
+        return len(self._searches)
+
+    def add(self, sql, query):
+        """
+        queue a search, returned SearchResult is empty until batch is flushed
+        """
+        result = SearchResult()
+        self._searches.append((sql, query, result))
+        return result
+
+    def flush(self):
+        """
+        send queued searches and fill their results, failed search is reported in its meta
+        """
+        searches, self._searches = self._searches, []
+        for group in _group_by_client(searches):
+            with group[0][0]._lease() as conn:
+                for i in range(0, len(group), self._max_size):
+                    chunk = group[i:i + self._max_size]
+                    responses = _msearch(conn, [(sql, query) for sql, query, _ in chunk])
+                    for (_, _, result), res in zip(chunk, responses):
+                        result.init(res)
+
+
+@contextmanager
+def batch(max_size=_MSEARCH_MAX_SIZE):
+    """
+    SelectSQL.execute() in the block returns an empty SearchResult at once, searches are sent as _msearch
+    (max_size searches each) when block exits and every result is filled in place:
+
+        with batch():
+            errors = LogCenter.select().where(LogCenter.message == 'error').execute()
+            slow = LogCenter.select().where(LogCenter.took > 1000).execute()
+        print(errors['data'], slow['data'])
+    """
+    pending = MSearchBatch(max_size)
+    stack = getattr(_local, 'batches', None)
+    if stack is None:
+        stack = _local.batches = []
+    stack.append(pending)
+    try:
+        yield pending
+    except BaseException:
+        stack.pop()
+        raise
+    stack.pop()
+    pending.flush()
+
+
+def current_batch():
+    """
+    innermost batch() block of current thread, None when not in a block
+    """
+    stack = getattr(_local, 'batches', None)
+    return stack[-1] if stack else None
+
+
+class Coalescer(object):
+    """
+    merge searches issued by different threads on the same client within window seconds into one _msearch,
+    first search of a window waits for the others (at most window seconds or until max_size searches come)
+    and sends them all, every caller blocks until its own response arrives
+    """
+
+    def __init__(self, window=_COALESCE_WINDOW, max_size=_COALESCE_MAX_SIZE):
+        self._window = window
+        self._max_size = max(int(max_size), 1)
+        self._cond = Condition(Lock())
+        self._groups = {}
+        self.searches = 0
+        self.requests = 0
+
+    def _take(self, key, group):
+        if self._groups.get(key) is group:
+            del self._groups[key]
+
+    def submit(self, sql, query):
+        """
+        search query of sql, response of elasticsearch is returned like conn.search()
+        """
+        key = sql._bound_client().key
+        future = Future()
+        with self._cond:
+            group = self._groups.get(key)
+            leader = group is None
+            if leader:
+                group = self._groups[key] = []
+            group.append((sql, query, future))
+            if len(group) >= self._max_size:
+                self._take(key, group)
+                self._cond.notify_all()
+            if leader:
+                deadline = default_timer() + self._window
+                while self._groups.get(key) is group:
+                    remain = deadline - default_timer()
+                    if remain <= 0:
+                        self._take(key, group)
+                        break
+                    self._cond.wait(remain)
+                self.searches += len(group)
+                self.requests += 1
+        if leader:
+            self._send(group)
+        return future.result()
+
+    @staticmethod
+    def _send(group):
+        try:
+            with group[0][0]._lease() as conn:
+                if len(group) == 1:
+                    sql, query, future = group[0]
+                    future.set_result(conn.search(index=sql._index, body=query, **sql._request_kwargs()))
+                    return
+                responses = _msearch(conn, [(sql, query) for sql, query, _ in group])
+        except Exception as ex:
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+        for (_, _, future), res in zip(group, responses):
+            if 'error' in res:
+                future.set_exception(_response_error(res))
+            else:
+                future.set_result(res)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'searches': self.searches,
+                'requests': self.requests,
+                'window': self._window,
+                'max_size': self._max_size,
+            }
+
+
+def coalesce(window=_COALESCE_WINDOW, max_size=_COALESCE_MAX_SIZE):
+    """
+    turn on coalescing of concurrent SelectSQL.execute() calls process wide, window=None turns it off
+    :return: the Coalescer in use, None when turned off
+    """
+    global coalescer
+    coalescer = Coalescer(window, max_size) if window else None
+    return coalescer
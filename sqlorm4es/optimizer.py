@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 13:10
+# @Author  : floatsliang
+# @File    : optimizer.py
+from numbers import Number
+from collections import OrderedDict
+
+from .field import OP, Expr, Field, Node
+from .utils import split_in_value
+
+_LOGICAL_OP = {
+    OP.OP_AND: 'AND',
+    OP.OP_OR: 'OR',
+}
+
+_RANGE_OP = {
+    OP.OP_GT: 'gt',
+    OP.OP_GTE: 'gte',
+    OP.OP_LT: 'lt',
+    OP.OP_LTE: 'lte',
+}
+
+_RANGE_BOUND_OP = {v: k for k, v in _RANGE_OP.items()}
+
+_LOWER_BOUND = {'gt', 'gte'}
+
+_OP_SYMBOL = {
+    OP.OP_ADD: '+', OP.OP_SUB: '-', OP.OP_MUL: '*', OP.OP_DIV: '/', OP.OP_XOR: '^',
+    OP.OP_EQ: '=', OP.OP_NE: '!=', OP.OP_LT: '<', OP.OP_LTE: '<=', OP.OP_GT: '>', OP.OP_GTE: '>=',
+    OP.OP_IN: 'IN', OP.OP_LIKE: 'LIKE', OP.OP_NOT_LIKE: 'NOT LIKE', OP.OP_MATCH: 'MATCH',
+    OP.OP_NOT_MATCH: 'NOT MATCH', OP.OP_MATCH_ALL: 'MATCHALL',
+    OP.OP_COUNT: 'count', OP.OP_SUM: 'sum', OP.OP_MAX: 'max', OP.OP_MIN: 'min', OP.OP_AVG: 'avg',
+}
+
+
+class _Group(object):
+    __slots__ = ('op', 'children')
+
+    def __init__(self, op, children):
+        self.op = op
+        self.children = children
+
+
+def _leaf_parts(node):
+    """
+    split a simple predicate into (field, field name, literal),
+    None if it compares anything but a plain field with a literal
+    """
+    if not isinstance(node, Expr) or node.op in _LOGICAL_OP:
+        return None
+    if isinstance(node.lhs, Field):
+        field, literal = node.lhs, node.rhs
+    elif isinstance(node.rhs, Field):
+        field, literal = node.rhs, node.lhs
+    elif isinstance(node.lhs, str):
+        field, literal = node.lhs, node.rhs
+    else:
+        return None
+    if isinstance(literal, Node):
+        return None
+    name = field.get_name() if isinstance(field, Field) else field
+    return field, name, literal
+
+
+def _literal_key(literal):
+    if isinstance(literal, (list, tuple)):
+        return tuple(_literal_key(v) for v in literal)
+    if isinstance(literal, dict):
+        return tuple(sorted((k, _literal_key(v)) for k, v in literal.items()))
+    try:
+        hash(literal)
+    except TypeError:
+        return repr(literal)
+    return literal.__class__, literal
+
+
+def _is_number(val):
+    return isinstance(val, Number) and not isinstance(val, bool)
+
+
+def _tighter(curr, new):
+    """
+    tighter one of two bounds on the same side, None if they can not be compared
+    """
+    (curr_key, curr_val), (new_key, new_val) = curr, new
+    if _literal_key(curr_val) == _literal_key(new_val):
+        return curr if curr_key in ('gt', 'lt') else new
+    if not _is_number(curr_val) or not _is_number(new_val):
+        return None
+    if curr_key in _LOWER_BOUND:
+        return new if new_val > curr_val else curr
+    return new if new_val < curr_val else curr
+
+
+class WhereOptimizer(object):
+    """
+    rewrite where expression tree before it is compiled to bool query:
+    flatten nested AND/OR, fold same field equality in OR into terms,
+    merge range bounds of the same field in AND and drop duplicate predicates
+    """
+
+    def __init__(self):
+        self.rewrites = []
+
+    def optimize(self, node):
+        if not isinstance(node, Expr) or node.op not in _LOGICAL_OP:
+            return node
+        return self._build(self._rewrite(self._flatten(node)))
+
+    def _flatten(self, node):
+        children = []
+        nested = 0
+        node_stack = [(node, False)]
+        while node_stack:
+            curr, is_rhs = node_stack.pop()
+            if isinstance(curr, Expr) and curr.op is node.op:
+                if is_rhs:
+                    nested += 1
+                node_stack.append((curr.rhs, True))
+                node_stack.append((curr.lhs, False))
+            elif isinstance(curr, Expr) and curr.op in _LOGICAL_OP:
+                children.append(self._flatten(curr))
+            else:
+                children.append(curr)
+        if nested:
+            self.rewrites.append(u'flatten {} nested {} into parent'.format(nested, _LOGICAL_OP[node.op]))
+        return _Group(node.op, children)
+
+    def _rewrite(self, group):
+        children = []
+        for child in group.children:
+            if isinstance(child, _Group):
+                child = self._rewrite(child)
+            if isinstance(child, _Group) and child.op is group.op:
+                self.rewrites.append(u'flatten nested {} into parent'.format(_LOGICAL_OP[group.op]))
+                children.extend(child.children)
+            else:
+                children.append(child)
+        group.children = children
+        if group.op is OP.OP_OR:
+            self._fold_terms(group)
+        else:
+            self._merge_ranges(group)
+        self._drop_duplicates(group)
+        if len(group.children) == 1:
+            return group.children[0]
+        return group
+
+    def _fold_terms(self, group):
+        folding = OrderedDict()
+        for i, child in enumerate(group.children):
+            if not isinstance(child, Expr) or child.op not in (OP.OP_EQ, OP.OP_IN):
+                continue
+            parts = _leaf_parts(child)
+            if parts is None:
+                continue
+            field, name, literal = parts
+            if name not in folding:
+                folding[name] = (field, [])
+            folding[name][1].append(i)
+        removed = set()
+        replaced = {}
+        for name, (field, members) in folding.items():
+            if len(members) < 2:
+                continue
+            values = []
+            seen = set()
+            for i in members:
+                child = group.children[i]
+                literal = _leaf_parts(child)[2]
+                for val in ([literal] if child.op is OP.OP_EQ else split_in_value(literal)):
+                    key = _literal_key(val)
+                    if key not in seen:
+                        seen.add(key)
+                        values.append(val)
+            replaced[members[0]] = Expr(field, OP.OP_IN, values)
+            removed.update(members[1:])
+            self.rewrites.append(u'fold {} predicates on {} into terms'.format(len(members), name))
+        if replaced:
+            group.children = [replaced.get(i, child) for i, child in enumerate(group.children) if i not in removed]
+
+    def _merge_ranges(self, group):
+        bounds = OrderedDict()
+        for i, child in enumerate(group.children):
+            if not isinstance(child, Expr) or (child.op not in _RANGE_OP and child.op is not OP.OP_RANGE):
+                continue
+            parts = _leaf_parts(child)
+            if parts is None:
+                continue
+            field, name, literal = parts
+            if child.op is OP.OP_RANGE:
+                if not isinstance(literal, dict):
+                    continue
+                items = list(literal.items())
+            else:
+                items = [(_RANGE_OP[child.op], literal)]
+            if name not in bounds:
+                bounds[name] = (i, field, [], [])
+            bounds[name][2].append(i)
+            bounds[name][3].extend(items)
+        removed = set()
+        replaced = {}
+        for name, (first, field, members, items) in bounds.items():
+            if len(items) < 2:
+                continue
+            lower = upper = None
+            leftovers = []
+            for item in items:
+                curr = lower if item[0] in _LOWER_BOUND else upper
+                if curr is not None:
+                    tighter = _tighter(curr, item)
+                    if tighter is None:
+                        leftovers.append(item)
+                        continue
+                    item = tighter
+                if item[0] in _LOWER_BOUND:
+                    lower = item
+                else:
+                    upper = item
+            merged = [dict(b for b in (lower, upper) if b)] + [dict([b]) for b in leftovers]
+            if len(merged) >= len(members):
+                continue
+            new_leaves = []
+            for bound in merged:
+                if len(bound) == 1:
+                    ((key, val),) = bound.items()
+                    new_leaves.append(Expr(field, _RANGE_BOUND_OP[key], val))
+                else:
+                    new_leaves.append(Expr(field, OP.OP_RANGE, bound))
+            replaced[first] = new_leaves
+            removed.update(members)
+            self.rewrites.append(u'merge {} range predicates on {} into {}'.format(
+                len(items), name, len(new_leaves)))
+        if replaced:
+            children = []
+            for i, child in enumerate(group.children):
+                if i in replaced:
+                    children.extend(replaced[i])
+                elif i not in removed:
+                    children.append(child)
+            group.children = children
+
+    def _drop_duplicates(self, group):
+        seen = set()
+        children = []
+        for child in group.children:
+            parts = _leaf_parts(child)
+            if parts is not None:
+                key = (child.op, parts[1], _literal_key(parts[2]))
+                if key in seen:
+                    self.rewrites.append(u'drop duplicate predicate {}'.format(format_expr(child)))
+                    continue
+                seen.add(key)
+            children.append(child)
+        group.children = children
+
+    def _build(self, node):
+        if not isinstance(node, _Group):
+            return node
+        children = [self._build(child) for child in node.children]
+        expr = children[0]
+        for child in children[1:]:
+            expr = Expr(expr, node.op, child)
+        return expr
+
+
+def _format_operand(node):
+    if isinstance(node, Field):
+        return node.get_name()
+    if isinstance(node, Expr):
+        if node.op in _LOGICAL_OP:
+            return u'({})'.format(format_expr(node))
+        return format_expr(node)
+    return repr(node)
+
+
+def format_expr(node):
+    """
+    readable sql-like text of a where expression
+    """
+    if not isinstance(node, Expr):
+        return _format_operand(node)
+    if node.op in _LOGICAL_OP:
+        children = []
+        node_stack = [node]
+        while node_stack:
+            curr = node_stack.pop()
+            if isinstance(curr, Expr) and curr.op is node.op:
+                node_stack.append(curr.rhs)
+                node_stack.append(curr.lhs)
+            else:
+                children.append(_format_operand(curr))
+        return u' {} '.format(_LOGICAL_OP[node.op]).join(children)
+    if node.op in (OP.OP_COUNT, OP.OP_SUM, OP.OP_MAX, OP.OP_MIN, OP.OP_AVG):
+        return u'{}({})'.format(_OP_SYMBOL[node.op], _leaf_name(node.lhs))
+    parts = _leaf_parts(node)
+    if parts is None:
+        return u'{} {} {}'.format(_format_operand(node.lhs), _OP_SYMBOL.get(node.op, node.op),
+                                  _format_operand(node.rhs))
+    field, name, literal = parts
+    if node.op is OP.OP_RANGE:
+        text = name
+        for key, val in sorted(literal.items()):
+            symbol = '<' if key in ('gt', 'lt') else '<='
+            if key in _LOWER_BOUND:
+                text = u'{!r} {} {}'.format(val, symbol, text)
+            else:
+                text = u'{} {} {!r}'.format(text, symbol, val)
+        return text
+    return u'{} {} {!r}'.format(name, _OP_SYMBOL.get(node.op, node.op), literal)
+
+
+def _leaf_name(node):
+    return node.get_name() if isinstance(node, Field) else str(node)
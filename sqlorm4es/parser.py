@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 14:20
+# @Author  : floatsliang
+# @File    : parser.py
+import re
+from collections import namedtuple
+
+from .field import OP, Expr, Param, aggregate, date_trunc
+from .utils import LRUCache
+
+_AST_CACHE_SIZE = 256
+
+_TOKEN_PATTERN = re.compile(r'''
+    (?P<ws>\s+)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?![^\s(),;=<>!]))
+  | (?P<param>:[A-Za-z_]\w*)
+  | (?P<op>==|!=|<>|>=|<=|=|<|>)
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<comma>,)
+  | (?P<semi>;)
+  | (?P<word>[^\s(),;'"=<>!]+)
+''', re.VERBOSE)
+
+_KEYWORDS = {'SELECT', 'FROM', 'WHERE', 'GROUP', 'ORDER', 'BY', 'LIMIT', 'OFFSET', 'AND', 'OR', 'NOT', 'IN',
+             'LIKE', 'MATCH', 'MATCHALL', 'ASC', 'DESC'}
+
+_COMPARE_OP = {
+    '=': OP.OP_EQ, '==': OP.OP_EQ, '!=': OP.OP_NE, '<>': OP.OP_NE,
+    '>': OP.OP_GT, '>=': OP.OP_GTE, '<': OP.OP_LT, '<=': OP.OP_LTE,
+}
+
+_MIRROR_OP = {
+    OP.OP_EQ: OP.OP_EQ, OP.OP_NE: OP.OP_NE, OP.OP_GT: OP.OP_LT,
+    OP.OP_GTE: OP.OP_LTE, OP.OP_LT: OP.OP_GT, OP.OP_LTE: OP.OP_GTE,
+}
+
+_AGGREGATES = {
+    'count': OP.OP_COUNT, 'sum': OP.OP_SUM, 'max': OP.OP_MAX, 'min': OP.OP_MIN, 'avg': OP.OP_AVG,
+    'distinct': OP.OP_CARDINALITY, 'percentile': OP.OP_PERCENTILES, 'percentiles': OP.OP_PERCENTILES,
+}
+
+_AGGREGATE_NAMES = {v: k for k, v in _AGGREGATES.items()}
+
+Token = namedtuple('Token', ['kind', 'value', 'pos'])
+
+# parsed statements are cached and shared, so AST nodes are immutable tuples
+SelectStmt = namedtuple('SelectStmt', ['fields', 'index', 'where', 'group_by', 'order_by', 'limit', 'offset'])
+BoolOp = namedtuple('BoolOp', ['op', 'lhs', 'rhs'])
+Predicate = namedtuple('Predicate', ['field', 'op', 'value'])
+# args are the aggregation options, eg. (('precision_threshold', 3000),)
+Aggregate = namedtuple('Aggregate', ['op', 'field', 'args'], defaults=(None,))
+ParamRef = namedtuple('ParamRef', ['name'])
+DateTrunc = namedtuple('DateTrunc', ['interval', 'field'])
+
+ast_cache = LRUCache(_AST_CACHE_SIZE)
+
+
+class SQLSyntaxError(ValueError):
+    pass
+
+
+def _unquote(text):
+    quote = text[0]
+    body = text[1:-1].replace(quote * 2, quote)
+    return re.sub(r'\\(.)', r'\1', body)
+
+
+def tokenize(text: str):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN_PATTERN.match(text, pos)
+        if not match:
+            raise SQLSyntaxError(u'ERROR: unexpected character {!r} at position {}'.format(text[pos], pos))
+        kind = match.lastgroup
+        if kind != 'ws':
+            value = match.group(kind)
+            if kind == 'string':
+                value = _unquote(value)
+            elif kind == 'number':
+                value = float(value) if any(c in value for c in '.eE') else int(value)
+            elif kind == 'param':
+                value = value[1:]
+            tokens.append(Token(kind, value, pos))
+        pos = match.end()
+    tokens.append(Token('eof', None, pos))
+    return tokens
+
+
+class _Parser(object):
+    """
+    recursive descent parser of select statement:
+
+    select     := SELECT fields [FROM word] [WHERE or_expr] [GROUP BY groups]
+                  [ORDER BY order [, order]*] [LIMIT number [(, | OFFSET) number]] [OFFSET number] [;]
+    group      := name | DATE_TRUNC '(' interval ',' name ')'
+    or_expr    := and_expr (OR and_expr)*
+    and_expr   := primary (AND primary)*
+    primary    := '(' or_expr ')' | predicate
+    predicate  := name compare value | value compare name | name [NOT] (LIKE | MATCH) value
+                | name MATCHALL value | name IN (values | :param)
+    """
+
+    def __init__(self, text):
+        self._text = text
+        self._tokens = tokenize(text)
+        self._pos = 0
+
+    def error(self, expected):
+        tok = self.peek()
+        found = 'end of statement' if tok.kind == 'eof' else repr(tok.value)
+        return SQLSyntaxError(u'ERROR: expected {} but found {} at position {} of {!r}'.format(
+            expected, found, tok.pos, self._text))
+
+    def peek(self):
+        return self._tokens[self._pos]
+
+    def advance(self):
+        tok = self._tokens[self._pos]
+        self._pos += 1
+        return tok
+
+    def is_keyword(self, *keywords):
+        tok = self.peek()
+        return tok.kind == 'word' and tok.value.upper() in keywords
+
+    def accept_keyword(self, keyword):
+        if self.is_keyword(keyword):
+            return self.advance()
+        return None
+
+    def expect_keyword(self, keyword):
+        if not self.is_keyword(keyword):
+            raise self.error(keyword)
+        return self.advance()
+
+    def accept(self, kind):
+        if self.peek().kind == kind:
+            return self.advance()
+        return None
+
+    def expect(self, kind):
+        if self.peek().kind != kind:
+            raise self.error(kind)
+        return self.advance()
+
+    def expect_end(self):
+        self.accept('semi')
+        if self.peek().kind != 'eof':
+            raise self.error('end of statement')
+
+    def name(self):
+        tok = self.peek()
+        if tok.kind != 'word' or tok.value.upper() in _KEYWORDS:
+            raise self.error('field name')
+        return self.advance().value
+
+    def integer(self):
+        tok = self.peek()
+        if tok.kind != 'number' or not isinstance(tok.value, int):
+            raise self.error('integer')
+        return self.advance().value
+
+    def parse_select(self):
+        self.expect_keyword('SELECT')
+        fields = self.parse_fields()
+        index = where = limit = offset = None
+        group_by = order_by = ()
+        if self.accept_keyword('FROM'):
+            index = self.name()
+        if self.accept_keyword('WHERE'):
+            where = self.parse_or()
+        if self.accept_keyword('GROUP'):
+            self.expect_keyword('BY')
+            group_by = self.parse_group_by()
+        if self.accept_keyword('ORDER'):
+            self.expect_keyword('BY')
+            order_by = self.parse_order_by()
+        if self.accept_keyword('LIMIT'):
+            limit = self.integer()
+            if self.accept('comma'):
+                offset, limit = limit, self.integer()
+        if self.accept_keyword('OFFSET'):
+            offset = self.integer()
+        self.expect_end()
+        return SelectStmt(fields, index, where, group_by, order_by, limit, offset)
+
+    def parse_condition(self):
+        where = self.parse_or()
+        self.expect_end()
+        return where
+
+    def parse_fields(self):
+        if self.peek().kind == 'word' and self.peek().value == '*':
+            self.advance()
+            return ()
+        fields = [self.parse_field()]
+        while self.accept('comma'):
+            fields.append(self.parse_field())
+        return tuple(fields)
+
+    def parse_field(self):
+        name = self.name()
+        if self.peek().kind == 'lparen' and name.lower() in _AGGREGATES:
+            self.advance()
+            is_distinct = self.accept_keyword('DISTINCT') is not None
+            field = self.name()
+            args = []
+            while self.accept('comma'):
+                tok = self.expect('number')
+                args.append(tok.value)
+            self.expect('rparen')
+            try:
+                expr = aggregate(name, field, args, is_distinct)
+            except (ValueError, NotImplementedError) as ex:
+                raise SQLSyntaxError(u'{} in {!r}'.format(ex, self._text))
+            return Aggregate(expr.op, field, expr.rhs)
+        return name
+
+    def parse_names(self):
+        names = [self.name()]
+        while self.accept('comma'):
+            names.append(self.name())
+        return tuple(names)
+
+    def parse_group_by(self):
+        names = [self.parse_group()]
+        while self.accept('comma'):
+            names.append(self.parse_group())
+        return tuple(names)
+
+    def parse_group(self):
+        name = self.name()
+        if self.peek().kind == 'lparen' and name.lower() == 'date_trunc':
+            self.advance()
+            tok = self.peek()
+            if tok.kind not in ('string', 'word'):
+                raise self.error('date_trunc interval')
+            interval = self.advance().value
+            self.expect('comma')
+            field = self.name()
+            self.expect('rparen')
+            return DateTrunc(interval, field)
+        return name
+
+    def parse_order_by(self):
+        order_by = []
+        while 1:
+            field = self.parse_field()
+            order = 'asc'
+            if self.is_keyword('ASC', 'DESC'):
+                order = self.advance().value.lower()
+            order_by.append((field, order))
+            if not self.accept('comma'):
+                return tuple(order_by)
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.accept_keyword('OR'):
+            node = BoolOp(OP.OP_OR, node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_primary()
+        while self.accept_keyword('AND'):
+            node = BoolOp(OP.OP_AND, node, self.parse_primary())
+        return node
+
+    def parse_primary(self):
+        if self.accept('lparen'):
+            node = self.parse_or()
+            self.expect('rparen')
+            return node
+        return self.parse_predicate()
+
+    def parse_predicate(self):
+        if self.peek().kind in ('string', 'number', 'param'):
+            value = self.parse_value()
+            op = _COMPARE_OP[self.expect('op').value]
+            return Predicate(self.name(), _MIRROR_OP[op], value)
+        field = self.name()
+        tok = self.peek()
+        if tok.kind == 'op':
+            self.advance()
+            return Predicate(field, _COMPARE_OP[tok.value], self.parse_value())
+        if self.accept_keyword('NOT'):
+            if self.accept_keyword('LIKE'):
+                return Predicate(field, OP.OP_NOT_LIKE, self.parse_value())
+            if self.accept_keyword('MATCH'):
+                return Predicate(field, OP.OP_NOT_MATCH, self.parse_value())
+            raise self.error('LIKE or MATCH after NOT')
+        if self.accept_keyword('LIKE'):
+            return Predicate(field, OP.OP_LIKE, self.parse_value())
+        if self.accept_keyword('MATCHALL'):
+            return Predicate(field, OP.OP_MATCH_ALL, self.parse_value())
+        if self.accept_keyword('MATCH'):
+            return Predicate(field, OP.OP_MATCH, self.parse_value())
+        if self.accept_keyword('IN'):
+            if self.peek().kind == 'param':
+                return Predicate(field, OP.OP_IN, self.parse_value())
+            return Predicate(field, OP.OP_IN, self.parse_values())
+        raise self.error('comparison operator')
+
+    def parse_values(self):
+        self.expect('lparen')
+        values = [self.parse_value()]
+        while self.accept('comma') or self.accept('semi'):
+            values.append(self.parse_value())
+        self.expect('rparen')
+        return tuple(values)
+
+    def parse_value(self):
+        tok = self.peek()
+        if tok.kind in ('string', 'number'):
+            return self.advance().value
+        if tok.kind == 'param':
+            return ParamRef(self.advance().value)
+        if tok.kind == 'word' and tok.value.upper() not in _KEYWORDS:
+            value = self.advance().value
+            upper = value.upper()
+            if upper == 'TRUE' or upper == 'FALSE':
+                return upper == 'TRUE'
+            return value
+        raise self.error('value')
+
+
+def parse_select(text: str) -> SelectStmt:
+    """
+    parse select statement into AST, cached by statement text
+    """
+    key = ('select', text)
+    stmt = ast_cache.get(key)
+    if stmt is None:
+        stmt = _Parser(text).parse_select()
+        ast_cache.set(key, stmt)
+    return stmt
+
+
+def parse_condition(text: str):
+    """
+    parse where condition into AST, cached by condition text
+    """
+    key = ('where', text)
+    where = ast_cache.get(key)
+    if where is None:
+        where = _Parser(text).parse_condition()
+        ast_cache.set(key, where)
+    return where
+
+
+def resolve_field(model_clazz, name: str):
+    """
+    model field of a (dotted) field name, the name itself if model has no such field
+    """
+    fields = getattr(model_clazz, '_fields', None)
+    if not fields:
+        return name
+    parts = name.split('.')
+    desc = fields.get(parts[0])
+    if desc is None:
+        return name
+    field = desc.field
+    for part in parts[1:]:
+        field = getattr(field, '_fields', {}).get(part)
+        if field is None:
+            return name
+    return field
+
+
+def build_where(node, model_clazz=None):
+    """
+    where expression of a where AST, field names resolved against model
+    """
+    if isinstance(node, BoolOp):
+        return Expr(build_where(node.lhs, model_clazz), node.op, build_where(node.rhs, model_clazz))
+    value = node.value
+    if isinstance(value, ParamRef):
+        value = Param(value.name)
+    elif isinstance(value, tuple):
+        value = list(value)
+    return Expr(resolve_field(model_clazz, node.field), node.op, value)
+
+
+def build_field(field):
+    if isinstance(field, Aggregate):
+        return Expr(field.field, field.op, field.args)
+    return field
+
+
+def build_group(field, model_clazz=None):
+    """
+    group by field of a group by AST item, field name of date_trunc resolved against model
+    """
+    if isinstance(field, DateTrunc):
+        try:
+            return date_trunc(field.interval, resolve_field(model_clazz, field.field))
+        except ValueError as ex:
+            raise SQLSyntaxError(str(ex))
+    return field
+
+
+def field_text(field):
+    if isinstance(field, Aggregate):
+        options = dict(field.args or ())
+        args = options.get('percents') or [options[k] for k in ('precision_threshold',) if k in options]
+        return u'{}({})'.format(_AGGREGATE_NAMES[field.op], ', '.join([field.field] + [str(a) for a in args]))
+    return field
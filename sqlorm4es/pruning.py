@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 00:20
+# @Author  : floatsliang
+# @File    : pruning.py
+import re
+from datetime import datetime, timedelta, timezone
+
+from dateutil import parser as date_parser
+from dateutil.relativedelta import relativedelta
+
+from .query import Bool
+from .utils import NOW_DATE_PATTERN
+
+_PLACEHOLDER_PATTERN = re.compile(r'\{[^{}]*\}')
+_EPOCH = datetime(1970, 1, 1)
+_GRANULARITY_STEPS = {
+    'hour': relativedelta(hours=1),
+    'day': relativedelta(days=1),
+    'week': relativedelta(weeks=1),
+    'month': relativedelta(months=1),
+    'year': relativedelta(years=1),
+}
+_NOW_UNITS = {'y': 'years', 'M': 'months', 'w': 'weeks', 'd': 'days', 'h': 'hours', 'H': 'hours',
+              'm': 'minutes', 's': 'seconds'}
+# more indices than this are searched by wildcard, index list is sent in url whose length es limits (4kb)
+_MAX_INDICES = 128
+
+
+def _utc(value):
+    """
+    naive UTC datetime of a date string (es date math now+/-N<unit> included), datetime or epoch millis
+    """
+    if isinstance(value, (int, float)):
+        return _EPOCH + timedelta(milliseconds=value)
+    if isinstance(value, str):
+        match = NOW_DATE_PATTERN.match(value)
+        if match:
+            moment = datetime.now(timezone.utc).replace(tzinfo=None)
+            if match.group('op'):
+                delta = relativedelta(**{_NOW_UNITS[match.group('unit')]: int(match.group('num'))})
+                moment = moment + delta if match.group('op') == '+' else moment - delta
+            return moment
+        value = date_parser.parse(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _conjuncts(node):
+    """
+    clauses every document matched by bool query node satisfies: its filter and must clauses,
+    nested bool queries without should are opened
+    """
+    clauses = []
+    for occur in ('filter', 'must'):
+        parts = node.get(occur) or []
+        for part in parts if isinstance(parts, list) else [parts]:
+            inner = part.get('bool') if isinstance(part, dict) else None
+            if inner is not None and not inner.get('should'):
+                clauses.extend(_conjuncts(inner))
+            else:
+                clauses.append(part)
+    return clauses
+
+
+class IndexPattern(object):
+    """
+    time based index names like logs-{:%Y.%m.%d}, a new index every granularity (hour, day, week, month, year)
+    of time field in UTC, searches are sent only to indices the time range of where clause falls in
+    """
+
+    def __init__(self, pattern, granularity='day', time_field='@timestamp'):
+        if granularity not in _GRANULARITY_STEPS:
+            raise ValueError(u'ERROR: index granularity must be one of {}'.format(
+                ', '.join(_GRANULARITY_STEPS)))
+        self.pattern = pattern
+        self.granularity = granularity
+        self.time_field = time_field
+        self.wildcard = re.sub(r'\*+', '*', _PLACEHOLDER_PATTERN.sub('*', pattern))
+
+    def _truncate(self, moment):
+        moment = moment.replace(minute=0, second=0, microsecond=0)
+        if self.granularity == 'hour':
+            return moment
+        moment = moment.replace(hour=0)
+        if self.granularity == 'week':
+            return moment - timedelta(days=moment.weekday())
+        if self.granularity == 'month':
+            return moment.replace(day=1)
+        if self.granularity == 'year':
+            return moment.replace(month=1, day=1)
+        return moment
+
+    def index_of(self, value):
+        """
+        index a document with time field value is written to
+        """
+        return self.pattern.format(_utc(value))
+
+    def indices(self, start=None, end=None, end_exclusive=False):
+        """
+        names of indices covering [start, end] ([start, end) when end_exclusive),
+        wildcard when either bound is unknown or too many indices
+        """
+        if start is None or end is None:
+            return [self.wildcard]
+        moment, end = self._truncate(_utc(start)), _utc(end)
+        step = _GRANULARITY_STEPS[self.granularity]
+        names = [self.pattern.format(moment)]
+        while 1:
+            moment += step
+            if moment > end or (end_exclusive and moment == end):
+                return names
+            if len(names) >= _MAX_INDICES:
+                return [self.wildcard]
+            name = self.pattern.format(moment)
+            if name != names[-1]:
+                names.append(name)
+
+    def prune(self, query):
+        """
+        comma separated indices a compiled query may find documents in, from range of time field
+        which all matched documents satisfy (see Bool.get_time_scope)
+        :param query: compiled query dict
+        """
+        ranges = [clause['range'][self.time_field] for clause in _conjuncts(query.get('query', {}).get('bool', {}))
+                  if isinstance(clause, dict) and self.time_field in clause.get('range', {})]
+        scope = Bool()
+        scope._work_dir = {'filter': [{'range': {self.time_field: bounds}} for bounds in ranges]}
+        try:
+            start, end = scope.get_time_scope(self.time_field)
+            end_exclusive = any(bounds.get('lt') == end for bounds in ranges)
+            return ','.join(self.indices(start or None, end or None, end_exclusive))
+        except (TypeError, ValueError, OverflowError):
+            return self.wildcard
+
+
+def routing_text(value):
+    """
+    routing of a field value as es takes it, booleans in lowercase
+    """
+    return ('true' if value else 'false') if isinstance(value, bool) else str(value)
+
+
+def routing_of(query, field):
+    """
+    comma separated routing values of compiled query whose where clause pins field with = or IN in AND,
+    None when it does not (search goes to all shards)
+    :param query: compiled query dict
+    :param field: stored name of routing field
+    """
+    values = None
+    for clause in _conjuncts(query.get('query', {}).get('bool', {})):
+        if not isinstance(clause, dict):
+            continue
+        if field in clause.get('term', {}):
+            term = clause['term'][field]
+            pinned = [term['value'] if isinstance(term, dict) else term]
+        elif field in clause.get('terms', {}):
+            pinned = clause['terms'][field]
+        else:
+            continue
+        values = pinned if values is None else [value for value in values if value in pinned]
+    if not values:
+        return None
+    texts = []
+    for value in values:
+        text = routing_text(value)
+        if text not in texts:
+            texts.append(text)
+    return ','.join(texts)
@@ -18,22 +18,19 @@ class InvalidVersionError(Exception):
     pass
 
 
-def _not_allowed(clazz, field_name):
-    def inner(*args, **kwargs):
-        pass
+_DEFAULT_VERSION = 5.1
 
-    if hasattr(clazz, 'with_' + field_name):
-        setattr(clazz, 'with_' + field_name, inner)
-    if hasattr(clazz, 'get_' + field_name):
-        setattr(clazz, 'get_' + field_name, inner)
+
+def _not_allowed(*args, **kwargs):
+    pass
 
 
 def _get_banned_field_list(clazz, version):
     banned_field_list = []
     if version < 7:
-        banned_field_list += clazz.get('_NOT_ALLOWED_7X', [])
+        banned_field_list += getattr(clazz, '_NOT_ALLOWED_7X', [])
     if version < 6:
-        banned_field_list += clazz.get('_NOT_ALLOWED_6X', [])
+        banned_field_list += getattr(clazz, '_NOT_ALLOWED_6X', [])
     return banned_field_list
 
 
@@ -54,28 +51,59 @@ def Q(name_or_query=None, *args, **kwargs):
 
 class Base(dict):
     _func_dict = {}
+    _version_tables = {}
+    _dispatch = {}
+    _banned = ()
 
-    def __init__(self, version=5.1, *args, **kwargs):
+    def __init_subclass__(cls, **kwargs):
+        super(Base, cls).__init_subclass__(**kwargs)
+        cls._func_dict = {k: v for k, v in inspect.getmembers(cls, inspect.isfunction) if k.startswith('with_')}
+        cls._version_tables = {}
+        cls._dispatch, cls._banned = cls._dispatch_table(_DEFAULT_VERSION)
+
+    @classmethod
+    def _dispatch_table(cls, version):
+        """
+        with_* dispatch table of the class with methods banned in given es version
+        replaced, resolved once per (class, version)
+        :return: (dispatch table, banned method names)
+        """
+        tables = cls._version_tables.get(version, None)
+        if tables is None:
+            table = dict(cls._func_dict)
+            banned = []
+            for field_name in _get_banned_field_list(cls, version):
+                for method_name in ('with_' + field_name, 'get_' + field_name):
+                    if hasattr(cls, method_name):
+                        banned.append(method_name)
+                        if method_name in table:
+                            table[method_name] = _not_allowed
+            tables = (table, tuple(banned))
+            cls._version_tables[version] = tables
+        return tables
+
+    def __init__(self, version=_DEFAULT_VERSION, *args, **kwargs):
         super(Base, self).__init__()
         version = float(version)
-        banned_field_list = _get_banned_field_list(self, version)
-        for field_name in banned_field_list:
-            _not_allowed(self, field_name)
-        for k, v in inspect.getmembers(self, inspect.ismethod):
-            if k.startswith('with_'):
-                self._func_dict[k] = v
+        if version != _DEFAULT_VERSION:
+            self._dispatch, self._banned = self._dispatch_table(version)
+        for method_name in self._banned:
+            setattr(self, method_name, _not_allowed)
 
         self._with_given_fields(*args, **kwargs)
 
     def __getattr__(self, field):
-        actual_field = 'with_' + field
-        return super(Base, self).__getattribute__(actual_field)
+        func = self._dispatch.get('with_' + field, None)
+        if func is None:
+            raise AttributeError(u'ERROR: {} has no field {}'.format(self.__class__.__name__, field))
+        return func.__get__(self, self.__class__)
 
     def _with_given_fields(self, *args, **kwargs):
+        dispatch = self._dispatch
         for k, v in kwargs.items():
             k = 'with_{}'.format(k.lower())
-            if k in self._func_dict:
-                self._func_dict[k](v)
+            if k in dispatch:
+                dispatch[k](self, v)
 
     def _validate_query_field(self, query: dict, copied=False):
         clazz_name = self.__class__.__name__.lower()
@@ -215,22 +243,22 @@ class Range(Base):
         super(Range, self).__init__(*args, **kwargs)
 
     def with_gte(self, gte: str):
-        if gte:
+        if gte is not None:
             self._work_dir['gte'] = '{}'.format(gte)
         return self
 
     def with_lte(self, lte: str):
-        if lte:
+        if lte is not None:
             self._work_dir['lte'] = '{}'.format(lte)
         return self
 
     def with_gt(self, gt: str):
-        if gt:
+        if gt is not None:
             self._work_dir['gt'] = '{}'.format(gt)
         return self
 
     def with_lt(self, lt: str):
-        if lt:
+        if lt is not None:
             self._work_dir['lt'] = '{}'.format(lt)
         return self
 
@@ -341,6 +369,47 @@ class Aggs(Base):
         self._work_dir[name] = aggs
         return self
 
+    def date_histogram(self, field, name='', order=None, **params):
+        """
+        :param params: calendar_interval or fixed_interval, time_zone, min_doc_count, extended_bounds...
+        """
+        if not name:
+            name = "group_by_{}".format(field)
+        aggs = {
+            "date_histogram": dict(params, field=field)
+        }
+        if order:
+            aggs['date_histogram']['order'] = {"_key": order}
+        self._work_dir[name] = aggs
+        return self
+
+    def composite(self, fields, name='composite', orders=None, size=None, after=None):
+        """
+        one composite aggregation with a source per field, buckets are paged with after key
+        :param fields: field names (terms source) or (name, source type, source params)
+        """
+        orders = orders or {}
+        sources = []
+        for field in fields:
+            if isinstance(field, str):
+                field = (field, 'terms', {"field": field})
+            field, source_type, params = field
+            source = dict(params)
+            if field in orders:
+                source['order'] = orders[field]
+            sources.append({field: {source_type: source}})
+        aggs = {
+            "composite": {
+                "sources": sources
+            }
+        }
+        if size:
+            aggs['composite']['size'] = int(size)
+        if after:
+            aggs['composite']['after'] = after
+        self._work_dir["group_by_{}".format(name)] = aggs
+        return self
+
     def metrics(self, field, name='', op='max'):
         if op is 'count':
             return self
@@ -353,6 +422,36 @@ class Aggs(Base):
         }
         return self
 
+    def cardinality(self, field, name='', precision_threshold=None):
+        if not name:
+            name = "cardinality_{}".format(field)
+        aggs = {
+            "field": field
+        }
+        if precision_threshold:
+            aggs['precision_threshold'] = int(precision_threshold)
+        self._work_dir[name] = {
+            "cardinality": aggs
+        }
+        return self
+
+    def percentiles(self, field, name='', percents=None, compression=None):
+        if not name:
+            name = "percentiles_{}".format(field)
+        aggs = {
+            "field": field
+        }
+        if percents:
+            aggs['percents'] = list(percents)
+        if compression:
+            aggs['tdigest'] = {
+                "compression": compression
+            }
+        self._work_dir[name] = {
+            "percentiles": aggs
+        }
+        return self
+
     def aggs(self, query, name):
         name = "group_by_" + name
         self._work_dir[name]['aggs'] = query
@@ -3,19 +3,39 @@
 # @Author  : floatsliang
 # @File    : sql.py
 from typing import Union
+import asyncio
 import re
-from copy import deepcopy
+from collections.abc import Mapping
+from contextlib import ExitStack
+from copy import copy, deepcopy
 
 from .epool import POOL
+from .aio import AIO_POOL
 from .compiler import QueryCompiler
-from .field import Expr, Field, OP_DICT, OP
-from .utils import result_wrapper, SearchResult
+from . import cache, flight, msearch
+from .msearch import current_batch
+from .optimizer import WhereOptimizer, format_expr
+from .parser import SQLSyntaxError, parse_select, parse_condition, build_where, build_field, build_group, \
+    field_text, resolve_field
+from .field import Expr, Field, OP_DICT, OP, aggregate, date_trunc
+from .columnar import ColumnBuilder, bucket_rows, default_fields, total_hits
+from .pruning import routing_of, routing_text
+from .utils import merge_iter, prefetch_iter, SearchResult, json_dumps
 
 _WHERE_PATTERN = re.compile(
     r'^\s*(?P<lhs>\S+)\s*(?P<op>(=|!=|<>|>=|<=|>|<|in|IN|LIKE|like|MATCH|match|MATCHALL|matchall))\s*(?P<rhs>\S+)\s*$')
 _AGG_PATTERN = re.compile(
-    r'^\s*(?P<aggs>(count|COUNT|sum|SUM|max|MAX|min|MIN|avg|AVG|distinct|DISTINCT))\(\s*(?P<field>\S+)\s*\)\s*$')
+    r'^\s*(?P<aggs>(count|COUNT|sum|SUM|max|MAX|min|MIN|avg|AVG|distinct|DISTINCT|percentiles?|PERCENTILES?))'
+    r'\(\s*(?P<distinct>(distinct|DISTINCT)\s+)?(?P<field>[^\s,()]+)(?P<args>(\s*,\s*[^\s,()]+)*)\s*\)\s*$')
+_DATE_TRUNC_PATTERN = re.compile(
+    r'^\s*(date_trunc|DATE_TRUNC)\(\s*[\'"]?(?P<interval>\w+)[\'"]?\s*,\s*(?P<field>[^\s,()]+)\s*\)\s*$')
 _ORDER_BY_PATTERN = re.compile(r'^\s*(?P<field>\S+),?(\s+(?P<order>(asc|ASC|desc|DESC)))?\s*$')
+_QUOTED_PATTERN = re.compile(r'\'(?:[^\'\\]|\\.)*\'|"(?:[^"\\]|\\.)*"')
+_COMPOUND_PATTERN = re.compile(r'\b(and|or)\b|[()]', re.IGNORECASE)
+
+_BULK_CHUNK_SIZE = 500
+_BULK_MAX_CHUNK_BYTES = 100 * 1024 * 1024
+_PAGE_SIZE = 1000
 
 
 def where_str_to_expr_dict(expr_str: str) -> dict:
@@ -33,7 +53,14 @@ def where_str_to_expr_dict(expr_str: str) -> dict:
     return expr_dict
 
 
-def parse_where(node: str):
+def parse_where(node: str, model_clazz=None):
+    try:
+        return build_where(parse_condition(node), model_clazz)
+    except SQLSyntaxError:
+        # fall back to single predicate split for unquoted values with spaces, eg. "message = hello world",
+        # compound conditions must parse
+        if _COMPOUND_PATTERN.search(_QUOTED_PATTERN.sub('', node)):
+            raise
     match_dict = where_str_to_expr_dict(node)
     if match_dict:
         if match_dict['op'].lower() not in OP_DICT:
@@ -68,9 +95,8 @@ def parse_aggs(node: str):
     match_agg = _AGG_PATTERN.match(node)
     if match_agg:
         match_dict = match_agg.groupdict()
-        if match_dict['aggs'].lower() not in OP_DICT:
-            raise NotImplementedError(u'ERROR: {} aggregation not supported yet'.format(match_dict['aggs']))
-        return Expr(match_dict['field'], OP_DICT[match_dict['aggs'].lower()], None)
+        args = [arg.strip() for arg in match_dict['args'].split(',')[1:]]
+        return aggregate(match_dict['aggs'], match_dict['field'], args, bool(match_dict['distinct']))
     return None
 
 
@@ -91,25 +117,44 @@ class SQL(object):
         self._model_clazz = model_clazz
         self._index = None
         self._database = None
+        self._client = None
+        self._aio_client = None
         self._doc_type = None
+        self._index_pattern = None
+        self._routing = None
+        # set on copies made by _narrowed: pruned indices may not exist, routing values of where clause
+        self._ignore_unavailable = False
+        self._routing_value = None
         if model_clazz:
             meta = getattr(model_clazz, '_meta')
             if meta:
                 self._index = getattr(meta, 'index', None)
                 self._database = getattr(meta, 'database', None)
+                self._client = getattr(meta, 'client', None)
+                self._aio_client = getattr(meta, 'aio_client', None)
                 self._doc_type = getattr(meta, 'doc_type', None)
+                self._index_pattern = getattr(meta, 'index_pattern', None)
+                self._routing = getattr(meta, 'routing', None)
         self._data['where'] = None
-        self._index = kwargs.get('index', None) or self._index
-        self._database = kwargs.get('database', None) or self._database
+        if kwargs.get('index', None) and kwargs['index'] != self._index:
+            self.index(kwargs['index'])
+        database = kwargs.get('database', None)
+        if database and database is not self._database:
+            self.database(database)
         self._doc_type = kwargs.get('doc_type', None) or self._doc_type
+        self._cache_ttl = None
+        self._use_cache = True
         self._compiler = QueryCompiler(self._data)
 
     def index(self, index):
         self._index = index
+        self._index_pattern = None
         return self
 
     def database(self, database):
         self._database = database
+        self._client = None
+        self._aio_client = None
         return self
 
     def doc_type(self, doc_type):
@@ -119,9 +164,15 @@ class SQL(object):
     def clone(self):
         new_sql = self.__class__(self._model_clazz)
         new_sql.index(self._index)
+        new_sql._index_pattern = self._index_pattern
+        new_sql._routing = self._routing
         new_sql.database(deepcopy(self._database))
+        new_sql._client = self._client
+        new_sql._aio_client = self._aio_client
         new_sql._data = deepcopy(self._data)
         new_sql._doc_type = self._doc_type
+        new_sql._use_cache = self._use_cache
+        new_sql._cache_ttl = self._cache_ttl
         new_sql._compiler = QueryCompiler(new_sql._data)
         return new_sql
 
@@ -129,7 +180,7 @@ class SQL(object):
         for node in nodes:
             if not isinstance(node, Expr):
                 if isinstance(node, str):
-                    node = parse_where(node)
+                    node = parse_where(node, self._model_clazz)
                 elif isinstance(node, (tuple, list)):
                     node = parse_where_tuple_expr(node)
                 else:
@@ -142,6 +193,73 @@ class SQL(object):
                 self._data['where'] &= node
         return self
 
+    def _bound_client(self):
+        client = self._client
+        if client is None:
+            client = self._client = POOL.bind(self._database)
+        return client
+
+    def _lease(self):
+        return self._bound_client().lease()
+
+    def _bound_aio_client(self):
+        client = self._aio_client
+        if client is None:
+            client = self._aio_client = AIO_POOL.bind(self._database)
+        return client
+
+    def _lease_async(self):
+        return self._bound_aio_client().lease()
+
+    def _request_kwargs(self):
+        kwargs = {}
+        if self._doc_type:
+            kwargs['doc_type'] = self._doc_type
+        if self._ignore_unavailable:
+            kwargs['ignore_unavailable'] = True
+        if self._routing_value:
+            kwargs['routing'] = self._routing_value
+        return kwargs
+
+    def _narrows(self):
+        return self._index_pattern is not None or self._routing is not None
+
+    def _narrowed(self, query=None):
+        """
+        copy of sql searching only indices of model index pattern the time range of where clause falls in,
+        and only shards of the values where clause pins model routing field to
+        :param query: compiled query dict, compiled from sql when None
+        """
+        if not self._narrows():
+            return self
+        query = self.compile() if query is None else query
+        sql = copy(self)
+        pattern = self._index_pattern
+        if pattern is not None:
+            sql._index = pattern.prune(query)
+            sql._index_pattern = None
+            sql._ignore_unavailable = sql._index != pattern.wildcard
+        if self._routing is not None:
+            sql._routing = None
+            sql._routing_value = routing_of(query, self._routing)
+        return sql
+
+    def explain_rewrite(self):
+        """
+        show how WhereOptimizer rewrites where clause before compiling
+        :return: dict of where clause before/after rewrite and applied rewrites
+        """
+        where = self._data['where']
+        if where is None:
+            return {'before': '', 'after': '', 'rewrites': []}
+        optimizer = WhereOptimizer()
+        optimized = optimizer.optimize(where)
+        return {
+            'before': format_expr(where),
+            'after': format_expr(optimized),
+            'rewrites': optimizer.rewrites,
+        }
+
     def compile(self):
         raise NotImplementedError
 
@@ -154,25 +272,205 @@ class InsertSQL(SQL):
     def __init__(self, model_clazz, **kwargs):
         if not model_clazz:
             raise Exception(u'InsertSQL must have index Model')
-        self._data = {'id': None, 'values': [], 'upsert': True, 'columns': model_clazz._fields}
+        fields = model_clazz._fields
+        # rows may name a field by its attribute or stored name, documents are written with stored names
+        columns = {desc.field.get_name(): desc for desc in fields.values()}
+        columns.update(fields)
+        self._data = {'id': None, 'values': [], 'upsert': True, 'columns': columns,
+                      'defaults': {fields[name].field.get_name(): value for name, value in model_clazz._data.items()},
+                      'chunk_size': _BULK_CHUNK_SIZE, 'max_chunk_bytes': _BULK_MAX_CHUNK_BYTES}
         super(InsertSQL, self).__init__(model_clazz, **kwargs)
 
     def id(self, doc_id):
+        """
+        document id of rows without their own _id
+        """
         self._data['id'] = doc_id
         return self
 
-    def values(self, rows):
-        pass
+    def values(self, *rows):
+        """
+        :param rows: dict, model instance or iterable of them, iterables are consumed lazily when executing
+        :return:
+        """
+        self._data['values'].extend(rows)
+        return self
 
     def upsert(self, insert_on_conflict=True):
         self._data['upsert'] = insert_on_conflict
         return self
 
+    def chunk(self, size: int = None, max_bytes: int = None):
+        """
+        split rows into _bulk requests of at most size documents and max_bytes request body
+        """
+        if size is not None:
+            self._data['chunk_size'] = max(int(size), 1)
+        if max_bytes is not None:
+            self._data['max_chunk_bytes'] = max(int(max_bytes), 1)
+        return self
+
+    def _iter_rows(self):
+        for row in self._data['values']:
+            if isinstance(row, Mapping) or hasattr(row, '_fields'):
+                yield row
+            else:
+                for sub_row in row:
+                    yield sub_row
+
+    def _validate_row(self, row):
+        if not isinstance(row, Mapping):
+            row = row._data
+        columns = self._data['columns']
+        doc = dict(self._data['defaults'])
+        doc_id = self._data['id']
+        for name, value in row.items():
+            if name == '_id':
+                doc_id = value
+                continue
+            if name not in columns:
+                raise ValueError(u'ERROR: field {} not defined in model {}'.format(
+                    name, self._model_clazz.__name__))
+            field = columns[name].field
+            if value is None:
+                doc[field.get_name()] = value
+            elif field.multi and isinstance(value, (list, tuple)):
+                doc[field.get_name()] = [field.validate(v) for v in value]
+            else:
+                doc[field.get_name()] = field.validate(value)
+        for desc in self._model_clazz._fields.values():
+            if desc.field.required and doc.get(desc.field.get_name()) is None:
+                raise ValueError(u'ERROR: required field {} is missing'.format(desc.field.get_name()))
+        return doc_id, doc
+
+    def _actions(self):
+        """
+        yield (action lines, None) for valid rows and (None, failed item) for rows failed validation
+        """
+        op = 'index' if self._data['upsert'] else 'create'
+        time_key = self._index_pattern.time_field if self._index_pattern is not None else None
+        routing_key = self._routing
+        for row in self._iter_rows():
+            meta = {}
+            try:
+                doc_id, doc = self._validate_row(row)
+                if time_key is not None:
+                    if doc.get(time_key) is None:
+                        # bulk request has no index, a document without its own would fail all of them
+                        raise ValueError(u'ERROR: time field {} is missing, index of document is unknown'.format(
+                            time_key))
+                    meta['_index'] = self._index_pattern.index_of(doc[time_key])
+                if routing_key is not None and doc.get(routing_key) is not None:
+                    meta['routing'] = routing_text(doc[routing_key])
+            except (ValueError, TypeError) as ex:
+                error = {'type': 'validation_exception', 'reason': str(ex)}
+                yield None, {op: {'_index': self._index, 'status': 400, 'error': error}}
+                continue
+            if doc_id is not None:
+                meta['_id'] = doc_id
+            yield json_dumps({op: meta}) + b'\n' + json_dumps(doc) + b'\n', None
+
+    def _bulk_index(self):
+        # documents of index pattern carry their own index, the wildcard cannot be written
+        return self._index if self._index_pattern is None else None
+
+    def _chunks(self):
+        """
+        yield (bulk request body, items) per chunk, items hold failed item of invalid rows
+        and None for each document in body, in row order
+        """
+        chunk_size = self._data['chunk_size']
+        max_bytes = self._data['max_chunk_bytes']
+        lines = []
+        items = []
+        chunk_bytes = 0
+        for line, failed in self._actions():
+            if failed is not None:
+                items.append(failed)
+                continue
+            if lines and (len(lines) >= chunk_size or chunk_bytes + len(line) > max_bytes):
+                yield b''.join(lines), items
+                lines, items, chunk_bytes = [], [], 0
+            lines.append(line)
+            items.append(None)
+            chunk_bytes += len(line)
+        if lines or items:
+            yield b''.join(lines) if lines else None, items
+
     def compile(self):
-        pass
+        """
+        :return: iterator of ndjson _bulk request bodies, one per chunk
+        """
+        for body, _ in self._chunks():
+            if body is not None:
+                yield body
 
-    def execute(self, ):
-        pass
+    def execute_iter(self):
+        """
+        send rows chunk by chunk through _bulk api
+        :return: iterator of (ok, item) per row in row order, item is the _bulk response item
+        """
+        with self._lease() as conn:
+            for body, items in self._chunks():
+                for res in self._send_chunk(conn, body, items):
+                    yield res
+
+    def _send_chunk(self, conn, body, items):
+        """
+        send one chunk from _chunks through _bulk api
+        :return: list of (ok, item) of the chunk
+        """
+        res = None
+        if body is not None:
+            try:
+                res = conn.bulk(body=body, index=self._bulk_index(), **self._request_kwargs())
+            finally:
+                cache.invalidate(self._index)
+        return InsertSQL._chunk_results(res, items)
+
+    @staticmethod
+    def _chunk_results(res, items):
+        res_items = iter(res['items']) if res is not None else None
+        results = []
+        for item in items:
+            if item is None:
+                item = next(res_items)
+            status = next(iter(item.values())).get('status', 500)
+            results.append((200 <= status < 300, item))
+        return results
+
+    @staticmethod
+    def _summary(results):
+        res = {'success': 0, 'failed': 0, 'errors': []}
+        for ok, item in results:
+            if ok:
+                res['success'] += 1
+            else:
+                res['failed'] += 1
+                res['errors'].append(item)
+        return res
+
+    def execute(self):
+        """
+        :return: count of succeeded and failed rows with failed items
+        """
+        return InsertSQL._summary(self.execute_iter())
+
+    async def execute_async(self):
+        """
+        asyncio version of execute, chunks are sent one by one over AsyncESConnection
+        """
+        results = []
+        async with self._lease_async() as conn:
+            for body, items in self._chunks():
+                res = None
+                if body is not None:
+                    try:
+                        res = await conn.bulk(body=body, index=self._bulk_index(), **self._request_kwargs())
+                    finally:
+                        cache.invalidate(self._index)
+                results.extend(InsertSQL._chunk_results(res, items))
+        return InsertSQL._summary(results)
 
 
 class DeleteSQL(SQL):
@@ -202,9 +500,36 @@ class UpdateSQL(SQL):
 class SelectSQL(SQL):
 
     def __init__(self, model_clazz=None, **kwargs):
-        self._data = {'fields': [], 'join': None, 'group_by': [], 'order_by': {}, 'limit': None, 'offset': None}
+        self._data = {'fields': [], 'join': None, 'group_by': [], 'order_by': {}, 'limit': None, 'offset': None,
+                      'composite': None, 'es_version': None}
         super(SelectSQL, self).__init__(model_clazz, **kwargs)
 
+    @classmethod
+    def from_sql(cls, text: str, model_clazz=None, **kwargs):
+        """
+        build select sql from sql statement text, eg.
+        "SELECT lineno, max(lineno) FROM lala WHERE (ok = true OR lineno IN (1, 2)) AND message = 'a=b'
+        GROUP BY ok ORDER BY lineno DESC LIMIT 10", parsed statement is cached by text
+        :param text: select statement, table in FROM clause is used as index
+        :param model_clazz: model used to resolve field names in where clause
+        :return: SelectSQL
+        """
+        stmt = parse_select(text)
+        if stmt.index and not kwargs.get('index'):
+            kwargs['index'] = stmt.index
+        sql = cls(model_clazz, **kwargs).fields(*[build_field(field) for field in stmt.fields])
+        if stmt.where is not None:
+            sql.where(build_where(stmt.where, model_clazz))
+        if stmt.group_by:
+            sql.group_by(*[build_group(field, model_clazz) for field in stmt.group_by])
+        if stmt.order_by:
+            sql.order_by(*[(field_text(field), order) for field, order in stmt.order_by])
+        if stmt.limit is not None:
+            sql.limit(stmt.limit)
+        if stmt.offset is not None:
+            sql.offset(stmt.offset)
+        return sql
+
     def fields(self, *fields):
         for field in fields:
             if isinstance(field, str):
@@ -217,7 +542,12 @@ class SelectSQL(SQL):
         return self
 
     def group_by(self, *fields):
-        self._data['group_by'] += fields
+        for field in fields:
+            if isinstance(field, str):
+                match = _DATE_TRUNC_PATTERN.match(field)
+                if match:
+                    field = date_trunc(match.group('interval'), resolve_field(self._model_clazz, match.group('field')))
+            self._data['group_by'].append(field)
         return self
 
     def order_by(self, *fields):
@@ -233,6 +563,15 @@ class SelectSQL(SQL):
             self._data['order_by'][field] = order
         return self
 
+    def composite(self, size: int = _PAGE_SIZE):
+        """
+        compile group by fields to sources of one composite aggregation returning size buckets per page,
+        instead of nested terms aggregations which only return top buckets, see iter_groups
+        :param size: buckets per page, None turns composite off
+        """
+        self._data['composite'] = int(size) if size else None
+        return self
+
     def limit(self, limit: int = 10):
         self._data['limit'] = int(limit)
         return self
@@ -244,44 +583,361 @@ class SelectSQL(SQL):
     def join(self, join_type, on=None):
         return self
 
-    def compile(self):
-        return self._compiler.compile()
+    def compile(self, format='dict'):
+        """
+        :param format: 'dict' for query dict, 'bytes' for json encoded request body
+        :return:
+        """
+        self._data['es_version'] = self._bound_client().version
+        return self._compiler.compile(format=format)
 
-    def paginate(self):
+    def _iter_pages(self, tie_breaker='_id'):
+        """
+        yield raw search response page by page with search_after, tie_breaker field is appended to
+        order by fields so that sort values of last hit locate next page uniquely
+        """
+        sql, query = self._page_query(tie_breaker)
+        with sql._lease() as conn:
+            while 1:
+                res = conn.search(index=sql._index, body=query, **sql._request_kwargs())
+                yield res
+                if not SelectSQL._next_page(query, res):
+                    return
+
+    def _page_query(self, tie_breaker):
+        sql = self.clone()
+        if tie_breaker not in sql._data['order_by']:
+            sql.order_by((tie_breaker, 'asc'))
+        if not sql._data['limit']:
+            sql.limit(_PAGE_SIZE)
+        query = sql.compile()
+        return sql._narrowed(query), query
+
+    @staticmethod
+    def _next_page(query, res):
+        """
+        move query to the page after res with search_after, False if res is the last page
+        """
+        hits = res.get('hits', {}).get('hits', [])
+        if len(hits) < query['size'] or 'sort' not in hits[-1]:
+            return False
+        query.pop('from', None)
+        query['search_after'] = hits[-1]['sort']
+        return True
+
+    def paginate(self, prefetch: int = 1, tie_breaker='_id'):
         """
-        yield document according to your sql and order by field
+        yield SearchResult page by page according to your sql and order by fields, page length is limit
+        (1000 by default), next pages are fetched in background while caller handles current page
+        :param prefetch: max pages fetched ahead of caller, 0 fetches each page in caller's thread when asked for
+        :param tie_breaker: unique field appended to order by fields
         :return:
         """
-        if not self._data['limit'] or not self._data['order_by']:
-            raise Exception(u'ERROR: paginate need page length(limit) and order by field')
-        query = self.order_by(('_id', 'asc')).compile()
-        database = POOL.connect(**self._database)
-        res = database.search(index=self._index, body=query, doc_type=self._doc_type)
-        if 'hits' not in res:
-            return
-        res_data = res['hits']['hits']
-        if not res_data:
-            return
-        search_after_val = res_data[-1].get('sort', None)
-        if search_after_val is None:
-            return SearchResult(res)
-        if 'from' in query:
-            del query['from']
-        query['search_after'] = search_after_val
-        while 1:
+        for res in prefetch_iter(self._iter_pages(tie_breaker), prefetch):
             yield SearchResult(res)
-            res = database.search(index=self._index, body=query, doc_type=self._doc_type)
-            if 'hits' not in res:
+
+    def stream(self, prefetch: int = 2, tie_breaker='_id'):
+        """
+        yield documents one by one, pages are fetched with search_after in background
+        :param prefetch: max pages fetched ahead of caller
+        :param tie_breaker: unique field appended to order by fields
+        :return:
+        """
+        for page in self.paginate(prefetch, tie_breaker):
+            for doc in page['data']:
+                yield doc
+
+    def execute_columnar(self, fields=None, prefetch: int = 1, tie_breaker='_id'):
+        """
+        fetch all matching documents page by page into numpy arrays, one per field, hits of every page are
+        decoded straight into arrays preallocated from total hits of first page (see columnar.ColumnBuilder)
+        :param fields: field names or model fields, selected fields (all model fields when none) by default
+        :param prefetch: max pages fetched ahead of caller
+        :param tie_breaker: unique field appended to order by fields
+        :return: dict of field name to numpy masked array
+        """
+        if fields is None:
+            fields = [field for field in self._data['fields'] if isinstance(field, str)]
+            fields = fields or default_fields(self._model_clazz)
+        builder = None
+        for res in prefetch_iter(self._iter_pages(tie_breaker), prefetch):
+            if builder is None:
+                builder = ColumnBuilder(fields, self._model_clazz, capacity=total_hits(res))
+            builder.add_hits(res.get('hits', {}).get('hits', []))
+        return builder.result()
+
+    def _iter_group_pages(self, size=None):
+        """
+        yield raw search response page by page of composite aggregation, after_key of a page
+        locates the next one
+        """
+        if not self._data['group_by']:
+            raise ValueError(u'ERROR: iter_groups needs group by fields')
+        sql = self.clone().composite(size or self._data.get('composite') or _PAGE_SIZE)
+        query = sql.compile()
+        sql = sql._narrowed(query)
+        query['size'] = 0
+        composite = query['aggs']['group_by_composite']['composite']
+        with sql._lease() as conn:
+            while 1:
+                res = conn.search(index=sql._index, body=query, **sql._request_kwargs())
+                yield res
+                aggs = res.get('aggregations', {}).get('group_by_composite', {})
+                if not aggs.get('after_key') or len(aggs.get('buckets', [])) < composite['size']:
+                    return
+                composite['after'] = aggs['after_key']
+
+    def iter_groups(self, size: int = None, prefetch: int = 1):
+        """
+        yield every group of group by fields as dict of group keys, doc_count and metric values,
+        groups are paged with composite aggregation so client memory stays constant however many there are
+        :param size: buckets per page, composite size or 1000 by default
+        :param prefetch: max pages fetched ahead of caller
+        :return:
+        """
+        for res in prefetch_iter(self._iter_group_pages(size), prefetch):
+            for row in bucket_rows(res.get('aggregations')):
+                yield row
+
+    def _scroll_slice(self, conn, query, slice_id, slices, keep_alive):
+        """
+        yield hits page by page of one slice with scroll api
+        """
+        body = dict(query)
+        body.pop('from', None)
+        if slices > 1:
+            body['slice'] = {'id': slice_id, 'max': slices}
+        res = conn.search(index=self._index, body=body, scroll=keep_alive, **self._request_kwargs())
+        scroll_id = res.get('_scroll_id')
+        try:
+            while 1:
+                hits = res.get('hits', {}).get('hits', [])
+                if not hits:
+                    return
+                yield hits
+                scroll_id = res.get('_scroll_id', scroll_id)
+                res = conn.scroll(scroll_id=scroll_id, scroll=keep_alive)
+        finally:
+            if scroll_id:
+                conn.clear_scroll(scroll_id=scroll_id, ignore=(404,))
+
+    def _pit_slice(self, conn, query, pit_id, slice_id, slices, keep_alive):
+        """
+        yield hits page by page of one slice with point in time and search_after
+        """
+        body = dict(query)
+        body.pop('from', None)
+        body['pit'] = {'id': pit_id, 'keep_alive': keep_alive}
+        if slices > 1:
+            body['slice'] = {'id': slice_id, 'max': slices}
+        body['sort'] = list(body['sort']) + ['_shard_doc'] if 'sort' in body else ['_shard_doc']
+        while 1:
+            res = conn.transport.perform_request('POST', '/_search', body=body)
+            hits = res.get('hits', {}).get('hits', [])
+            if not hits:
                 return
-            res_data = res['hits']['hits']
-            if not res_data:
+            yield hits
+            if len(hits) < body['size']:
                 return
-            query['search_after'] = res_data[-1]['sort']
+            body['pit'] = {'id': res.get('pit_id', body['pit']['id']), 'keep_alive': keep_alive}
+            body['search_after'] = hits[-1]['sort']
+
+    def export(self, slices: int = 2, sinks=None, keep_alive='5m', use_pit=False, prefetch: int = None):
+        """
+        export all documents matching the sql with slices scrolling in parallel threads,
+        compiled query is sent as it is plus slice (and pit) options, page length is limit (1000 by default)
+        :param slices: number of slices, each is scrolled by its own thread
+        :param sinks: None to get one iterator of documents merged from all slices,
+                      or list of callables, one per slice, called with every document of its slice
+        :param keep_alive: how long the scroll context or point in time is kept between pages
+        :param use_pit: point in time with search_after instead of scroll (elasticsearch 7.10+)
+        :param prefetch: max pages fetched ahead of caller, slices by default
+        :return: iterator of documents, or list of document count per slice when sinks are given
+        """
+        slices = max(int(slices), 1)
+        if sinks is not None and len(sinks) != slices:
+            raise ValueError(u'ERROR: {} sinks given for {} slices'.format(len(sinks), slices))
+        sql = self
+        if not self._data['limit']:
+            sql = self.clone().limit(_PAGE_SIZE)
+        query = sql.compile()
+        sql = sql._narrowed(query)
+        if 'sort' not in query and not use_pit:
+            query = dict(query, sort=['_doc'])
+        # client stays leased until every slice is done, pit is deleted before lease ends
+        resources = ExitStack()
+        try:
+            conn = resources.enter_context(self._lease())
+            if use_pit:
+                params = {'keep_alive': keep_alive}
+                if sql._ignore_unavailable:
+                    params['ignore_unavailable'] = 'true'
+                if sql._routing_value:
+                    params['routing'] = sql._routing_value
+                res = conn.transport.perform_request('POST', '/{}/_pit'.format(sql._index), params=params)
+                pit_id = res['id']
+                resources.callback(conn.transport.perform_request, 'DELETE', '/_pit',
+                                   body={'id': pit_id}, params={'ignore': 404})
+                streams = [sql._pit_slice(conn, query, pit_id, i, slices, keep_alive) for i in range(slices)]
+            else:
+                streams = [sql._scroll_slice(conn, query, i, slices, keep_alive) for i in range(slices)]
+        except BaseException:
+            resources.close()
+            raise
+        if sinks is not None:
+            streams = [_sink_pages(i, stream, sinks[i]) for i, stream in enumerate(streams)]
+        pages = merge_iter(streams, prefetch or slices)
+
+        if sinks is None:
+            return _export_docs(pages, resources.close)
+        counts = [0] * slices
+        with resources:
+            for slice_id, count in pages:
+                counts[slice_id] += count
+        return counts
+
+    def prepare(self):
+        """
+        compile sql with Param placeholders in where clause once,
+        execute the returned statement with param values
+        :return: PreparedSelectSQL
+        """
+        self._data['es_version'] = self._bound_client().version
+        return PreparedSelectSQL(self.clone())
+
+    def cache(self, enabled=True, ttl=None):
+        """
+        whether execute() reads and fills the result cache turned on by result_cache(), and ttl of its entry
+        (default ttl of cache backend when None)
+        """
+        self._use_cache = enabled
+        self._cache_ttl = ttl
+        return self
+
+    def _search(self, query):
+        results = cache.backend if self._use_cache else None
+        group = flight.group
+        if results is None and group is None:
+            return self._send_search(query)
+        body = query if isinstance(query, bytes) else json_dumps(query)
+        key = (self._bound_client().key, self._index, self._doc_type, body)
+        if results is None:
+            return group.do(key, lambda: self._send_search(query))
+        res = results.get(key)
+        if res is not None:
+            return res
+
+        def fetch():
+            generation = cache.generation
+            res = self._send_search(query)
+            # partial results and results of searches overlapping a write are not cached
+            if generation == cache.generation and not res.get('timed_out') and \
+                    not res.get('_shards', {}).get('failed'):
+                results.set(key, res, self._cache_ttl)
+            return res
+
+        if group is None:
+            return fetch()
+        return group.do(key, fetch)
+
+    def _send_search(self, query):
+        coalescer = msearch.coalescer
+        if coalescer is not None:
+            return coalescer.submit(self, query)
+        with self._lease() as conn:
+            return conn.search(index=self._index, body=query, **self._request_kwargs())
+
+    def _execute(self, query):
+        pending = current_batch()
+        if pending is not None:
+            return pending.add(self, query)
+        return SearchResult(self._search(query))
+
+    async def _search_async(self, query):
+        async with self._lease_async() as conn:
+            return await conn.search(index=self._index, body=query, **self._request_kwargs())
 
-    @result_wrapper
     def execute(self):
-        query = self.compile()
-        kwargs = {}
-        if self._doc_type:
-            kwargs['doc_type'] = self._doc_type
-        return POOL.connect(**self._database).search(index=self._index, body=query, **kwargs)
+        """
+        search compiled query, inside a batch() block it is queued and sent with others as one _msearch
+        """
+        sql = self._narrowed()
+        return sql._execute(sql.compile(format='bytes'))
+
+    async def execute_async(self):
+        """
+        asyncio version of execute, same compiled query is sent over AsyncESConnection
+        """
+        sql = self._narrowed()
+        return SearchResult(await sql._search_async(sql.compile(format='bytes')))
+
+    async def paginate_async(self, tie_breaker='_id'):
+        """
+        asyncio version of paginate, next page is requested before current page is handed to caller
+        """
+        sql, query = self._page_query(tie_breaker)
+        kwargs = sql._request_kwargs()
+        async with sql._lease_async() as conn:
+            pending = asyncio.ensure_future(conn.search(index=sql._index, body=dict(query), **kwargs))
+            try:
+                while pending is not None:
+                    res = await pending
+                    pending = None
+                    if SelectSQL._next_page(query, res):
+                        pending = asyncio.ensure_future(conn.search(index=sql._index, body=dict(query), **kwargs))
+                    yield SearchResult(res)
+            finally:
+                if pending is not None:
+                    pending.cancel()
+
+    async def stream_async(self, tie_breaker='_id'):
+        """
+        asyncio version of stream, yield documents one by one
+        """
+        async for page in self.paginate_async(tie_breaker):
+            for doc in page['data']:
+                yield doc
+
+
+def _sink_pages(slice_id, pages, sink):
+    for hits in pages:
+        data = SearchResult({'hits': {'hits': hits}})['data']
+        for doc in data:
+            sink(doc)
+        yield slice_id, len(data)
+
+
+def _export_docs(pages, on_close):
+    try:
+        for hits in pages:
+            for doc in SearchResult({'hits': {'hits': hits}})['data']:
+                yield doc
+    finally:
+        on_close()
+
+
+class PreparedSelectSQL(object):
+
+    def __init__(self, sql: SelectSQL):
+        self._sql = sql
+        self._plan = sql._compiler.prepare()
+
+    @property
+    def params(self):
+        return self._plan.params
+
+    def compile(self, **params):
+        return self._plan.bind(**params)
+
+    def compile_bytes(self, **params):
+        return self._plan.bind_bytes(**params)
+
+    def _target(self, params):
+        sql = self._sql
+        return sql._narrowed(self.compile(**params)) if sql._narrows() else sql
+
+    def execute(self, **params):
+        return self._target(params)._execute(self.compile_bytes(**params))
+
+    async def execute_async(self, **params):
+        return SearchResult(await self._target(params)._search_async(self.compile_bytes(**params)))
@@ -2,43 +2,327 @@
 # @Time    : 2019/10/11 9:45
 # @Author  : floatsliang
 # @File    : utils.py
-from functools import wraps
+from functools import partial, wraps
 from copy import deepcopy
+from collections import OrderedDict
+from collections.abc import Mapping, KeysView, ValuesView, ItemsView
+from itertools import chain
+from threading import Lock, Thread, Event
+from queue import Queue, Full
+import json
 import re
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 FORMAL_DATE_PATTERN = re.compile(r'^(?P<year>\d{4})\D(?P<month>\d{2})\D(?P<day>\d{2}).*$')
 NOW_DATE_PATTERN = re.compile(r'^now((?P<op>[-+])(?P<num>\d+)(?P<unit>([yMwdhHms])))?\s*$')
 
 
+def split_in_value(val):
+    if isinstance(val, str):
+        val = re.sub(r'\s*[()\[\]]\s*', '', val)
+        val = re.split(r'\s*[,;]\s*', val)
+    elif not isinstance(val, list) and not isinstance(val, tuple):
+        val = [val]
+    return list(val)
+
+
+def _json_default(obj, fallback=None):
+    if isinstance(obj, Document):
+        return obj.to_dict()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, (list, tuple)):
+        return list(obj)
+    for base in (str, int, float):
+        if isinstance(obj, base):
+            return base(obj)
+    if fallback is not None:
+        return fallback(obj)
+    raise TypeError(u'ERROR: Type is not JSON serializable: {}'.format(type(obj).__name__))
+
+
+def json_dumps(obj, default=None) -> bytes:
+    """
+    encode obj to compact utf-8 json bytes, use orjson when it is installed,
+    subclasses (eg. Document) are encoded through default as orjson would read their storage
+    """
+    if orjson is not None:
+        default = _json_default if default is None else partial(_json_default, fallback=default)
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_SUBCLASS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+class Document(dict):
+    """
+    document of a search hit: _source of the hit plus its _id, a dict reading through the hit without
+    copying it, _source is copied into the dict on first modification, raw hit is never modified.
+    until then the dict only holds _id, so it is never empty to json, which reads its items()
+    """
+    __slots__ = ('_hit',)
+
+    def __init__(self, hit):
+        super(Document, self).__init__(_id=hit.get('_id', None))
+        self._hit = hit
+
+    @property
+    def source(self):
+        """
+        mapping of the document fields, _id is left out until document is modified
+        """
+        return self if self._hit is None else self._hit['_source']
+
+    @property
+    def lazy(self):
+        """
+        document still reads through its hit
+        """
+        return self._hit is not None
+
+    def to_dict(self):
+        if self._hit is None:
+            return dict.copy(self)
+        return {**self._hit['_source'], '_id': self._hit.get('_id', None)}
+
+    copy = to_dict
+
+    def __reduce_ex__(self, protocol):
+        # copied and pickled as a plain dict
+        return dict, (self.to_dict(),)
+
+    def _own(self):
+        hit = self._hit
+        if hit is not None:
+            dict.clear(self)
+            dict.update(self, hit['_source'])
+            dict.__setitem__(self, '_id', hit.get('_id', None))
+            self._hit = None
+
+    def __getitem__(self, key):
+        if self._hit is None:
+            return dict.__getitem__(self, key)
+        if key == '_id':
+            return self._hit.get('_id', None)
+        return self._hit['_source'][key]
+
+    def get(self, key, default=None):
+        if self._hit is None:
+            return dict.get(self, key, default)
+        if key == '_id':
+            return self._hit.get('_id', None)
+        return self._hit['_source'].get(key, default)
+
+    def __contains__(self, key):
+        if self._hit is None:
+            return dict.__contains__(self, key)
+        return key == '_id' or key in self._hit['_source']
+
+    def __iter__(self):
+        if self._hit is None:
+            return dict.__iter__(self)
+        return self._iter_source()
+
+    def _iter_source(self):
+        for key in self._hit['_source']:
+            if key != '_id':
+                yield key
+        yield '_id'
+
+    def __len__(self):
+        if self._hit is None:
+            return dict.__len__(self)
+        return len(self._hit['_source']) + ('_id' not in self._hit['_source'])
+
+    def keys(self):
+        return dict.keys(self) if self._hit is None else KeysView(self)
+
+    def values(self):
+        return dict.values(self) if self._hit is None else ValuesView(self)
+
+    def items(self):
+        return dict.items(self) if self._hit is None else ItemsView(self)
+
+    def __setitem__(self, key, value):
+        self._own()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._own()
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        self._own()
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        self._own()
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        self._own()
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        self._own()
+        dict.update(self, *args, **kwargs)
+
+    def clear(self):
+        self._own()
+        dict.clear(self)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __or__(self, other):
+        return {**self.to_dict(), **other}
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return self.to_dict() == (other.to_dict() if isinstance(other, Document) else dict(other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class DocumentList(list):
+    """
+    list of documents of search hits, each hit is wrapped in a Document reading its _source and _id
+    without copying them, raw hits and their _source are never modified. + and += share documents
+    of both operands instead of copying them
+    """
+
+    @classmethod
+    def from_hits(cls, hits):
+        # hits without _source are skipped as they always were
+        return cls([Document(hit) for hit in hits if hit.get('_source')])
+
+    def materialize(self):
+        """
+        flat list of all documents, the list itself
+        """
+        return self
+
+    def chunks(self):
+        """
+        iterate (sources, ids) of documents, documents still reading their hits give _source of the hit
+        """
+        sources, ids = [], []
+        for doc in self:
+            if isinstance(doc, Document):
+                hit = doc._hit
+                if hit is not None:
+                    sources.append(hit['_source'])
+                    ids.append(hit.get('_id', None))
+                    continue
+            sources.append(doc)
+            ids.append(doc.get('_id', None))
+        return iter([(sources, ids)])
+
+    @property
+    def lazy(self):
+        """
+        number of documents still reading through their hits
+        """
+        return sum(1 for doc in self if isinstance(doc, Document) and doc._hit is not None)
+
+    def __add__(self, docs):
+        return DocumentList(chain(self, docs))
+
+    def __radd__(self, docs):
+        return DocumentList(chain(docs, self))
+
+    def __iadd__(self, docs):
+        self.extend(docs)
+        return self
+
+
 class SearchResult(dict):
+    """
+    dict of documents ('data') and meta of a search response, documents are decoded lazily from raw response
+    (see DocumentList), raw response is kept as raw
+    """
 
     def __init__(self, res: dict=None):
-        super(SearchResult, self).__init__(data=[], meta={
+        super(SearchResult, self).__init__(data=DocumentList(), meta={
             'count': 0,
             'status': 200,
             'error': 'ok'
         })
+        self.raw = None
         if res:
             self.init(res)
 
     def init(self, res :dict):
-        if 'hits' in res:
-            es_data = res['hits']['hits']
-            for doc in es_data:
-                data = doc.get("_source", None)
-                if data:
-                    data['_id'] = doc.get('_id', None)
-                    self['data'].append(data)
+        self.raw = res
+        if isinstance(res, SearchResult):
+            self['data'] = DocumentList()
+            self['data'] += res['data']
+            self['meta'] = dict(res['meta'])
+            self.raw = res.raw
+        elif 'hits' in res:
+            self['data'] = DocumentList.from_hits(res['hits']['hits'])
             self['meta']['count'] = len(self['data'])
         elif 'error' in res:
             self['meta']['status'] = res['status']
             self['meta']['error'] = res['error']['reason']
 
+    def materialize(self):
+        """
+        flat list of documents, see DocumentList.materialize
+        """
+        return self['data'].materialize()
+
+    def to_columns(self, fields=None, model_clazz=None):
+        """
+        documents as numpy arrays, one per field, see columnar.ColumnBuilder
+        :param fields: field names or model fields, default all fields of model_clazz
+                       or keys of the documents without model
+        :param model_clazz: model giving dtype of fields
+        :return: dict of field name to numpy masked array
+        """
+        from .columnar import ColumnBuilder, default_fields
+        docs = self['data']
+        if fields is None:
+            fields = default_fields(model_clazz, docs)
+        builder = ColumnBuilder(fields, model_clazz, capacity=len(docs))
+        for sources, ids in docs.chunks():
+            builder.add_sources(sources, ids)
+        return builder.result()
+
+    def to_table(self, numpy=False):
+        """
+        flat table of group by buckets of raw response, see columnar.flatten_buckets
+        :param numpy: numpy masked arrays instead of lists
+        :return: OrderedDict of column name to values
+        """
+        from .columnar import flatten_buckets, to_arrays
+        columns = flatten_buckets((self.raw or {}).get('aggregations'))
+        return to_arrays(columns) if numpy else columns
+
     def __add__(self, other):
         if isinstance(other, SearchResult):
             res = SearchResult()
             if self['meta']['count'] > 0 or other['meta']['count'] > 0:
-                res['data'] = deepcopy(self['data']) + deepcopy(other['data'])
+                res['data'] = self['data'] + other['data']
                 res['meta'] = {
                     'count': len(res['data']),
                     'status': 200,
@@ -67,5 +351,154 @@ class SearchResult(dict):
 def result_wrapper(func):
     @wraps(func)
     def wrapped(*args, **kwargs):
-        return SearchResult(func(*args, **kwargs))
+        res = func(*args, **kwargs)
+        # a pending result (eg. of batch()) is filled in place later, it must not be copied
+        return res if isinstance(res, SearchResult) else SearchResult(res)
     return wrapped
+
+
+class LRUCache(object):
+    """
+    bounded, thread-safe LRU mapping with hit/miss/eviction counters
+    """
+
+    def __init__(self, maxsize=512):
+        self._maxsize = int(maxsize)
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self._maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+_PREFETCH_POLL_INTERVAL = 0.1
+_PREFETCH_DONE = object()
+
+
+class _PrefetchError(object):
+    __slots__ = ('exc',)
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _inline_iter(iterables):
+    """
+    iterate iterables one after another in the caller's thread, nothing is read ahead
+    """
+    try:
+        for iterable in iterables:
+            yield from iterable
+    finally:
+        for iterable in iterables:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+
+def merge_iter(iterables, depth: int = 1):
+    """
+    iterate every iterable in its own background thread and yield their items as they come,
+    keeping at most depth items ready ahead of the caller, first exception raised by any iterable
+    is re-raised in the caller and stops the others.
+    depth 0 (or less) iterates them one after another in the caller's thread without reading ahead
+    """
+    iterables = list(iterables)
+    if int(depth) <= 0:
+        yield from _inline_iter(iterables)
+        return
+    items = Queue(maxsize=int(depth))
+    stop = Event()
+
+    def put(obj):
+        while not stop.is_set():
+            try:
+                items.put(obj, timeout=_PREFETCH_POLL_INTERVAL)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce(iterable):
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as ex:
+            put(_PrefetchError(ex))
+        finally:
+            # let generator clean up (eg. clear scroll) when caller stops early
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+            put(_PREFETCH_DONE)
+
+    for iterable in iterables:
+        Thread(target=produce, args=(iterable,), daemon=True).start()
+    try:
+        running = len(iterables)
+        while running:
+            item = items.get()
+            if item is _PREFETCH_DONE:
+                running -= 1
+            elif isinstance(item, _PrefetchError):
+                raise item.exc
+            else:
+                yield item
+    finally:
+        stop.set()
+
+
+def prefetch_iter(iterable, depth: int = 1):
+    """
+    iterate iterable in a background thread, keeping at most depth items ready ahead of the caller,
+    exception raised by iterable is re-raised in the caller, depth 0 iterates it in the caller's thread
+    """
+    return merge_iter([iterable], depth)
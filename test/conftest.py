@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 21:30
+# @Author  : floatsliang
+# @File    : conftest.py
+import json
+from contextlib import nullcontext
+
+import pytest
+
+from sqlorm4es.sql import SQL
+
+
+class FakeConnection(object):
+    """
+    record every request, search answers queued responses then empty pages, bulk answers 201 per document
+    (409 for message conflict)
+    """
+
+    def __init__(self, responses=None):
+        self.requests = []
+        self._responses = list(responses or [])
+
+    def search(self, index=None, body=None, **kwargs):
+        self.requests.append(dict(kwargs, index=index, body=body))
+        if self._responses:
+            return self._responses.pop(0)
+        return {'hits': {'total': 0, 'hits': []}}
+
+    def bulk(self, body=None, index=None, **kwargs):
+        self.requests.append(dict(kwargs, index=index, body=body))
+        items = []
+        lines = body.splitlines()
+        for i in range(0, len(lines), 2):
+            (op, meta), = json.loads(lines[i]).items()
+            doc = json.loads(lines[i + 1])
+            status = 409 if doc.get('message') == 'conflict' else 201
+            items.append({op: {'_index': index, '_id': meta.get('_id', str(len(self.requests))), 'status': status}})
+        return {'errors': False, 'items': items}
+
+
+@pytest.fixture
+def use_connection(monkeypatch):
+    """
+    make every query lease the given fake connection, SQL._lease is where all requests get their client
+    """
+
+    def use(fake):
+        monkeypatch.setattr(SQL, '_lease', lambda *args, **kwargs: nullcontext(fake))
+        return fake
+
+    return use
+
+
+@pytest.fixture
+def conn(use_connection):
+    return use_connection(FakeConnection())
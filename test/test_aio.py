@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 19:00
+# @Author  : floatsliang
+# @File    : test_aio.py
+import asyncio
+import json
+import time
+from threading import Thread, Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from elasticsearch.exceptions import NotFoundError, ConnectionError
+
+from sqlorm4es.aio import AsyncDBPool, AsyncESConnection, _make_url
+from sqlorm4es.field import *
+from sqlorm4es.model import BaseModel
+
+
+class ESHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    lock = Lock()
+    requests = []
+    in_flight = 0
+    max_in_flight = 0
+    total = 25
+    delay = 0.02
+
+    def _reply(self, status, res, chunked=False):
+        data = json.dumps(res).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(data), 7):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data[i:i + 7]), data[i:i + 7]))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        cls = self.__class__
+        with cls.lock:
+            cls.requests.append((self.path, body))
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        time.sleep(self.delay)
+        with cls.lock:
+            cls.in_flight -= 1
+        if self.path.startswith('/missing/'):
+            return self._reply(404, {'error': {'type': 'index_not_found_exception'}, 'status': 404})
+        if self.path.endswith('/_bulk'):
+            lines = body.splitlines()
+            return self._reply(200, {'items': [{'index': {'_id': str(i), 'status': 201}}
+                                               for i in range(len(lines) // 2)]})
+        query = json.loads(body)
+        start = query['search_after'][0] + 1 if 'search_after' in query else query.get('from', 0)
+        hits = [{'_id': str(i), '_source': {'lineno': i}, 'sort': [i]}
+                for i in range(start, min(start + query.get('size', 10), self.total))]
+        self._reply(200, {'hits': {'total': self.total, 'hits': hits}}, chunked=start % 2 == 1)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ESHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def pool(server, monkeypatch):
+    pool = AsyncDBPool(hosts=['127.0.0.1:{}'.format(server.server_port)], maxsize=50)
+    monkeypatch.setattr(LogCenter._meta, 'aio_client', pool.bind(LogCenter._meta.database))
+    ESHandler.requests = []
+    ESHandler.max_in_flight = 0
+    return pool
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    lineno = Integer(required=True)
+
+
+def test_execute_async(pool, monkeypatch):
+    # slow enough answers that concurrent searches overlap on a loaded machine too
+    monkeypatch.setattr(ESHandler, 'delay', 0.1)
+    sql = LogCenter.select(LogCenter.lineno).where(LogCenter.lineno > 3).order_by(('lineno', 'asc')).limit(5)
+
+    async def run():
+        results = await asyncio.gather(*[sql.execute_async() for _ in range(40)])
+        await pool.close()
+        return results
+
+    results = asyncio.run(run())
+    assert all(res['meta']['count'] == 5 for res in results)
+    assert ESHandler.requests[0] == ('/lala/_search', sql.compile(format='bytes'))
+    assert ESHandler.max_in_flight > 10
+
+
+def test_paginate_async(pool):
+    async def run():
+        docs = [doc async for doc in LogCenter.select().limit(4).stream_async()]
+        pages = [page async for page in LogCenter.select().limit(10).offset(5).paginate_async()]
+        stmt = LogCenter.select().where(LogCenter.lineno > Param('line')).limit(3).prepare()
+        res = await stmt.execute_async(line=7)
+        with pytest.raises(NotFoundError):
+            await LogCenter.select().index('missing').execute_async()
+        await pool.close()
+        return docs, pages, res
+
+    docs, pages, res = asyncio.run(run())
+    assert [doc['lineno'] for doc in docs] == list(range(25))
+    assert [page['meta']['count'] for page in pages] == [10, 10, 0]
+    assert res['meta']['count'] == 3
+
+
+def test_insert_async(pool):
+    async def run():
+        res = await LogCenter.insert(*[{'lineno': i} for i in range(7)] + [{'lineno': 'x'}]).chunk(size=3) \
+            .execute_async()
+        await pool.close()
+        return res
+
+    res = asyncio.run(run())
+    assert (res['success'], res['failed']) == (7, 1)
+    assert [path for path, _ in ESHandler.requests] == ['/lala/_bulk'] * 3
+
+
+def test_retry_on_dropped_connection():
+    received = []
+
+    async def serve(reader, writer):
+        # answers first request of a connection, drops it after reading the second one
+        for served in range(2):
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = int(head.lower().split(b'content-length: ')[1].split(b'\r\n')[0])
+            await reader.readexactly(length)
+            received.append(head.split(b' ')[1].decode())
+            if served:
+                break
+            writer.write(b'HTTP/1.1 200 OK\r\ncontent-type: application/json\r\ncontent-length: 2\r\n\r\n{}')
+            await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        pool = AsyncDBPool(engine=AsyncESConnection,
+                           hosts=['127.0.0.1:{}'.format(server.sockets[0].getsockname()[1])])
+        conn = pool.connect()
+        await conn.search(index='lala', body={})
+        # search is sent again on a new connection
+        assert await conn.search(index='lala', body={}) == {}
+        # bulk may have been applied by server, it is not sent again
+        with pytest.raises(ConnectionError):
+            await conn.bulk(body=b'{"index":{}}\n{"lineno":1}\n', index='lala')
+        await pool.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(run())
+    assert received == ['/lala/_search', '/lala/_search', '/lala/_search', '/lala/_bulk']
+
+
+class RecordingConnection(object):
+    created = []
+
+    def __init__(self, config, timeout):
+        self.config = config
+        self.closed = False
+        RecordingConnection.created.append(self)
+
+    async def close(self):
+        self.closed = True
+
+
+def test_pool_caps_clients(monkeypatch):
+    RecordingConnection.created = []
+    pool = AsyncDBPool(engine=RecordingConnection, max_conn=2, wait_timeout=0.5)
+    config_of = [{'hosts': ['127.0.0.1:{}'.format(9201 + i)]} for i in range(3)]
+    keys = []
+    monkeypatch.setattr(AsyncDBPool, '_key_of', lambda self, config: keys.append(config) or str(config))
+    handles = [pool.bind(config) for config in config_of]
+
+    async def run():
+        async with handles[0].lease() as first, handles[1].lease():
+            assert handles[0].connect() is first
+            waiter = asyncio.ensure_future(handles[2].lease().__aenter__())
+            await asyncio.sleep(0.05)
+            # both clients are leased, third config waits for a slot
+            assert not waiter.done()
+            assert pool.stats()['active'] == 2
+        third = await waiter
+        assert third.config == config_of[2]
+        await asyncio.sleep(0)
+        # least recently used client is evicted and closed
+        assert [conn.closed for conn in RecordingConnection.created] == [False, True, False]
+        stats = pool.stats()
+        await pool.close()
+        return stats
+
+    stats = asyncio.run(run())
+    assert len(keys) == 3
+    assert (stats['active'], stats['idle'], stats['created'], stats['evicted'], stats['waits']) == (1, 1, 3, 1, 1)
+    assert all(conn.closed for conn in RecordingConnection.created)
+
+
+def test_pool_wait_timeout():
+    pool = AsyncDBPool(engine=RecordingConnection, max_conn=1, wait_timeout=0.05)
+
+    async def run():
+        async with pool.lease(hosts=['127.0.0.1:9201']):
+            with pytest.raises(Exception, match='no idle connection'):
+                pool.connect(hosts=['127.0.0.1:9202'])
+            with pytest.raises(Exception, match='after waiting'):
+                async with pool.lease(hosts=['127.0.0.1:9202']):
+                    pass
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_make_url():
+    assert _make_url('lala', None, '_search') == '/lala/_search'
+    assert _make_url(['a', 'b-*'], '', '_bulk') == '/a,b-*/_bulk'
+    assert _make_url('log 2026', b'doc', '_search') == '/log%202026/doc/_search'
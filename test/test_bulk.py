@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 16:40
+# @Author  : floatsliang
+# @File    : test_bulk.py
+import json
+import time
+from contextlib import contextmanager
+from threading import Lock, get_ident
+
+import pytest
+
+from sqlorm4es.bulk import parallel_bulk
+from sqlorm4es.field import *
+from sqlorm4es.model import BaseModel
+from sqlorm4es.sql import SQL
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    lineno = Integer(required=True)
+    message = Text(default='xixi')
+
+
+class FakeConnection(object):
+
+    def __init__(self, stats):
+        self._stats = stats
+
+    def bulk(self, body=None, index=None, **kwargs):
+        time.sleep(0.005)
+        docs = [json.loads(line) for line in body.splitlines()[1::2]]
+        with self._stats['lock']:
+            self._stats['threads'].add(get_ident())
+            self._stats['docs'] += len(docs)
+        if any(doc['lineno'] == 13 for doc in docs):
+            raise ConnectionError('connection refused')
+        return {'items': [{'index': {'_id': doc['lineno'], 'status': 201}} for doc in docs]}
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = {'lock': Lock(), 'threads': set(), 'docs': 0, 'leases': 0, 'leased': 0}
+    conn = FakeConnection(stats)
+
+    @contextmanager
+    def lease(self):
+        with stats['lock']:
+            stats['leases'] += 1
+            stats['leased'] += 1
+        try:
+            yield conn
+        finally:
+            with stats['lock']:
+                stats['leased'] -= 1
+
+    monkeypatch.setattr(SQL, '_lease', lease)
+    return stats
+
+
+def test_parallel_bulk(stats):
+    produced = []
+
+    def rows():
+        for i in range(200):
+            produced.append(i)
+            yield {'lineno': i} if i != 50 else {'message': 'no lineno'}
+
+    results = []
+    for ok, item in parallel_bulk(LogCenter, (row for row in rows() if row.get('lineno') != 13),
+                                  workers=4, chunk_size=10, queue_size=2):
+        results.append((ok, item))
+        # producer never runs ahead more than queued + in flight chunks
+        assert len(produced) - len(results) <= (2 + 4 + 2 + 2) * 10
+    assert len(results) == 199
+    assert sorted(item['index']['_id'] for ok, item in results if ok) == [i for i in range(200) if i not in (13, 50)]
+    assert [item['index']['status'] for ok, item in results if not ok] == [400]
+    assert len(stats['threads']) > 1
+    # one lease per chunk sent, all given back to the pool
+    assert stats['leases'] == 20
+    assert stats['leased'] == 0
+
+
+def test_parallel_bulk_error(stats):
+    with pytest.raises(ConnectionError):
+        for _ in parallel_bulk(LogCenter, ({'lineno': i} for i in range(100)), workers=2, chunk_size=5):
+            pass
+    assert stats['docs'] < 100
+    assert stats['leased'] == 0
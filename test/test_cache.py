@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 22:05
+# @Author  : floatsliang
+# @File    : test_cache.py
+import json
+import time
+
+import pytest
+
+from sqlorm4es import result_cache, MemoryCache
+from sqlorm4es import cache as cache_module
+from sqlorm4es.field import Integer, Text
+from sqlorm4es.model import BaseModel
+
+
+class LogCenter(BaseModel):
+    __index__ = 'logs-2026.10.18'
+
+    lineno = Integer(required=True)
+    message = Text()
+
+
+class CountingConnection(object):
+
+    def __init__(self):
+        self.searches = 0
+        self.on_search = None
+        self.timed_out = False
+
+    def search(self, index=None, body=None, **kwargs):
+        self.searches += 1
+        if self.on_search is not None:
+            self.on_search()
+        return {'timed_out': self.timed_out,
+                'hits': {'total': 1, 'hits': [{'_id': str(self.searches), '_source': {'index': index}}]}}
+
+    def bulk(self, body=None, index=None, **kwargs):
+        count = len(body.splitlines()) // 2
+        return {'errors': False, 'items': [{'index': {'_id': str(i), 'status': 201}} for i in range(count)]}
+
+
+@pytest.fixture
+def conn(use_connection):
+    yield use_connection(CountingConnection())
+    result_cache(None)
+
+
+def test_memory_cache():
+    cache = MemoryCache(ttl=0.05, maxsize=2, max_bytes=1000)
+    key = ('k', 'logs-a', None, b'{}')
+    cache.set(key, {'hits': 1})
+    res = cache.get(key)
+    assert res == {'hits': 1}
+    res['hits'] = 2
+    assert cache.get(key) == {'hits': 1}
+    time.sleep(0.06)
+    assert cache.get(key) is None
+
+    for i in range(3):
+        cache.set(('k', 'logs-{}'.format(i), None, b'{}'), {'i': i}, ttl=10)
+    assert cache.get(('k', 'logs-0', None, b'{}')) is None
+    assert len(cache) == 2 and cache.stats()['evictions'] == 1
+    cache.set(('k', 'big', None, b'{}'), {'data': 'x' * 2000})
+    assert cache.get(('k', 'big', None, b'{}')) is None
+    cache.set(('k', 'half-1', None, b'{}'), {'data': 'x' * 600}, ttl=10)
+    cache.set(('k', 'half-2', None, b'{}'), {'data': 'x' * 600}, ttl=10)
+    assert cache.get(('k', 'half-1', None, b'{}')) is None
+    assert cache.get(('k', 'half-2', None, b'{}')) is not None
+    assert len(cache) == 1 and cache.stats()['bytes'] <= 1000
+
+    cache.set(('k', 'logs-*', None, b'{}'), {}, ttl=10)
+    cache.set(('k', 'other,logs-1', None, b'{}'), {}, ttl=10)
+    cache.set(('k', 'other', None, b'{}'), {}, ttl=10)
+    cache.invalidate('logs-1')
+    assert [key[1] for key in cache._data] == ['other']
+
+
+def test_cached_execute(conn):
+    cache = result_cache(ttl=10)
+    sql = LogCenter.select().where(LogCenter.lineno > 1)
+    first = sql.execute()
+    second = LogCenter.select().where(LogCenter.lineno > 1).execute()
+    assert conn.searches == 1
+    assert second == first and second['data'][0] is not first['data'][0]
+    LogCenter.select().where(LogCenter.lineno > 2).execute()
+    sql.clone().cache(False).execute()
+    assert conn.searches == 3
+    assert cache.stats()['hits'] == 1
+
+    # writes through model drop results of the index
+    LogCenter.insert({'lineno': 1}).execute()
+    sql.execute()
+    assert conn.searches == 4
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_cache_skips_stale_and_partial(conn):
+    cache = result_cache(ttl=10)
+    conn.on_search = lambda: cache_module.invalidate('logs-2026.10.18')
+    LogCenter.select().execute()
+    assert len(cache) == 0
+    conn.on_search = None
+    conn.timed_out = True
+    LogCenter.select().execute()
+    assert len(cache) == 0
+    conn.timed_out = False
+    LogCenter.select().execute()
+    LogCenter.select().execute()
+    assert conn.searches == 3
+
+
+def test_cached_get_many(conn):
+    cache = result_cache(ttl=10)
+    first = LogCenter.get_many(['lineno'], where=LogCenter.lineno > 1, limit=5)
+    second = LogCenter.get_many(['lineno'], where=LogCenter.lineno > 1, limit=5)
+    assert conn.searches == 1 and second == first
+    LogCenter.get_one(['lineno'], where=LogCenter.lineno > 1)
+    assert conn.searches == 2
+
+    # save() writes to the index, next get_many searches again
+    LogCenter(lineno=3).save()
+    LogCenter.get_many(['lineno'], where=LogCenter.lineno > 1, limit=5)
+    assert conn.searches == 3
+    assert cache.stats()['hits'] == 1
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 23:40
+# @Author  : floatsliang
+# @File    : test_columnar.py
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from sqlorm4es.field import *
+from sqlorm4es.model import BaseModel
+from sqlorm4es.utils import SearchResult
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    ok = Boolean()
+    lineno = Integer(required=True)
+    cost = Float()
+    message = Text()
+    timestamp = Date(name='@timestamp')
+    host = Object(name=Text(), port=Integer())
+
+
+DOCS = [
+    {'ok': 'true', 'lineno': 1, 'cost': 0.5, 'message': 'a', '@timestamp': '2026-10-18T08:00:00.000000+0800',
+     'host': {'name': 'h1', 'port': 9200}},
+    {'ok': False, 'lineno': '2', 'message': 'b', '@timestamp': 1792281600000, 'host': {'name': 'h2'}},
+    {'lineno': [3, 4], 'cost': 2, '@timestamp': None},
+]
+
+
+def hits(docs, start=0):
+    return [{'_id': str(start + i), '_source': doc, 'sort': [start + i]} for i, doc in enumerate(docs)]
+
+
+def test_to_columns():
+    res = SearchResult({'hits': {'total': 3, 'hits': hits(DOCS)}})
+    res += SearchResult({'hits': {'total': 1, 'hits': hits([{'lineno': 5, 'ok': True}], 3)}})
+    res['data'][1]['cost'] = 1.5
+    columns = res.to_columns(model_clazz=LogCenter)
+    assert list(columns) == ['ok', 'lineno', 'cost', 'message', '@timestamp', 'host']
+    assert columns['lineno'].dtype == np.int64 and columns['lineno'].tolist() == [1, 2, 3, 5]
+    assert columns['ok'].dtype == np.bool_ and columns['ok'].tolist() == [True, False, None, True]
+    assert columns['cost'].dtype == np.float64 and columns['cost'].tolist() == [0.5, 1.5, 2.0, None]
+    assert columns['message'].tolist() == ['a', 'b', None, None]
+    stamps = columns['@timestamp']
+    assert stamps.dtype == np.dtype('datetime64[ms]')
+    assert stamps.mask.tolist() == [False, False, True, True]
+    assert stamps[0] == np.datetime64('2026-10-18T00:00:00.000') == stamps[1]
+    # hits are not turned into documents
+    assert res['data'].lazy == 3
+
+    columns = res.to_columns(['_id', 'host.port', LogCenter.timestamp], LogCenter)
+    assert list(columns) == ['_id', 'host.port', '@timestamp']
+    assert columns['_id'].tolist() == ['0', '1', '2', '3']
+    assert columns['host.port'].dtype == np.int64 and columns['host.port'].tolist() == [9200, None, None, None]
+
+    columns = SearchResult({'hits': {'total': 3, 'hits': hits(DOCS)}}).to_columns()
+    assert list(columns) == ['ok', 'lineno', 'cost', 'message', '@timestamp', 'host']
+    assert columns['lineno'].dtype == object
+
+
+def test_execute_columnar(use_connection):
+    docs = [{'lineno': i, 'cost': i / 2} for i in range(2500)]
+    pages = [{'hits': {'total': 2500, 'hits': hits(docs[i:i + 1000], i)}} for i in range(0, 2500, 1000)]
+    requests = []
+
+    class PagingConnection(object):
+        def search(self, index=None, body=None, **kwargs):
+            requests.append(dict(body))
+            return pages[len(requests) - 1]
+
+    use_connection(PagingConnection())
+    columns = LogCenter.select('lineno', 'cost').where(LogCenter.lineno > 1).execute_columnar()
+    assert len(requests) == 3 and requests[2]['search_after'] == [1999]
+    assert list(columns) == ['lineno', 'cost']
+    assert np.array_equal(columns['lineno'], np.arange(2500))
+    assert columns['cost'].dtype == np.float64 and columns['cost'][-1] == 1249.5
+    assert not columns['cost'].mask.any()
+
+
+def test_to_table():
+    aggs = {'group_by_host': {'buckets': [
+        {'key': 'h1', 'doc_count': 3, 'group_by_lineno': {'buckets': [
+            {'key': 1, 'doc_count': 2, 'max_cost': {'value': 0.5}},
+            {'key': 2, 'doc_count': 1, 'max_cost': {'value': None}},
+        ]}},
+        {'key': 'h2', 'doc_count': 0, 'group_by_lineno': {'buckets': []}},
+        {'key': 'h3', 'doc_count': 1, 'group_by_lineno': {'buckets': [
+            {'key': 7, 'doc_count': 1, 'max_cost': {'value': 2.0}, 'avg_cost': {'value': 2.0}},
+        ]}},
+    ]}}
+    res = SearchResult({'hits': {'total': 4, 'hits': []}, 'aggregations': aggs})
+    table = res.to_table()
+    assert table == {
+        'host': ['h1', 'h1', 'h3'],
+        'lineno': [1, 2, 7],
+        'doc_count': [2, 1, 1],
+        'max_cost': [0.5, None, 2.0],
+        'avg_cost': [None, None, 2.0],
+    }
+    assert list(table) == ['host', 'lineno', 'doc_count', 'max_cost', 'avg_cost']
+
+    arrays = res.to_table(numpy=True)
+    assert arrays['host'].dtype == object and arrays['lineno'].dtype == np.int64
+    assert arrays['max_cost'].dtype == np.float64 and arrays['max_cost'].mask.tolist() == [False, True, False]
+    assert arrays['max_cost'].sum() == 2.5
+
+    res = SearchResult({'hits': {'total': 4, 'hits': []}, 'aggregations': {'max_cost': {'value': 3.0}}})
+    assert res.to_table() == {'max_cost': [3.0]}
+    assert SearchResult({'hits': {'total': 0, 'hits': []}}).to_table() == {}
+
+
+def test_to_table_percentiles():
+    aggs = {'group_by_ok': {'buckets': [
+        {'key': 'true', 'doc_count': 3, 'cardinality_message': {'value': 2},
+         'percentiles_cost': {'values': {'50.0': 1.0, '95.0': 2.5}}},
+        {'key': 'false', 'doc_count': 1, 'cardinality_message': {'value': 1},
+         'percentiles_cost': {'values': {'50.0': 3.0, '95.0': None}}},
+    ]}}
+    table = SearchResult({'hits': {'total': 4, 'hits': []}, 'aggregations': aggs}).to_table()
+    assert table == {
+        'ok': ['true', 'false'],
+        'doc_count': [3, 1],
+        'cardinality_message': [2, 1],
+        'percentiles_cost.50.0': [1.0, 3.0],
+        'percentiles_cost.95.0': [2.5, None],
+    }
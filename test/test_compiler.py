@@ -97,7 +97,7 @@ def test_parse_where():
 def test_parse_fields():
     _source, _aggs = parser.parse_fields()
     assert _source == ['ok', 'lineno', 'test', 'timestamp']
-    assert _aggs == [('lineno', OP.OP_MAX)]
+    assert _aggs == [('lineno', OP.OP_MAX, None)]
 
 
 def test_parse_group_by():
@@ -126,3 +126,30 @@ def test_parse_select_sql():
     assert q['aggs'] == expected_aggs
 
 
+def test_plan_cache():
+    def build_sql(ok, lineno, timestamp):
+        return {
+            'fields': [LogCenter.ok, LogCenter.lineno],
+            'where': ((LogCenter.ok == ok) & (LogCenter.message != 'dfdf')) | (LogCenter.timestamp >= timestamp) |
+                     (LogCenter.lineno >> lineno) | (LogCenter.lineno > 0),
+            'join': None,
+            'group_by': [],
+            'order_by': {'lineno': 'desc'},
+            'limit': 22,
+            'offset': None
+        }
+
+    QueryCompiler.plan_cache.clear()
+    first = QueryCompiler(build_sql('true', ' ( 12; 45 ) ', '2017-10-12')).compile()
+    assert QueryCompiler.plan_cache.stats()['misses'] == 1
+    for args in (('false', [1, 2, 3], '2018-01-01'), ('true', '(7)', '2019-10-10')):
+        sql = build_sql(*args)
+        cached = QueryCompiler(sql).compile()
+        assert cached == QueryCompiler(sql).compile(use_cache=False)
+        assert cached != first
+    stats = QueryCompiler.plan_cache.stats()
+    assert stats['hits'] == 2 and stats['misses'] == 1 and stats['size'] == 1
+
+    cached['query']['bool']['filter']['bool']['should'].pop()
+    assert QueryCompiler(build_sql('true', [1], '2019-10-10')).compile() == \
+        QueryCompiler(build_sql('true', [1], '2019-10-10')).compile(use_cache=False)
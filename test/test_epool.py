@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 12:20
+# @Author  : floatsliang
+# @File    : test_epool.py
+import time
+from threading import Thread, Barrier, Event
+
+import pytest
+
+from sqlorm4es.epool import ESConnection, DBPool
+
+
+def test_bytes_passthrough():
+    conn = ESConnection({'hosts': ['127.0.0.1:9200'], 'es_version': 6.2}, None)
+    serializer = conn.transport.serializer
+    assert conn.version == 6.2
+    assert serializer.dumps(b'{"size":1}') == b'{"size":1}'
+    assert serializer.loads(serializer.dumps({'size': 1, 'q': u'中'})) == {'size': 1, 'q': u'中'}
+    assert conn._bulk_body(b'{"index":{}}\n{"a":1}') == b'{"index":{}}\n{"a":1}\n'
+
+
+def _config(port, **kwargs):
+    return dict({'hosts': ['127.0.0.1:{}'.format(port)]}, **kwargs)
+
+
+def test_pool_shares_transport():
+    pool = DBPool(max_conn=4)
+    v6 = pool.connect(**_config(9201, es_version=6.8))
+    v7 = pool.connect(**_config(9201, es_version=7.10))
+    assert v6 is not v7
+    assert v6.version == 6.8 and v7.version == 7.10
+    assert v6.transport is v7.transport
+    assert pool.connect(**_config(9201, es_version=6.8)) is v6
+    assert pool.connect(**_config(9202)).transport is not v6.transport
+    stats = pool.stats()
+    assert stats['created'] == 3
+    assert stats['idle'] == 3 and stats['active'] == 0
+    # default client and two host sets
+    assert stats['transports'] == 3
+
+
+def test_pool_evicts_lru():
+    pool = DBPool(max_conn=2)
+    first = pool.connect(**_config(9201))
+    pool.connect(**_config(9202))
+    assert pool.connect(**_config(9201)) is first
+    pool.connect(**_config(9203))
+    assert pool.connect(**_config(9201)) is first
+    assert pool.stats()['evicted'] == 1
+    assert pool.connect(**_config(9202)) is not None
+    assert pool.stats()['created'] == 4
+
+
+def test_pool_evicts_idle():
+    pool = DBPool(max_conn=4, pool_timeout=0.05)
+    first = pool.connect(**_config(9201))
+    time.sleep(0.1)
+    assert pool.connect(**_config(9202)) is not first
+    assert pool.stats()['evicted'] == 1
+    assert pool.stats()['idle'] == 1
+
+
+def test_pool_lease_waits():
+    pool = DBPool(max_conn=1, wait_timeout=2)
+    got = []
+    with pool.lease(**_config(9201)) as leased:
+        assert pool.stats()['active'] == 1
+        # same config is shared with lease holder
+        assert pool.connect(**_config(9201)) is leased
+        t = Thread(target=lambda: got.append(pool.connect(**_config(9202))))
+        t.start()
+        time.sleep(0.1)
+        assert not got
+    t.join()
+    assert got and got[0] is not leased
+    stats = pool.stats()
+    assert stats['waits'] == 1 and stats['wait_time'] > 0
+    assert stats['evicted'] == 1 and stats['active'] == 0
+
+
+def test_pool_wait_timeout():
+    pool = DBPool(max_conn=1, wait_timeout=0.05)
+    with pool.lease(**_config(9201)):
+        with pytest.raises(Exception, match='no idle connection'):
+            pool.connect(**_config(9202))
+
+
+def test_pool_concurrent_connect():
+    pool = DBPool(max_conn=4)
+    barrier = Barrier(8)
+    got = []
+
+    def connect():
+        barrier.wait()
+        got.append(pool.connect(**_config(9201)))
+
+    threads = [Thread(target=connect) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(got) == 8 and all(conn is got[0] for conn in got)
+    assert pool.stats()['created'] == 1
+    pool.clear()
+    assert pool.stats()['idle'] == 0
+
+
+def test_client_handle():
+    pool = DBPool(max_conn=1)
+    config = _config(9201, es_version=7.10)
+    handle = pool.bind(config)
+    conn = handle.connect()
+    assert handle.connect() is conn and conn.version == 7.10
+    assert pool.stats()['created'] == 1
+    assert pool.bind({}).connect() is pool.connect()
+
+    # evicted by another config, resolved again on next use
+    pool.connect(**_config(9202))
+    assert handle.connect() is not conn
+    with handle.lease() as leased:
+        assert leased is handle.connect()
+        assert pool.stats()['active'] == 1
+
+    # config hot-reloaded in place
+    config['es_version'] = 6.8
+    assert handle.connect().version == 7.10
+    pool.reload()
+    assert handle.connect().version == 6.8
+
+
+
+def test_pool_creates_client_out_of_lock(monkeypatch):
+    pool = DBPool(max_conn=4)
+    ready = pool.connect(**_config(9201))
+    started, release = Event(), Event()
+    create_conn = DBPool._create_conn
+
+    def slow_create(timeout, config, transport=None):
+        if config['hosts'] == ['127.0.0.1:9202']:
+            started.set()
+            release.wait(5)
+        return create_conn(timeout, config, transport=transport)
+
+    monkeypatch.setattr(DBPool, '_create_conn', staticmethod(slow_create))
+    got = []
+    threads = [Thread(target=lambda: got.append(pool.connect(**_config(9202)))) for _ in range(2)]
+    for t in threads:
+        t.start()
+    assert started.wait(5)
+    # other configs are served while a client is being created
+    assert pool.connect(**_config(9201)) is ready
+    release.set()
+    for t in threads:
+        t.join()
+    assert got[0] is got[1]
+    assert pool.stats()['created'] == 2
+
+
+def test_pool_keeps_leased_transport():
+    pool = DBPool(max_conn=1, wait_timeout=0.05)
+    handle = pool.bind(_config(9201))
+    with handle.lease() as leased:
+        with pytest.raises(Exception, match='no idle connection'):
+            pool.connect(**_config(9202))
+        assert handle.connect() is leased
+    http_pool = leased.transport.connection_pool.connections[0].pool
+    assert http_pool.pool is not None
+    pool.connect(**_config(9202))
+    assert pool.stats()['evicted'] == 1
+    # transport is closed with its last client once lease ends
+    assert http_pool.pool is None
+    assert handle.connect() is not leased
+
+
+def test_client_handle_keeps_lru_order():
+    pool = DBPool(max_conn=2)
+    handle = pool.bind(_config(9201))
+    conn = handle.connect()
+    other = pool.connect(**_config(9202))
+    assert handle.connect() is conn
+    # least recently used client is evicted, not the one handle just used
+    pool.connect(**_config(9203))
+    assert handle.connect() is conn
+    assert pool.connect(**_config(9202)) is not other
+
+
+def test_pool_evicts_idle_on_lease():
+    pool = DBPool(max_conn=4, pool_timeout=0.05)
+    handle = pool.bind(_config(9201))
+    handle.connect()
+    pool.connect(**_config(9202))
+    time.sleep(0.1)
+    # client leased is used now, the other one timed out
+    with handle.lease():
+        stats = pool.stats()
+        assert stats['active'] == 1 and stats['idle'] == 0 and stats['evicted'] == 1
+    assert pool.stats()['idle'] == 1
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 21:25
+# @Author  : floatsliang
+# @File    : test_flight.py
+import json
+import time
+from threading import Thread, Event, Lock
+
+import pytest
+from elasticsearch.exceptions import ConnectionError
+
+from sqlorm4es import single_flight
+from sqlorm4es.field import Integer
+from sqlorm4es.model import BaseModel
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    lineno = Integer(required=True)
+
+
+class SlowConnection(object):
+    """
+    every search blocks until released, lineno 13 fails
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.release = Event()
+        self._lock = Lock()
+
+    def search(self, index=None, body=None, **kwargs):
+        with self._lock:
+            self.requests.append((index, body))
+        self.release.wait(5)
+        if b'"13"' in body:
+            raise ConnectionError('N/A', 'unlucky', None)
+        return {'hits': {'total': 1, 'hits': [{'_id': '1', '_source': {'index': index}}]}}
+
+
+@pytest.fixture
+def conn(use_connection):
+    yield use_connection(SlowConnection())
+    single_flight(False)
+
+
+def run_threads(targets, conn, wait_requests):
+    threads = [Thread(target=target) for target in targets]
+    for t in threads:
+        t.start()
+    deadline = time.time() + 5
+    while len(conn.requests) < wait_requests and time.time() < deadline:
+        time.sleep(0.01)
+    # let waiters join their flights before first request returns
+    time.sleep(0.1)
+    conn.release.set()
+    for t in threads:
+        t.join()
+
+
+def test_single_flight(conn):
+    group = single_flight()
+    results = []
+
+    def search(index):
+        return lambda: results.append(LogCenter.select().where(LogCenter.lineno > 1).index(index).execute())
+
+    run_threads([search('lala')] * 8 + [search('other')] * 2, conn, 2)
+    assert sorted(index for index, _ in conn.requests) == ['lala', 'other']
+    assert sorted(res['data'][0]['index'] for res in results) == ['lala'] * 8 + ['other'] * 2
+    # waiters get their own documents
+    assert len({id(res['data'][0]) for res in results}) == 10
+    assert group.stats() == {'in_flight': 0, 'calls': 2, 'coalesced': 8}
+
+    conn.requests = []
+    LogCenter.select().where(LogCenter.lineno > 1).execute()
+    assert len(conn.requests) == 1
+    assert group.stats()['calls'] == 3
+
+
+def test_single_flight_error(conn):
+    group = single_flight()
+    errors = []
+
+    def search():
+        try:
+            LogCenter.select().where(LogCenter.lineno > 13).execute()
+        except ConnectionError as ex:
+            errors.append(ex)
+
+    run_threads([search] * 4, conn, 1)
+    assert len(conn.requests) == 1
+    assert len(errors) == 4
+    assert group.stats() == {'in_flight': 0, 'calls': 1, 'coalesced': 3}
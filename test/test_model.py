@@ -93,3 +93,19 @@ def test_instantiate_model():
     }
 
 
+def test_model_binds_client():
+    class Log(BaseModel):
+        __index__ = 'log'
+        __database__ = {'hosts': ['127.0.0.1:9201']}
+
+    sql = Log.select()
+    assert sql._client is Log._meta.client
+    assert sql._bound_aio_client() is Log._meta.aio_client
+    assert sql.clone()._client is Log._meta.client
+    assert Log.select().database({'hosts': ['127.0.0.1:9202']})._client is None
+    log = Log()
+    assert log._meta.client is Log._meta.client
+    log.database({'hosts': ['127.0.0.1:9203']})
+    assert log._meta.client is not Log._meta.client
+    assert log._meta.client.config == {'hosts': ['127.0.0.1:9203']}
+    assert log._meta.aio_client.config == {'hosts': ['127.0.0.1:9203']}
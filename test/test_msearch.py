@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 20:30
+# @Author  : floatsliang
+# @File    : test_msearch.py
+import json
+from threading import Thread, Barrier, Lock
+
+import pytest
+from elasticsearch.exceptions import RequestError
+
+from sqlorm4es import batch, coalesce
+from sqlorm4es import msearch as msearch_module
+from sqlorm4es.field import Integer, Text
+from sqlorm4es.model import BaseModel
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+    __database__ = {'hosts': ['127.0.0.1:9201']}
+
+    lineno = Integer(required=True)
+    message = Text()
+
+
+class MSearchConnection(object):
+    """
+    answers every search with one hit holding lineno of its range query, lineno < 0 fails
+    """
+
+    def __init__(self):
+        self.requests = []
+        self._lock = Lock()
+
+    @staticmethod
+    def _answer(query):
+        lineno = int(query['query']['bool']['filter']['bool']['must'][0]['range']['lineno']['gt'])
+        if lineno < 0:
+            return {'error': {'type': 'parsing_exception', 'reason': 'bad lineno'}, 'status': 400}
+        return {'hits': {'total': 1, 'hits': [{'_id': str(lineno), '_source': {'lineno': lineno}}]}}
+
+    def search(self, index=None, body=None, **kwargs):
+        with self._lock:
+            self.requests.append(('search', index, 1))
+        return self._answer(json.loads(body))
+
+    def msearch(self, body=None, **kwargs):
+        lines = body.splitlines()
+        headers = [json.loads(line) for line in lines[::2]]
+        with self._lock:
+            self.requests.append(('msearch', [h['index'] for h in headers], len(headers)))
+        return {'responses': [self._answer(json.loads(line)) for line in lines[1::2]]}
+
+
+@pytest.fixture
+def conn(use_connection):
+    yield use_connection(MSearchConnection())
+    coalesce(None)
+
+
+def build_sql(lineno):
+    return LogCenter.select().where(LogCenter.lineno > lineno)
+
+
+def test_batch(conn):
+    with batch(max_size=3) as pending:
+        results = [build_sql(i).execute() for i in range(1, 5)]
+        prepared = build_sql(7).index('other').prepare().execute()
+        failed = build_sql(-1).execute()
+        assert len(pending) == 6
+        assert all(res['meta']['count'] == 0 for res in results)
+        assert not conn.requests
+    assert [req[2] for req in conn.requests] == [3, 3]
+    assert conn.requests[1][1] == ['lala', 'other', 'lala']
+    assert [res['data'][0]['lineno'] for res in results] == [1, 2, 3, 4]
+    assert prepared['data'][0]['_id'] == '7'
+    assert failed['meta'] == {'count': 0, 'status': 400, 'error': 'bad lineno'}
+    assert build_sql(5).execute()['data'][0]['lineno'] == 5
+
+
+def test_get_many_in_batch(conn):
+    with batch():
+        many = LogCenter.get_many(['lineno'], where=LogCenter.lineno > 3)
+        one = LogCenter.get_one(['lineno'], where=LogCenter.lineno > 6)
+        assert many['meta']['count'] == 0
+    assert conn.requests == [('msearch', ['lala', 'lala'], 2)]
+    assert [doc['lineno'] for doc in many['data']] == [3]
+    assert [doc['lineno'] for doc in one['data']] == [6]
+
+
+def test_batch_discarded_on_error(conn):
+    with pytest.raises(ValueError):
+        with batch():
+            build_sql(1).execute()
+            raise ValueError('oops')
+    assert not conn.requests
+    assert msearch_module.current_batch() is None
+
+
+def test_coalesce(conn):
+    coalescer = coalesce(window=0.5, max_size=8)
+    barrier = Barrier(8)
+    results = {}
+
+    def search(i):
+        barrier.wait()
+        results[i] = build_sql(i).execute()
+
+    threads = [Thread(target=search, args=(i,)) for i in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert conn.requests == [('msearch', ['lala'] * 8, 8)]
+    assert all(results[i]['data'][0]['lineno'] == i for i in range(1, 9))
+    assert coalescer.stats()['searches'] == 8 and coalescer.stats()['requests'] == 1
+
+    # lonely search is sent as it is after window
+    coalesce(window=0.01)
+    assert build_sql(3).execute()['data'][0]['lineno'] == 3
+    assert conn.requests[-1] == ('search', 'lala', 1)
+
+
+def test_coalesce_error(conn):
+    coalesce(window=0.5, max_size=2)
+    errors = []
+
+    def search(i):
+        try:
+            build_sql(i).execute()
+        except RequestError as ex:
+            errors.append(ex)
+
+    threads = [Thread(target=search, args=(i,)) for i in (-1, 1)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(errors) == 1 and errors[0].status_code == 400
+    assert conn.requests == [('msearch', ['lala', 'lala'], 2)]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 13:55
+# @Author  : floatsliang
+# @File    : test_optimizer.py
+from sqlorm4es.compiler import QueryCompiler
+from sqlorm4es.field import *
+from sqlorm4es.model import BaseModel
+from sqlorm4es.optimizer import WhereOptimizer, format_expr
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    ok = Boolean(default=True)
+    lineno = Integer(required=True)
+    message = Text(default='xixi')
+
+
+def _compile(where):
+    return QueryCompiler({
+        'fields': [], 'where': where, 'join': None, 'group_by': [],
+        'order_by': {}, 'limit': None, 'offset': None
+    }).compile(use_cache=False)['query']['bool']['filter']['bool']
+
+
+def test_fold_terms():
+    where = (LogCenter.lineno == 1) | (LogCenter.message == 'x') | (LogCenter.lineno == 2) | \
+            (LogCenter.lineno >> '(3; 4)')
+    optimizer = WhereOptimizer()
+    assert format_expr(optimizer.optimize(where)) == "lineno IN [1, 2, '3', '4'] OR message = 'x'"
+    assert optimizer.rewrites == ['fold 3 predicates on lineno into terms']
+    assert _compile(where) == {'should': [{'terms': {'lineno': [1, 2, 3, 4]}}, {'term': {'message': {'value': 'x'}}}]}
+
+
+def test_merge_ranges():
+    where = (LogCenter.lineno > 5) & (LogCenter.message == 'x') & ((LogCenter.lineno < 100) & (LogCenter.lineno >= 7))
+    optimizer = WhereOptimizer()
+    assert format_expr(optimizer.optimize(where)) == "7 <= lineno < 100 AND message = 'x'"
+    assert optimizer.rewrites == ['flatten 1 nested AND into parent', 'merge 3 range predicates on lineno into 1']
+    assert _compile(where) == {'must': [{'range': {'lineno': {'gte': '7', 'lt': '100'}}},
+                                        {'term': {'message': {'value': 'x'}}}]}
+
+    where = (LogCenter.message >= 'a') & (LogCenter.message > 'b')
+    assert format_expr(WhereOptimizer().optimize(where)) == "message >= 'a' AND message > 'b'"
+
+
+def test_drop_duplicates():
+    where = (LogCenter.message != 'e') & (LogCenter.ok == True) & (LogCenter.message != 'e') & \
+            ((LogCenter.lineno == 1) | (LogCenter.lineno == 1))
+    optimizer = WhereOptimizer()
+    assert format_expr(optimizer.optimize(where)) == "message != 'e' AND ok = True AND lineno IN [1]"
+    assert optimizer.rewrites == ['fold 2 predicates on lineno into terms', "drop duplicate predicate message != 'e'"]
+    assert _compile(where) == {
+        'must': [{'term': {'ok': {'value': 'true'}}}, {'terms': {'lineno': [1]}}],
+        'must_not': [{'term': {'message': {'value': 'e'}}}]
+    }
+
+
+def test_explain_rewrite():
+    sql = LogCenter.select().where((LogCenter.lineno == 1) | (LogCenter.lineno == 2)).where(LogCenter.lineno < 10)
+    assert sql.explain_rewrite() == {
+        'before': '(lineno = 1 OR lineno = 2) AND lineno < 10',
+        'after': 'lineno IN [1, 2] AND lineno < 10',
+        'rewrites': ['fold 2 predicates on lineno into terms'],
+    }
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 14:50
+# @Author  : floatsliang
+# @File    : test_parser.py
+import pytest
+
+from sqlorm4es.sql import SelectSQL
+from sqlorm4es.field import *
+from sqlorm4es.model import BaseModel
+from sqlorm4es.parser import SQLSyntaxError, Aggregate, BoolOp, DateTrunc, ParamRef, Predicate, tokenize, \
+    parse_select, ast_cache
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+
+    ok = Boolean(default=True)
+    lineno = Integer(required=True)
+    message = Text(default='xixi')
+    timestamp = Date(timezone="+8")
+    bigbrother = Object(
+        head=Integer()
+    )
+
+
+def test_tokenize():
+    assert [(tok.kind, tok.value) for tok in tokenize("a.b>=-1.5 AND c IN ('x''y', :p) 2017-10-12")] == [
+        ('word', 'a.b'), ('op', '>='), ('number', -1.5), ('word', 'AND'), ('word', 'c'), ('word', 'IN'),
+        ('lparen', '('), ('string', "x'y"), ('comma', ','), ('param', 'p'), ('rparen', ')'),
+        ('word', '2017-10-12'), ('eof', None)
+    ]
+
+
+def test_parse_select():
+    stmt = parse_select("select lineno, max(lineno) from lala where (ok = true or lineno in (1; 2)) "
+                        "and message = 'a = b or c' and 5 < lineno and message not like :m "
+                        "group by ok order by lineno desc, max(lineno) limit 20, 10;")
+    assert stmt.fields == ('lineno', Aggregate(OP.OP_MAX, 'lineno'))
+    assert stmt.index == 'lala'
+    assert stmt.where == BoolOp(OP.OP_AND, BoolOp(OP.OP_AND, BoolOp(OP.OP_AND, BoolOp(
+        OP.OP_OR, Predicate('ok', OP.OP_EQ, True), Predicate('lineno', OP.OP_IN, (1, 2))),
+        Predicate('message', OP.OP_EQ, 'a = b or c')), Predicate('lineno', OP.OP_GT, 5)),
+        Predicate('message', OP.OP_NOT_LIKE, ParamRef('m')))
+    assert stmt.group_by == ('ok',)
+    assert stmt.order_by == (('lineno', 'desc'), (Aggregate(OP.OP_MAX, 'lineno'), 'asc'))
+    assert (stmt.limit, stmt.offset) == (10, 20)
+
+    for bad in ("SELECT FROM lala", "SELECT * WHERE lineno = ", "SELECT * WHERE NOT lineno = 1",
+                "SELECT * WHERE (lineno = 1", "SELECT * LIMIT 1.5", "SELECT * WHERE lineno = 1 lineno = 2"):
+        with pytest.raises(SQLSyntaxError):
+            parse_select(bad)
+
+
+def test_ast_cache():
+    text = "SELECT * FROM lala WHERE lineno > 10"
+    hits = ast_cache.stats()['hits']
+    assert parse_select(text) is parse_select(text)
+    assert ast_cache.stats()['hits'] == hits + 1
+
+
+def test_from_sql():
+    sql = SelectSQL.from_sql("SELECT lineno, max(lineno) FROM lala "
+                             "WHERE (ok = true OR lineno IN (1, 2)) AND message = 'a=b' AND timestamp >= '2017-10-12' "
+                             "GROUP BY ok ORDER BY lineno DESC LIMIT 10 OFFSET 20", LogCenter)
+    expected = LogCenter.select(LogCenter.lineno, 'max(lineno)') \
+        .where(((LogCenter.ok == True) | (LogCenter.lineno >> [1, 2])) & (LogCenter.message == 'a=b') &
+               (LogCenter.timestamp >= '2017-10-12')) \
+        .group_by('ok') \
+        .order_by(('lineno', 'desc')) \
+        .limit(10) \
+        .offset(20)
+    assert sql.compile() == expected.compile()
+    assert sql._index == 'lala'
+
+
+def test_where_str():
+    sql = LogCenter.select().where("bigbrother.head IN (1; 2) OR (message = 'x' AND lineno < 5)")
+    expected = LogCenter.select().where((LogCenter.bigbrother.head >> [1, 2]) |
+                                        ((LogCenter.message == 'x') & (LogCenter.lineno < 5)))
+    assert sql.compile() == expected.compile()
+    assert LogCenter.select().where("message = hello world").compile() == \
+        LogCenter.select().where(LogCenter.message == 'hello world').compile()
+    # no single predicate fallback for AND/OR and parentheses outside quotes
+    with pytest.raises(SQLSyntaxError):
+        LogCenter.select().where('lineno = 1 AND message = hello world')
+    with pytest.raises(SQLSyntaxError):
+        LogCenter.select().where('(message = hello world)')
+    assert LogCenter.select().where("lineno > :min_line").prepare().params == ('min_line',)
+
+
+def test_approximate_aggs():
+    stmt = parse_select("SELECT count(DISTINCT message), distinct(lineno, 3000), percentiles(lineno, 50, 99.9) "
+                        "FROM lala GROUP BY ok")
+    assert stmt.fields == (Aggregate(OP.OP_CARDINALITY, 'message'),
+                           Aggregate(OP.OP_CARDINALITY, 'lineno', (('precision_threshold', 3000),)),
+                           Aggregate(OP.OP_PERCENTILES, 'lineno', (('percents', (50.0, 99.9)),)))
+    for bad in ("SELECT max(lineno, 3) FROM lala", "SELECT sum(DISTINCT lineno) FROM lala"):
+        with pytest.raises(SQLSyntaxError):
+            parse_select(bad)
+
+    expected = LogCenter.select(distinct('message'), distinct(LogCenter.lineno, precision_threshold=3000),
+                                percentiles(LogCenter.lineno, 50, 99.9)).group_by('ok')
+    sql = SelectSQL.from_sql("SELECT count(DISTINCT message), distinct(lineno, 3000), percentiles(lineno, 50, 99.9) "
+                             "FROM lala GROUP BY ok", LogCenter)
+    assert sql.compile() == expected.compile()
+    # fields given as text go through the same aggregation builder
+    assert LogCenter.select('count(distinct message)', 'distinct(lineno, 3000)', 'percentiles(lineno, 50, 99.9)') \
+        .group_by('ok').compile() == expected.compile()
+    assert expected.compile()['aggs']['group_by_ok']['aggs'] == {
+        'cardinality_message': {'cardinality': {'field': 'message'}},
+        'cardinality_lineno': {'cardinality': {'field': 'lineno', 'precision_threshold': 3000}},
+        'percentiles_lineno': {'percentiles': {'field': 'lineno', 'percents': [50.0, 99.9]}},
+    }
+    assert LogCenter.select(percentiles('lineno', 95, compression=200)).compile()['aggs'] == {
+        'percentiles_lineno': {'percentiles': {'field': 'lineno', 'percents': [95.0], 'tdigest': {'compression': 200.0}}},
+    }
+    assert LogCenter.select('percentile(lineno, 95)').compile()['aggs'] == {
+        'percentiles_lineno': {'percentiles': {'field': 'lineno', 'percents': [95.0]}},
+    }
+    # options are part of the compiled plan key
+    assert LogCenter.select(distinct('lineno', 100)).compile() != LogCenter.select(distinct('lineno', 200)).compile()
+
+
+def test_date_trunc():
+    stmt = parse_select("SELECT max(lineno) FROM lala GROUP BY date_trunc('1h', timestamp), ok")
+    assert stmt.group_by == (DateTrunc('1h', 'timestamp'), 'ok')
+    sql = SelectSQL.from_sql("SELECT max(lineno) FROM lala GROUP BY DATE_TRUNC(day, timestamp), ok", LogCenter)
+    assert sql.compile() == LogCenter.select('max(lineno)').group_by(date_trunc('1d', LogCenter.timestamp), 'ok') \
+        .compile()
+    with pytest.raises(SQLSyntaxError):
+        SelectSQL.from_sql("SELECT * FROM lala GROUP BY date_trunc('3M', timestamp)")
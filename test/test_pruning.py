@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 00:40
+# @Author  : floatsliang
+# @File    : test_pruning.py
+import json
+from datetime import datetime
+
+import pytest
+
+from sqlorm4es.field import Integer, Text, Date, Param
+from sqlorm4es.model import BaseModel
+from sqlorm4es.pruning import IndexPattern, routing_of
+
+
+class LogCenter(BaseModel):
+    __index_pattern__ = 'logs-{:%Y.%m.%d}'
+
+    lineno = Integer()
+    message = Text()
+    timestamp = Date(name='@timestamp')
+
+
+class TenantLog(BaseModel):
+    __index__ = 'tenant-logs'
+    __routing__ = 'tenant'
+
+    tenant = Text(name='tenant_id')
+    lineno = Integer()
+
+
+def last_search(conn):
+    """
+    search kwargs of last request without its body
+    """
+    return {k: v for k, v in conn.requests[-1].items() if k != 'body'}
+
+
+def test_index_pattern():
+    pattern = IndexPattern('logs-{:%Y.%m.%d}')
+    assert pattern.wildcard == 'logs-*'
+    assert pattern.index_of('2026-10-18T07:30:00+0800') == 'logs-2026.10.17'
+    assert pattern.index_of(1792281600000) == 'logs-2026.10.18'
+    assert pattern.indices('2026-10-17T23:00:00Z', '2026-10-19T00:00:00Z') == [
+        'logs-2026.10.17', 'logs-2026.10.18', 'logs-2026.10.19']
+    assert pattern.indices('2026-10-17T23:00:00Z', None) == ['logs-*']
+    assert pattern.indices('2020-01-01', '2026-01-01') == ['logs-*']
+
+    monthly = IndexPattern('logs-{:%Y.%m}', granularity='month')
+    assert monthly.indices('2026-10-31T12:00:00Z', '2027-01-01T00:00:00Z') == [
+        'logs-2026.10', 'logs-2026.11', 'logs-2026.12', 'logs-2027.01']
+    hourly = IndexPattern('logs-{:%Y.%m.%d.%H}', granularity='hour')
+    assert len(hourly.indices('now-3h', 'now')) in (4, 5)
+    with pytest.raises(ValueError):
+        IndexPattern('logs-{:%Y}', granularity='minute')
+
+
+def test_prune_where():
+    assert LogCenter._meta.index == 'logs-*'
+    assert LogCenter._meta.index_pattern.time_field == '@timestamp'
+    pattern = LogCenter._meta.index_pattern
+
+    sql = LogCenter.select().where(LogCenter.timestamp >= '2026-10-17T00:00:00Z',
+                                   LogCenter.timestamp < '2026-10-18T12:00:00Z',
+                                   LogCenter.lineno > 1)
+    assert pattern.prune(sql.compile()) == 'logs-2026.10.17,logs-2026.10.18'
+    # upper bound from another AND clause, OR clause does not bound
+    sql = LogCenter.select().where((LogCenter.timestamp > '2026-10-18T08:00:00+0800') &
+                                   ((LogCenter.message == 'a') | (LogCenter.lineno > 3)) &
+                                   (LogCenter.timestamp <= '2026-10-18T23:00:00+0800'))
+    assert pattern.prune(sql.compile()) == 'logs-2026.10.18'
+    sql = LogCenter.select().where((LogCenter.timestamp >= '2026-10-17') | (LogCenter.message == 'a'))
+    assert pattern.prune(sql.compile()) == 'logs-*'
+    assert pattern.prune(LogCenter.select().where(LogCenter.timestamp >= '2026-10-17').compile()) == 'logs-*'
+    assert pattern.prune(LogCenter.select().compile()) == 'logs-*'
+
+
+def test_pruned_search(conn):
+    sql = LogCenter.select().where(LogCenter.timestamp >= '2026-10-17T00:00:00Z',
+                                   LogCenter.timestamp < '2026-10-18T12:00:00Z')
+    sql.execute()
+    assert last_search(conn) == {'index': 'logs-2026.10.17,logs-2026.10.18', 'ignore_unavailable': True}
+    list(sql.stream())
+    assert conn.requests[-1]['index'] == 'logs-2026.10.17,logs-2026.10.18'
+    LogCenter.select().where(LogCenter.lineno > 1).execute()
+    assert last_search(conn) == {'index': 'logs-*'}
+    # explicit index is searched as it is
+    sql.clone().index('logs-2026.10.01').execute()
+    assert last_search(conn) == {'index': 'logs-2026.10.01'}
+
+    prepared = LogCenter.select().where(LogCenter.timestamp >= Param('start'),
+                                        LogCenter.timestamp < '2026-10-19T00:00:00Z').prepare()
+    prepared.execute(start='2026-10-18T00:00:00Z')
+    assert conn.requests[-1]['index'] == 'logs-2026.10.18'
+
+
+def test_insert_routed_by_time(conn):
+    LogCenter.insert({'lineno': 1, 'timestamp': datetime(2026, 10, 17, 23, 30)},
+                     {'lineno': 2, 'timestamp': '2026-10-18T09:00:00+0800'}).execute()
+    request = conn.requests[-1]
+    assert request['index'] is None
+    metas = [json.loads(line) for line in request['body'].splitlines()[::2]]
+    assert metas == [{'index': {'_index': 'logs-2026.10.17'}}, {'index': {'_index': 'logs-2026.10.18'}}]
+
+    # document without time field has no index to go to, it fails alone
+    res = LogCenter.insert({'lineno': 3}, {'lineno': 4, 'timestamp': '2026-10-18T01:00:00Z'}).execute()
+    assert (res['success'], res['failed']) == (1, 1)
+    assert res['errors'][0]['index']['error']['type'] == 'validation_exception'
+    assert len(conn.requests[-1]['body'].splitlines()) == 2
+
+
+def test_routing_of_where():
+    assert TenantLog._meta.routing == 'tenant_id'
+    compiled = TenantLog.select().where(TenantLog.tenant == 'a', TenantLog.lineno > 1).compile()
+    assert routing_of(compiled, 'tenant_id') == 'a'
+    compiled = TenantLog.select().where((TenantLog.tenant == 'a') | (TenantLog.tenant == 'b')).compile()
+    assert routing_of(compiled, 'tenant_id') == 'a,b'
+    compiled = TenantLog.select().where(TenantLog.tenant >> ['a', 'b', 'c'], TenantLog.tenant >> ['c', 'b']).compile()
+    assert routing_of(compiled, 'tenant_id') == 'b,c'
+    compiled = TenantLog.select().where((TenantLog.tenant == 'a') | (TenantLog.lineno > 1)).compile()
+    assert routing_of(compiled, 'tenant_id') is None
+    assert routing_of(TenantLog.select().where(TenantLog.lineno == 1).compile(), 'tenant_id') is None
+
+
+def test_routed_search_and_insert(conn):
+    TenantLog.select().where(TenantLog.tenant == 'a').execute()
+    assert last_search(conn) == {'index': 'tenant-logs', 'routing': 'a'}
+    list(TenantLog.select().where('tenant_id IN (a, b)').stream())
+    assert conn.requests[-1]['routing'] == 'a,b'
+    TenantLog.select().where(TenantLog.lineno > 1).execute()
+    assert last_search(conn) == {'index': 'tenant-logs'}
+    prepared = TenantLog.select().where(TenantLog.tenant == Param('tenant')).prepare()
+    prepared.execute(tenant='b')
+    assert last_search(conn) == {'index': 'tenant-logs', 'routing': 'b'}
+
+    TenantLog.insert({'tenant': 'a', 'lineno': 1}, {'lineno': 2}).execute()
+    request = conn.requests[-1]
+    assert request['index'] == 'tenant-logs'
+    metas = [json.loads(line) for line in request['body'].splitlines()[::2]]
+    assert metas == [{'index': {'routing': 'a'}}, {'index': {}}]
@@ -2,7 +2,10 @@
 # @Time    : 2019/10/9 20:48
 # @Author  : floatsliang
 # @File    : test_query.py
+from threading import Thread
+
 from sqlorm4es.query import *
+from sqlorm4es.query import Base
 
 query = {
     "query": {
@@ -78,3 +81,35 @@ def test_construct_query():
         .range(field='tt', go_to='must_not', order='desc')
 
 
+def test_dispatch_table():
+    assert 'with_value' in Term._func_dict and 'with_query' not in Term._func_dict
+    assert Dsl._dispatch_table(5.1) is Dsl._dispatch_table(5.1)
+    assert Dsl._func_dict is not Bool._func_dict is not Base._func_dict
+
+    class Banned(Dsl):
+        _NOT_ALLOWED_6X = {'explain', }
+
+    allowed = Banned(version=6.2)
+    assert allowed.explain() is allowed
+    banned = Banned(version=5.6)
+    assert banned.explain() is None and banned.with_explain() is None and 'explain' not in banned
+    assert allowed['explain'] == 'true'
+
+
+def test_concurrent_construct():
+    errors = []
+
+    def construct(n):
+        for i in range(500):
+            value = '{}-{}'.format(n, i)
+            term = Q('term', field='f', value=value)
+            match = Q('match', field='f', query=value, operator='and')
+            if term['term']['f'] != {'value': value} or match['match']['f'] != {'query': value, 'operator': 'and'}:
+                errors.append(value)
+
+    threads = [Thread(target=construct, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 11:05
+# @Author  : floatsliang
+# @File    : test_sql.py
+import json
+
+import pytest
+
+from sqlorm4es.field import *
+from sqlorm4es.model import BaseModel
+
+
+class LogCenter(BaseModel):
+    __index__ = 'lala'
+    __database__ = {
+        "host": "122.23.2.23"
+    }
+
+    ok = Boolean(default=True)
+    lineno = Integer(required=True)
+    message = Text(default='xixi')
+    timestamp = Date(timezone="+8")
+
+
+def test_prepared_select(conn):
+    stmt = LogCenter.select(LogCenter.lineno) \
+        .where((LogCenter.lineno > Param('min_line')) & (LogCenter.message == 'error') &
+               (LogCenter.ok >> Param('ok'))) \
+        .limit(10) \
+        .prepare()
+    assert stmt.params == ('min_line', 'ok')
+
+    for min_line, ok in ((5, ['true']), ('12', 'false; true')):
+        expected = LogCenter.select(LogCenter.lineno) \
+            .where((LogCenter.lineno > min_line) & (LogCenter.message == 'error') & (LogCenter.ok >> ok)) \
+            .limit(10) \
+            .compile()
+        assert stmt.compile(min_line=min_line, ok=ok) == expected
+
+    assert json.loads(stmt.compile_bytes(min_line=5, ok=True)) == stmt.compile(min_line=5, ok=True)
+    stmt.execute(min_line=5, ok=[True])
+    assert conn.requests[-1]['index'] == 'lala'
+    assert json.loads(conn.requests[-1]['body'])['query']['bool']['filter']['bool']['must'][0] == \
+        {'range': {'lineno': {'gt': '5'}}}
+
+    with pytest.raises(ValueError):
+        stmt.compile(min_line='abc', ok=True)
+    with pytest.raises(ValueError):
+        stmt.compile(min_line=5)
+    with pytest.raises(ValueError):
+        stmt.compile(min_line=5, ok=True, max_line=10)
+
+
+def test_compile_bytes(conn):
+    for lineno in (10, 0, 20):
+        sql = LogCenter.select(LogCenter.ok).where((LogCenter.lineno > lineno) & (LogCenter.message == 'a"b')) \
+            .order_by((LogCenter.lineno, 'desc'))
+        body = sql.compile(format='bytes')
+        assert isinstance(body, bytes)
+        assert json.loads(body) == sql.compile()
+        sql.execute()
+        assert conn.requests[-1]['body'] == body
+
+
+def test_compile_bytes_zero_range(conn):
+    # bounds merged into one range, zero bound kept in cached plan
+    for _ in range(2):
+        sql = LogCenter.select().where(LogCenter.lineno >= 0, LogCenter.lineno < 100)
+        body = sql.compile(format='bytes')
+        assert json.loads(body)['query']['bool']['filter']['bool']['must'] == [
+            {'range': {'lineno': {'gte': '0', 'lt': '100'}}}]
+        sql.execute()
+        assert conn.requests[-1]['body'] == body
+    assert LogCenter.select().where(LogCenter.lineno > 0).compile()['query']['bool']['filter']['bool']['must'] == [
+        {'range': {'lineno': {'gt': '0'}}}]
+
+
+def test_insert(conn):
+    rows = [{'lineno': i, 'message': 'conflict' if i == 3 else 'm{}'.format(i), '_id': i} for i in range(10)]
+    sql = LogCenter.insert(rows[0], (row for row in rows[1:5]), {'message': 'no lineno'}, *rows[5:]) \
+        .upsert(False) \
+        .chunk(size=4)
+    results = list(sql.execute_iter())
+    assert [len(req['body'].splitlines()) for req in conn.requests] == [8, 8, 4]
+    assert [ok for ok, _ in results] == [True] * 3 + [False, True, False] + [True] * 5
+    assert [item['create'].get('_id') for _, item in results] == [0, 1, 2, 3, 4, None, 5, 6, 7, 8, 9]
+    assert results[5][1]['create']['status'] == 400
+    assert json.loads(conn.requests[0]['body'].splitlines()[1]) == \
+        {'ok': 'true', 'lineno': 0, 'message': 'm0'}
+
+    del conn.requests[:]
+    body_bytes = len(next(LogCenter.insert(rows[0]).compile()))
+    res = LogCenter.insert(*rows).chunk(max_bytes=body_bytes * 3).execute()
+    assert (res['success'], res['failed']) == (9, 1)
+    assert res['errors'][0]['index']['_id'] == 3
+    assert all(len(req['body']) <= body_bytes * 3 for req in conn.requests)
+    assert sum(len(req['body'].splitlines()) for req in conn.requests) == 20
+    assert len(conn.requests) == 4
+
+    with pytest.raises(ValueError):
+        LogCenter.insert({'lineno': 'abc'})._validate_row({'lineno': 'abc'})
+    with pytest.raises(ValueError):
+        LogCenter.insert()._validate_row({'lineno': 1, 'unknown': 1})
+
+
+def test_save(conn):
+    log = LogCenter(lineno=7, message='save')
+    assert log.save()['status'] == 201
+    assert conn.requests[-1]['index'] == 'lala'
+    assert log._data['_id'] == '1'
+    log.save()
+    assert json.loads(conn.requests[-1]['body'].splitlines()[0]) == {'index': {'_id': '1'}}
+    with pytest.raises(Exception):
+        LogCenter(lineno=7, message='conflict').save()
+
+
+def test_insert_renamed_field(conn):
+    class AccessLog(BaseModel):
+        __index__ = 'access'
+
+        status = Integer(name='http_status', required=True)
+        message = Text(name='msg', default='-')
+
+    AccessLog.insert({'status': 200}, {'http_status': '404', 'msg': 'missing'}, {'msg': 'no status'}).execute()
+    lines = conn.requests[-1]['body'].splitlines()
+    assert [json.loads(line) for line in lines[1::2]] == [
+        {'msg': '-', 'http_status': 200}, {'msg': 'missing', 'http_status': 404}]
+
+    log = AccessLog(status=500)
+    assert log.save()['status'] == 201
+    assert json.loads(conn.requests[-1]['body'].splitlines()[1]) == {'msg': '-', 'http_status': 500}
+    with pytest.raises(ValueError, match='http_status'):
+        AccessLog.insert()._validate_row({'msg': 'x'})
+
+
+class PagingConnection(object):
+    """
+    serve docs sorted by lineno and _id page by page with search_after
+    """
+
+    def __init__(self, docs, fail_at=None):
+        self.docs = sorted(docs, key=lambda doc: (doc['lineno'], doc['_id']))
+        self.requests = []
+        self.fail_at = fail_at
+
+    def search(self, index=None, body=None, **kwargs):
+        self.requests.append(json.loads(json.dumps(body)))
+        if len(self.requests) == self.fail_at:
+            raise ConnectionError('connection reset')
+        docs = self.docs
+        if 'search_after' in body:
+            docs = [doc for doc in docs if [doc['lineno'], doc['_id']] > body['search_after']]
+        docs = docs[body.get('from', 0):body.get('from', 0) + body['size']]
+        return {'hits': {'total': len(self.docs), 'hits': [
+            {'_id': doc['_id'], '_source': {'lineno': doc['lineno']}, 'sort': [doc['lineno'], doc['_id']]}
+            for doc in docs]}}
+
+
+def test_stream(use_connection):
+    docs = [{'_id': 'id{:02d}'.format(i), 'lineno': i // 3} for i in range(25)]
+    paging = PagingConnection(docs)
+    use_connection(paging)
+    sql = LogCenter.select(LogCenter.lineno).order_by((LogCenter.lineno, 'asc')).limit(4)
+    assert [doc['_id'] for doc in sql.stream()] == [doc['_id'] for doc in paging.docs]
+    assert len(paging.requests) == 7
+    assert paging.requests[0]['sort'] == [{'lineno': {'order': 'asc'}}, {'_id': {'order': 'asc'}}]
+    assert paging.requests[1]['search_after'] == [1, 'id03']
+    assert sql._data['order_by'] == {'lineno': 'asc'}
+
+    paging.requests = []
+    pages = list(sql.offset(20).paginate())
+    assert [page['meta']['count'] for page in pages] == [4, 1]
+    assert 'from' not in paging.requests[1]
+
+    paging.requests = []
+    stream = LogCenter.select().limit(5).stream(prefetch=1)
+    assert next(stream)['_id'] == 'id00'
+    stream.close()
+    assert len(paging.requests) <= 3
+
+    # nothing is fetched ahead without prefetch
+    paging.requests = []
+    stream = LogCenter.select().limit(5).stream(prefetch=0)
+    assert next(stream)['_id'] == 'id00'
+    assert len(paging.requests) == 1
+    stream.close()
+    assert len(paging.requests) == 1
+
+    use_connection(PagingConnection(docs, fail_at=3))
+    with pytest.raises(ConnectionError):
+        list(LogCenter.select().limit(5).stream())
+
+
+def test_paginate_without_sort(conn):
+    conn._responses = [{'hits': {'total': 1, 'hits': [{'_id': '1', '_source': {'lineno': 1}}] * 10}}]
+    pages = list(LogCenter.select().limit(10).paginate())
+    assert len(pages) == 1 and pages[0]['meta']['count'] == 10
+    assert len(conn.requests) == 1
+
+
+class SlicedConnection(object):
+    """
+    serve docs of each slice (doc number % max == slice id) with scroll or point in time
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.requests = []
+        self.scrolls = {}
+        self.cleared = []
+        self.transport = self
+
+    def _slice_hits(self, body, start):
+        slice_id, slices = body.get('slice', {}).get('id', 0), body.get('slice', {}).get('max', 1)
+        docs = [i for i in range(self.total) if i % slices == slice_id and i >= start]
+        return [{'_id': str(i), '_source': {'lineno': i}, 'sort': [i]} for i in docs[:body['size']]]
+
+    def search(self, index=None, body=None, scroll=None, **kwargs):
+        self.requests.append(('search', body))
+        hits = self._slice_hits(body, 0)
+        scroll_id = 'scroll-{}'.format(body.get('slice', {}).get('id', 0))
+        self.scrolls[scroll_id] = (body, hits[-1]['sort'][0] + 1 if hits else 0)
+        return {'_scroll_id': scroll_id, 'hits': {'hits': hits}}
+
+    def scroll(self, scroll_id=None, scroll=None):
+        body, start = self.scrolls[scroll_id]
+        hits = self._slice_hits(body, start)
+        self.scrolls[scroll_id] = (body, hits[-1]['sort'][0] + 1 if hits else start)
+        return {'_scroll_id': scroll_id, 'hits': {'hits': hits}}
+
+    def clear_scroll(self, scroll_id=None, **kwargs):
+        self.cleared.append(scroll_id)
+
+    def perform_request(self, method, url, params=None, body=None):
+        self.requests.append((url, body))
+        if url.endswith('/_pit'):
+            return {'id': 'pit'} if method == 'POST' else {}
+        start = body['search_after'][0] + 1 if 'search_after' in body else 0
+        return {'pit_id': 'pit', 'hits': {'hits': self._slice_hits(body, start)}}
+
+
+def test_export(use_connection):
+    sliced = SlicedConnection(103)
+    use_connection(sliced)
+    sql = LogCenter.select(LogCenter.lineno).where(LogCenter.lineno > 0).limit(10)
+    query = sql.compile()
+
+    docs = list(sql.export(slices=4))
+    assert sorted(int(doc['_id']) for doc in docs) == list(range(103))
+    assert sorted(sliced.cleared) == ['scroll-0', 'scroll-1', 'scroll-2', 'scroll-3']
+    first = [body for kind, body in sliced.requests if kind == 'search']
+    assert sorted(body['slice']['id'] for body in first) == [0, 1, 2, 3]
+    assert all(dict(body, slice=None, sort=None) == dict(query, slice=None, sort=None) for body in first)
+    assert first[0]['sort'] == ['_doc']
+    assert sql.compile() == query
+
+    received = [[], []]
+    assert sql.export(slices=2, sinks=[received[0].append, received[1].append]) == [52, 51]
+    assert all(int(doc['_id']) % 2 == i for i in range(2) for doc in received[i])
+
+    sliced.requests = []
+    docs = list(sql.export(slices=3, use_pit=True))
+    assert sorted(int(doc['_id']) for doc in docs) == list(range(103))
+    assert sliced.requests[0] == ('/lala/_pit', None)
+    assert sliced.requests[-1] == ('/_pit', {'id': 'pit'})
+    assert all(body['pit']['id'] == 'pit' and body['sort'] == ['_shard_doc']
+               for url, body in sliced.requests[1:-1])
+
+    with pytest.raises(ValueError):
+        sql.export(slices=2, sinks=[print])
+
+
+def test_iter_groups(conn):
+    keys = [{'ok': ok, 'lineno': i} for ok in (False, True) for i in range(5)]
+
+    def page(start, size):
+        buckets = [{'key': key, 'doc_count': 2, 'max_lineno': {'value': key['lineno']}}
+                   for key in keys[start:start + size]]
+        aggs = {'buckets': buckets}
+        if buckets:
+            aggs['after_key'] = buckets[-1]['key']
+        return {'hits': {'total': 20, 'hits': []}, 'aggregations': {'group_by_composite': aggs}}
+
+    conn._responses = [page(0, 4), page(4, 4), page(8, 4)]
+    sql = LogCenter.select('max(lineno)').where(LogCenter.lineno > 1).group_by('ok', 'lineno').order_by(('ok', 'desc'))
+    assert 'group_by_ok' in sql.compile()['aggs']
+    groups = list(sql.iter_groups(size=4))
+    assert groups[0] == {'ok': False, 'lineno': 0, 'doc_count': 2, 'max_lineno': 0}
+    assert [(g['ok'], g['lineno']) for g in groups] == [(k['ok'], k['lineno']) for k in keys]
+    bodies = [request['body'] for request in conn.requests]
+    assert len(bodies) == 3 and all(body['size'] == 0 for body in bodies)
+    composite = bodies[0]['aggs']['group_by_composite']
+    assert composite['composite']['sources'] == [{'ok': {'terms': {'field': 'ok', 'order': 'desc'}}},
+                                                 {'lineno': {'terms': {'field': 'lineno'}}}]
+    assert composite['aggs'] == {'max_lineno': {'max': {'field': 'lineno'}}}
+    assert bodies[2]['aggs']['group_by_composite']['composite']['after'] == keys[7]
+    # sql itself keeps nested terms
+    assert 'group_by_ok' in sql.compile()['aggs']
+
+    with pytest.raises(ValueError):
+        next(LogCenter.select().iter_groups())
+
+
+def test_date_trunc_group_by():
+    from datetime import datetime
+    sql = LogCenter.select('max(lineno)') \
+        .group_by(date_trunc('hour', LogCenter.timestamp, min_doc_count=0,
+                             extended_bounds=(datetime(2026, 10, 18), 'now')), 'ok') \
+        .order_by(('timestamp', 'desc'))
+    aggs = sql.compile()['aggs']
+    assert aggs['group_by_timestamp']['date_histogram'] == {
+        'field': 'timestamp', 'interval': '1h', 'min_doc_count': 0, 'order': {'_key': 'desc'},
+        'extended_bounds': {'min': '2026-10-18T00:00:00.000000', 'max': 'now'}}
+    assert aggs['group_by_timestamp']['aggs']['group_by_ok']['aggs'] == {'max_lineno': {'max': {'field': 'lineno'}}}
+
+    source = sql.clone().composite(100).compile()['aggs']['group_by_composite']['composite']['sources'][0]
+    assert source == {'timestamp': {'date_histogram': {'field': 'timestamp', 'interval': '1h',
+                                                       'order': 'desc'}}}
+    # es 7.2+ takes calendar_interval, compiled plan differs by version
+    modern = sql.clone().database({'hosts': ['127.0.0.1:9201'], 'es_version': '7.10'}).compile()['aggs']
+    assert modern['group_by_timestamp']['date_histogram']['calendar_interval'] == '1h'
+    assert 'interval' not in modern['group_by_timestamp']['date_histogram']
+    # time zone of Date field
+    histogram = LogCenter.select().group_by(date_trunc('1h', Date(name='@timestamp'))).compile()['aggs']
+    assert histogram['group_by_@timestamp']['date_histogram']['time_zone'] == '+08:00'
+
+    fixed = LogCenter.select().group_by(date_trunc('90m', 'timestamp', time_zone='Europe/Paris')) \
+        .database({'hosts': ['127.0.0.1:9201'], 'es_version': 7.2}).compile()
+    assert fixed['aggs']['group_by_timestamp']['date_histogram'] == {
+        'field': 'timestamp', 'fixed_interval': '90m', 'time_zone': 'Europe/Paris'}
+    # field given by text takes time zone of model field
+    assert LogCenter.select().group_by("date_trunc('1h', timestamp)").compile() == \
+        LogCenter.select().group_by(date_trunc('1h', LogCenter.timestamp)).compile()
+    # interval is part of the compiled plan key
+    assert LogCenter.select().group_by(date_trunc('1d', LogCenter.timestamp)).compile() != \
+        LogCenter.select().group_by(date_trunc('1h', LogCenter.timestamp)).compile()
+    for bad in ('2w', '1x', 'fortnight'):
+        with pytest.raises(ValueError):
+            date_trunc(bad, LogCenter.timestamp)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 22:40
+# @Author  : floatsliang
+# @File    : test_utils.py
+import json
+from copy import deepcopy
+
+from sqlorm4es.utils import SearchResult, DocumentList, Document, json_dumps, json_loads
+
+
+def make_response(count):
+    return {'took': 1, 'hits': {'total': count, 'hits': [
+        {'_id': str(i), '_source': {'lineno': i, 'tags': ['a']}} for i in range(count)]}}
+
+
+def test_lazy_search_result():
+    raw = make_response(5)
+    raw['hits']['hits'].append({'_id': 'empty', '_source': {}})
+    origin = deepcopy(raw)
+    res = SearchResult(raw)
+    assert res.raw is raw
+    assert res['meta'] == {'count': 5, 'status': 200, 'error': 'ok'}
+    assert res['data'].lazy == 5
+
+    assert res['data'][1] == {'lineno': 1, 'tags': ['a'], '_id': '1'}
+    assert res['data'][-1]['_id'] == '4'
+    # reading documents does not copy their _source
+    assert res['data'].lazy == 5
+    assert res['data'][1] is res['data'][1]
+    assert [doc['_id'] for doc in res['data'][:2]] == ['0', '1']
+    assert raw == origin
+
+    res['data'][0]['lineno'] = 100
+    assert raw['hits']['hits'][0]['_source']['lineno'] == 0
+    assert res['data'].lazy == 4
+    assert json.loads(json.dumps(res))['data'][0]['lineno'] == 100
+    assert res == {'data': [dict(doc) for doc in res['data']], 'meta': res['meta']}
+
+
+def test_document_view():
+    raw = make_response(2)
+    res = SearchResult(raw)
+    doc = res['data'][1]
+    assert isinstance(doc, Document) and doc.source is raw['hits']['hits'][1]['_source']
+    assert list(doc) == ['lineno', 'tags', '_id'] and len(doc) == 3
+    assert '_id' in doc and doc.get('missing') is None and doc.get('lineno') == 1
+    doc['lineno'] = 10
+    del doc['tags']
+    assert doc == {'lineno': 10, '_id': '1'} and raw['hits']['hits'][1]['_source'] == {'lineno': 1, 'tags': ['a']}
+    # documents are encoded as plain dicts by both json paths
+    expected = {'data': [{'lineno': 0, 'tags': ['a'], '_id': '0'}, {'lineno': 10, '_id': '1'}], 'meta': res['meta']}
+    assert json_loads(json_dumps(res)) == expected == json.loads(json.dumps(res))
+    assert json_loads(json_dumps(res['data'])) == expected['data']
+
+
+def test_json_documents():
+    res = SearchResult(make_response(2))
+    docs, doc = res['data'], res['data'][0]
+    assert isinstance(doc, dict) and isinstance(docs, list)
+    assert json.loads(json.dumps(doc)) == {'lineno': 0, 'tags': ['a'], '_id': '0'}
+    assert json.loads(json.dumps(doc, indent=2)) == json.loads(json.dumps(doc))
+    assert json.loads(json.dumps(docs)) == [{'lineno': 0, 'tags': ['a'], '_id': '0'},
+                                            {'lineno': 1, 'tags': ['a'], '_id': '1'}]
+    assert json_loads(json_dumps(doc)) == json.loads(json.dumps(doc))
+    assert dict(doc) == {**doc} == deepcopy(doc) == doc.copy()
+    assert not doc != {'lineno': 0, 'tags': ['a'], '_id': '0'}
+    doc.pop('tags')
+    assert json.loads(json.dumps(docs))[0] == {'lineno': 0, '_id': '0'}
+
+
+def test_search_result_compat():
+    res = SearchResult(make_response(2))
+    res += SearchResult(make_response(3))
+    assert res['meta']['count'] == 5
+    assert [doc['_id'] for doc in res['data']] == ['0', '1', '0', '1', '2']
+    total = SearchResult(make_response(1)) + res
+    assert total['meta']['count'] == 6
+    # documents are shared, not copied
+    assert total['data'][1] is res['data'][0]
+
+    docs = res['data']
+    docs.append({'_id': 'x'})
+    docs[0] = {'_id': 'y'}
+    del docs[1]
+    assert [doc['_id'] for doc in docs] == ['y', '0', '1', '2', 'x']
+    assert docs + [{'_id': 'z'}] == list(docs) + [{'_id': 'z'}]
+    assert DocumentList([{'a': 1}]) == [{'a': 1}]
+
+    error = SearchResult({'error': {'reason': 'boom'}, 'status': 500})
+    assert error['meta'] == {'count': 0, 'status': 500, 'error': 'boom'}
+    assert SearchResult(res) == res
+
+
+def test_search_result_concat():
+    pages = [SearchResult(make_response(3)) for _ in range(2000)]
+    total = SearchResult()
+    for page in pages:
+        total += page
+    assert len(total['data']) == total['meta']['count'] == 6000
+    assert total['data'].lazy == 6000
+    assert total['data'][4]['lineno'] == 1 and total['data'][-1]['_id'] == '2'
+    assert [doc['lineno'] for doc in total['data'][2:5]] == [2, 0, 1]
+    assert [doc['lineno'] for doc in total['data'][-4::2]] == [2, 1]
+    assert sum(1 for _ in total['data']) == 6000
+    assert total['data'].lazy == 6000
+    assert total['data'][3] is pages[1]['data'][0]
+
+    # operands are not changed by the sum, nor by modifying it
+    left = SearchResult(make_response(2))
+    right = SearchResult(make_response(2))
+    both = left + right
+    both += right
+    docs = both.materialize()
+    assert isinstance(docs, list) and len(docs) == 6
+    both['data'].append({'_id': 'x'})
+    left['data'][0] = {'_id': 'y'}
+    assert len(left['data']) == len(right['data']) == 2
+    assert [doc['_id'] for doc in both['data']] == ['0', '1', '0', '1', '0', '1', 'x']
+    assert [doc['_id'] for doc in left['data'] + [{'_id': 'z'}]] == ['y', '1', 'z']
+    assert [doc['_id'] for doc in [{'_id': 'z'}] + right['data']] == ['z', '0', '1']
+
+    # list handed out by materialize() is not shared with later sums
+    docs = left.materialize()
+    summed = left + right
+    docs.append({'_id': 'w'})
+    assert len(summed['data']) == 4 and len(list(summed['data'])) == 4
+    assert summed['data'][2]['_id'] == '0'
+    assert [doc['_id'] for doc in left['data']] == ['y', '1', 'w']